@@ -3,13 +3,100 @@ from flask.app import Flask
 from sqlalchemy import create_engine
 from flask_cors import CORS
 
-from model import UserDao, TweetDao
-from service import UserService, TweetService
-from view import create_endpoints
+from model import (UserDao, TweetDao, InMemoryTimelineStore, TableTimelineStore,
+                   MemoryStore, MemoryUserDao, MemoryTweetDao)
+from model.database import DEFAULT_REDACT, PoolStats, QueryStats, ReplicaRouter, engine_options
+from service import UserService, TweetService, PasswordHasher, TweetBuffer, Thumbnailer
+from view import AdmissionController, Compressor, RequestMetrics, create_endpoints
 
 class Services:
     pass
 
+###################################
+# Storage Backend
+###################################
+
+## The database engine, None with STORAGE_BACKEND = 'memory'
+def create_database(app, query_stats, metrics):
+    backend = app.config.get('STORAGE_BACKEND', 'database')
+    
+    if backend == 'memory':
+        return None
+    if backend != 'database':
+        raise ValueError(f'Unknown STORAGE_BACKEND: {backend}')
+    
+    pool_stats = PoolStats()
+    database = create_engine(app.config['DB_URL'], encoding='utf-8',
+                             **engine_options(app.config, app.config['DB_URL'], pool_stats))
+    app.extensions['pool_stats'] = pool_stats.attach(database)
+    app.extensions['query_stats'] = query_stats.attach(database)
+    metrics.add_collector(query_stats.metrics)
+    
+    return database
+
+## Reads of the DAOs go to DB_REPLICA_URLS, when there are any, see ReplicaRouter
+def create_replica_router(app, database, query_stats):
+    replica_urls = app.config.get('DB_REPLICA_URLS') or []
+    if database is None or not replica_urls:
+        return None
+    
+    replicas = [create_engine(url, encoding='utf-8', **engine_options(app.config, url)) for url in replica_urls]
+    for replica in replicas:
+        query_stats.attach(replica)
+    
+    router = ReplicaRouter(database, replicas,
+                           app.config.get('DB_REPLICA_POLICY', 'round-robin'),
+                           app.config.get('DB_READ_YOUR_WRITES_WINDOW', 5)).attach(app)
+    app.extensions['replica_router'] = router
+    
+    return router
+
+def create_daos(app, database, router=None):
+    if database is not None:
+        return UserDao(database, router), TweetDao(database, router)
+    
+    store = app.extensions['memory_store'] = MemoryStore()
+    return MemoryUserDao(store), MemoryTweetDao(store)
+
+###################################
+# Home Timeline Store
+###################################
+
+def create_timeline_store(config, database, tweet_dao):
+    store = config.get('TIMELINE_STORE')
+    max_length = config.get('TIMELINE_MAX_LENGTH', 800)
+    
+    if store == 'memory':
+        return InMemoryTimelineStore(tweet_dao, max_length, config.get('TIMELINE_MAX_USERS', 10000))
+    if store == 'table':
+        if database is None:
+            raise ValueError("TIMELINE_STORE 'table' needs STORAGE_BACKEND 'database'")
+        return TableTimelineStore(database, tweet_dao, max_length)
+    if store is None:
+        return None
+    
+    raise ValueError(f'Unknown TIMELINE_STORE: {store}')
+
+###################################
+# Write-behind Tweet Buffer
+###################################
+
+def create_tweet_buffer(app, tweet_dao):
+    if not app.config.get('TWEET_WRITE_BEHIND', False):
+        return None
+    
+    tweet_buffer = TweetBuffer(tweet_dao,
+                               app.config.get('TWEET_BUFFER_SIZE', 10000),
+                               app.config.get('TWEET_BUFFER_BATCH_SIZE', 500),
+                               app.config.get('TWEET_BUFFER_FLUSH_INTERVAL', 0.05),
+                               app.config.get('TWEET_BUFFER_PUT_TIMEOUT', 0.1),
+                               app.config.get('TWEET_BUFFER_FLUSH_ATTEMPTS', 5),
+                               app.config.get('TWEET_BUFFER_RETRY_BACKOFF', 0.1),
+                               app.config.get('TWEET_BUFFER_SPOOL')).start()
+    app.extensions['tweet_buffer'] = tweet_buffer
+    
+    return tweet_buffer
+
 ###################################
 # Create App
 ###################################
@@ -24,18 +111,40 @@ def create_app(test_config=None):
     else:
         app.config.update(test_config)
     
-    database = create_engine(app.config['DB_URL'], encoding='utf-8', max_overflow=0)
+    query_stats = QueryStats(app.config.get('SQL_SLOW_QUERY_THRESHOLD'),
+                             app.config.get('SQL_SLOW_QUERY_REDACT', DEFAULT_REDACT),
+                             app.config.get('SQL_SLOW_QUERY_LOG'))
+    
+    ## Registered first, so its after_request hook runs last and sees the response as sent
+    metrics = RequestMetrics(app.config.get('METRICS_LATENCY_BUCKETS'),
+                             query_stats,
+                             app.config.get('SQL_QUERY_COUNT_HEADER', False)).attach(app)
+    app.extensions['metrics'] = metrics
+    
+    ## Right after metrics, whose before_request hook runs first so shed requests are still counted,
+    ## and before every other hook, so a shed request costs as little as possible
+    admission = app.extensions['admission'] = AdmissionController(app.config).attach(app)
+    metrics.add_collector(admission.metrics)
+    
+    database = create_database(app, query_stats, metrics)
+    router = create_replica_router(app, database, query_stats)
     
     ## Persistence layer
-    user_dao = UserDao(database)
-    tweet_dao = TweetDao(database)
+    user_dao, tweet_dao = create_daos(app, database, router)
+    timeline_store = create_timeline_store(app.config, database, tweet_dao)
     
     ## Business Layer
+    password_hasher = PasswordHasher(app.config.get('PASSWORD_HASHER_WORKERS', 0),
+                                     app.config.get('PASSWORD_HASHER_QUEUE', 0))
+    thumbnailer = Thumbnailer(app.config.get('PROFILE_PICTURE_SIZES', (48, 96, 200)),
+                              app.config.get('THUMBNAILER_WORKERS', 2))
     services = Services
-    services.user_service = UserService(user_dao, app.config)
-    services.tweet_service = TweetService(tweet_dao)
+    services.user_service = UserService(user_dao, app.config, timeline_store, password_hasher, thumbnailer)
+    services.tweet_service = TweetService(tweet_dao, timeline_store, create_tweet_buffer(app, tweet_dao))
     
     # Create endpoints
     create_endpoints(app, services)
+    app.extensions['compressor'] = Compressor(app.config).attach(app)
+    metrics.add_collector(app.extensions['compressor'].metrics)
     
     return app
\ No newline at end of file
@@ -0,0 +1,58 @@
+from quart import Quart
+from quart_cors import cors
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from model import AsyncUserDao, AsyncTweetDao
+from model.database import DEFAULT_REDACT, PoolStats, QueryStats, engine_options
+from service import AsyncUserService, AsyncTweetService, PasswordHasher
+from view.async_endpoints import create_async_endpoints
+
+class Services:
+    pass
+
+###################################
+# Create Async App
+###################################
+
+## ASGI variant of app.create_app: the core endpoints on Quart, over an async SQLAlchemy engine.
+## ASYNC_DB_URL needs an async driver, e.g. mysql+aiomysql:// or sqlite+aiosqlite://
+def create_async_app(test_config=None):
+    app = Quart(__name__)
+    
+    app = cors(app)
+    
+    if test_config is None:
+        app.config.from_pyfile('config.py')
+    else:
+        app.config.update(test_config)
+    
+    db_url = app.config.get('ASYNC_DB_URL', app.config['DB_URL'])
+    pool_stats = PoolStats()
+    database = create_async_engine(db_url, **engine_options(app.config, db_url, pool_stats))
+    app.extensions['database'] = database
+    app.extensions['pool_stats'] = pool_stats.attach(database.sync_engine)
+    ## Statement stats and the slow-query log only: requests share a thread, so they aren't counted per request
+    app.extensions['query_stats'] = QueryStats(app.config.get('SQL_SLOW_QUERY_THRESHOLD'),
+                                               app.config.get('SQL_SLOW_QUERY_REDACT', DEFAULT_REDACT),
+                                               app.config.get('SQL_SLOW_QUERY_LOG')).attach(database.sync_engine)
+    
+    ## Persistence layer
+    user_dao = AsyncUserDao(database)
+    tweet_dao = AsyncTweetDao(database)
+    
+    ## Business Layer
+    password_hasher = PasswordHasher(app.config.get('PASSWORD_HASHER_WORKERS', 0),
+                                     app.config.get('PASSWORD_HASHER_QUEUE', 0))
+    services = Services
+    services.user_service = AsyncUserService(user_dao, app.config, password_hasher)
+    services.tweet_service = AsyncTweetService(tweet_dao)
+    
+    # Create endpoints
+    create_async_endpoints(app, services)
+    
+    @app.after_serving
+    async def close_database():
+        await database.dispose()
+        password_hasher.shutdown()
+    
+    return app
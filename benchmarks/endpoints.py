@@ -0,0 +1,348 @@
+## Endpoint benchmark suite.
+##
+##   python benchmarks/endpoints.py [--users 1000] [--follows 20] [--tweets 10]
+##                                  [--requests 500] [--password-requests 20] [--threads 1]
+##                                  [--endpoints sign-up login tweet follow timeline profile-picture]
+##                                  [--storage database|memory] [--db-url sqlite:///...] [--output results.json]
+##                                  [--baseline previous.json] [--tolerance 0.2]
+##
+## Builds the app through create_app with config.py's settings on a local SQLite
+## database (a temporary file unless --db-url is given), migrates it, seeds `--users`
+## users who each follow `--follows` others and posted `--tweets` tweets, then sends
+## `--requests` requests per endpoint (`--password-requests` for sign-up and login, which
+## spend most of their time in bcrypt) through the Flask test client from `--threads` threads. Reports throughput and p50/p99 latency per endpoint as JSON (stdout, or
+## --output), and a table on stderr.
+## --storage memory runs the app on the in-memory backend (STORAGE_BACKEND = 'memory') instead,
+## seeded with the same data, to profile the service and view layers without a database.
+## With --baseline (the JSON of an earlier run) it exits with status 1 when an endpoint's
+## throughput dropped, or its p99 grew, by more than --tolerance.
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import jwt
+import sqlalchemy
+from sqlalchemy import create_engine, text
+
+import config
+from app import create_app
+from model.schema import migrate
+from model import MemoryTweetDao, MemoryUserDao
+from service import PasswordHasher
+
+ENDPOINTS = ('sign-up', 'login', 'tweet', 'follow', 'timeline', 'profile-picture')
+PASSWORD_ENDPOINTS = ('sign-up', 'login')
+PASSWORD = 'benchmark-password'
+PICTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_pictures', 'default-owl.png')
+
+
+########################################################################
+#           Dataset
+########################################################################
+def seed(database, users, follows, tweets, seed=0):
+    rand = random.Random(seed)
+    hashed_password = PasswordHasher().hash(PASSWORD)
+
+    with database.begin() as connection:
+        connection.execute(text("""
+                INSERT INTO users (
+                    id,
+                    name,
+                    email,
+                    hashed_password,
+                    profile
+                ) VALUES (
+                    :id,
+                    :name,
+                    :email,
+                    :hashed_password,
+                    :profile
+                )
+            """), [{
+                'id': user_id,
+                'name': f'user{user_id}',
+                'email': f'user{user_id}@example.com',
+                'hashed_password': hashed_password,
+                'profile': f'profile of user {user_id}'
+            } for user_id in range(1, users + 1)])
+
+        ## User u follows the next `follows` users, so the benchmark's follows never collide
+        connection.execute(text("""
+                INSERT INTO users_follow_list (
+                    user_id,
+                    follow_user_id
+                ) VALUES (
+                    :user_id,
+                    :follow_user_id
+                )
+            """), [{
+                'user_id': user_id,
+                'follow_user_id': (user_id + i - 1) % users + 1
+            } for user_id in range(1, users + 1) for i in range(1, follows + 1)])
+
+        connection.execute(text("""
+                INSERT INTO tweets (
+                    user_id,
+                    tweet
+                ) VALUES (
+                    :user_id,
+                    :tweet
+                )
+            """), [{
+                'user_id': rand.randint(1, users),
+                'tweet': ' '.join(rand.choice(('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'tweet'))
+                                  for _ in range(rand.randint(3, 40)))[:300]
+            } for _ in range(users * tweets)])
+
+
+## Same dataset as seed(), in a model.MemoryStore
+def seed_memory(store, users, follows, tweets, seed=0):
+    rand = random.Random(seed)
+    hashed_password = PasswordHasher().hash(PASSWORD)
+    user_dao = MemoryUserDao(store)
+    tweet_dao = MemoryTweetDao(store)
+
+    for user_id in range(1, users + 1):
+        user_dao.insert_user({
+            'name': f'user{user_id}',
+            'email': f'user{user_id}@example.com',
+            'password': hashed_password,
+            'profile': f'profile of user {user_id}'
+        })
+    for user_id in range(1, users + 1):
+        user_dao.insert_follows(user_id, [(user_id + i - 1) % users + 1 for i in range(1, follows + 1)])
+    for _ in range(users * tweets):
+        tweet_dao.insert_tweet(rand.randint(1, users),
+                               ' '.join(rand.choice(('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'tweet'))
+                                        for _ in range(rand.randint(3, 40)))[:300])
+
+
+########################################################################
+#           Requests
+########################################################################
+## Same token as UserService.generate_access_token, without a bcrypt check per user
+def access_token(app, user_id):
+    payload = {
+        'user_id': user_id,
+        'exp': datetime.utcnow() + timedelta(seconds=60*60*24)
+    }
+    return jwt.encode(payload, app.config['JWT_SECRET_KEY'], 'HS256')
+
+## Each scenario returns a function sending its i-th request through a test client.
+def scenarios(app, args):
+    tokens = {}
+
+    def token(user_id):
+        if user_id not in tokens:
+            tokens[user_id] = access_token(app, user_id)
+        return {'Authorization': tokens[user_id]}
+
+    def user(i):
+        return i % args.users + 1
+
+    def sign_up(client, i):
+        return client.post('/sign-up', json={
+            'name': f'new user {i}',
+            'email': f'new{i}-{time.monotonic_ns()}@example.com',
+            'password': PASSWORD,
+            'profile': 'new profile'
+        })
+
+    def login(client, i):
+        return client.post('/login', json={'email': f'user{user(i)}@example.com', 'password': PASSWORD})
+
+    def tweet(client, i):
+        return client.post('/tweet', json={'tweet': f'benchmark tweet {i}'}, headers=token(user(i)))
+
+    ## The i-th follow of a user goes past the users it follows already
+    def follow(client, i):
+        user_id = user(i)
+        follow_id = (user_id + args.follows + i // args.users) % args.users + 1
+        return client.post('/follow', json={'follow': follow_id}, headers=token(user_id))
+
+    def timeline(client, i):
+        return client.get(f'/timeline/{user(i)}')
+
+    def profile_picture(client, i):
+        return client.get(f'/profile-picture/{i % args.pictures + 1}')
+
+    return {
+        'sign-up': sign_up,
+        'login': login,
+        'tweet': tweet,
+        'follow': follow,
+        'timeline': timeline,
+        'profile-picture': profile_picture
+    }
+
+def upload_pictures(app, count):
+    client = app.test_client()
+    with open(PICTURE, 'rb') as picture:
+        data = picture.read()
+
+    for user_id in range(1, count + 1):
+        client.post('/profile-picture',
+                    data={'profile_pic': (io.BytesIO(data + str(user_id).encode()), 'picture.png')},
+                    headers={'Authorization': access_token(app, user_id)},
+                    content_type='multipart/form-data')
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+def run(app, name, send, requests, threads):
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+
+    def worker(index):
+        client = app.test_client()
+        for i in range(index, requests, threads):
+            start = time.perf_counter()
+            res = send(client, i)
+            latencies[index].append(time.perf_counter() - start)
+            if res.status_code >= 400:
+                errors[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+
+    return {
+        'endpoint': name,
+        'requests': requests,
+        'errors': sum(errors),
+        'seconds': seconds,
+        'throughput': requests / seconds if seconds else None,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None
+    }
+
+
+########################################################################
+#           Baseline comparison
+########################################################################
+def regressions(results, baseline, tolerance):
+    previous = {result['endpoint']: result for result in baseline['results']}
+    found = []
+
+    for result in results:
+        before = previous.get(result['endpoint'])
+        if before is None:
+            continue
+        if before['throughput'] and result['throughput'] < before['throughput'] * (1 - tolerance):
+            found.append(f"{result['endpoint']}: throughput {before['throughput']:.1f} -> {result['throughput']:.1f}/s")
+        if before['p99_ms'] and result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            found.append(f"{result['endpoint']}: p99 {before['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms")
+
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=20)
+    parser.add_argument('--tweets', type=int, default=10, help='tweets per user')
+    parser.add_argument('--pictures', type=int, default=20, help='users with a profile picture')
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--password-requests', type=int, default=20, help='requests to sign-up and login')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--storage', choices=('database', 'memory'), default='database')
+    parser.add_argument('--db-url', help='an empty database, a temporary SQLite file by default')
+    parser.add_argument('--output', help='JSON results file, stdout by default')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.follows >= args.users:
+        parser.error('--follows must be lower than --users')
+    args.pictures = max(1, min(args.pictures, args.users))
+
+    work_directory = tempfile.mkdtemp(prefix='miniter-benchmark-')
+    try:
+        db_url = args.db_url or f"sqlite:///{os.path.join(work_directory, 'benchmark.db')}"
+        if args.storage == 'database':
+            database = create_engine(db_url, encoding='utf-8')
+            migrate(database)
+            seed(database, args.users, args.follows, args.tweets)
+
+        app_config = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+        app_config.update({
+            'STORAGE_BACKEND': args.storage,
+            'DB_URL': db_url,
+            'UPLOAD_DIRECTORY': os.path.join(work_directory, 'pictures'),
+            'SQL_SLOW_QUERY_THRESHOLD': None
+        })
+        if args.storage == 'memory' and app_config.get('TIMELINE_STORE') == 'table':
+            app_config['TIMELINE_STORE'] = 'memory'
+        app = create_app(app_config)
+        if args.storage == 'memory':
+            seed_memory(app.extensions['memory_store'], args.users, args.follows, args.tweets)
+
+        upload_pictures(app, args.pictures)
+
+        requests = scenarios(app, args)
+        results = []
+        for name in args.endpoints:
+            count = args.password_requests if name in PASSWORD_ENDPOINTS else args.requests
+            result = run(app, name, requests[name], count, args.threads)
+            results.append(result)
+            print(f"{name:>16} {result['throughput']:>9.1f}/s  p50 {result['p50_ms']:>8.2f} ms  "
+                  f"p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'database': database.dialect.name if args.storage == 'database' else 'memory',
+            'users': args.users,
+            'follows': args.follows,
+            'tweets_per_user': args.tweets,
+            'pictures': args.pictures,
+            'requests': args.requests,
+            'password_requests': args.password_requests,
+            'threads': args.threads
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            found = regressions(results, json.load(baseline), args.tolerance)
+        for regression in found:
+            print(f'regression: {regression}', file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
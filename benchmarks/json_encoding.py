@@ -0,0 +1,64 @@
+## Micro-benchmark of the JSON response encoders on timeline payloads.
+##
+##   python benchmarks/json_encoding.py [--sizes 50 200 800] [--repeat 5]
+##
+## Encodes a GET /timeline response body through flask.json.dumps with each
+## encoder and prints the best time per response and the speedup over the
+## stdlib encoder.
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, json
+
+from view.json_encoding import CustomJSONEcoder, OrjsonEncoder, orjson
+
+
+def timeline_payload(size, seed=0):
+    rand = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + ' ' * 10
+    timeline = [{
+        'user_id': rand.randint(1, 10000),
+        'tweet': ''.join(rand.choice(alphabet) for _ in range(rand.randint(20, 300)))
+    } for _ in range(size)]
+
+    return {
+        'user_id': 1,
+        'timeline': timeline,
+        'next_cursor': rand.randint(1, 10 ** 6)
+    }
+
+def bench(encoder, payload, repeat):
+    app = Flask(__name__)
+    app.json_encoder = encoder
+
+    with app.app_context():
+        number, _ = timeit.Timer(lambda: json.dumps(payload)).autorange()
+        best = min(timeit.repeat(lambda: json.dumps(payload), number=number, repeat=repeat))
+
+    return best / number
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if orjson is None:
+        sys.exit('orjson is not installed')
+
+    print(f"{'tweets':>8} {'json (us)':>12} {'orjson (us)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        payload = timeline_payload(size)
+        stdlib = bench(CustomJSONEcoder, payload, args.repeat)
+        fast = bench(OrjsonEncoder, payload, args.repeat)
+        print(f"{size:>8} {stdlib * 1e6:>12.1f} {fast * 1e6:>12.1f} {stdlib / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+## Synthetic social graph generator, for load and scale testing.
+##
+##   python benchmarks/social_graph.py --db-url mysql+mysqlconnector://.../miniter_scale
+##                                     [--users 1000000] [--avg-follows 20] [--avg-tweets 10]
+##                                     [--popularity-exponent 1.0] [--celebrities 5]
+##                                     [--celebrity-reach 0.2] [--start 2024-01-01] [--days 30] [--bursts 20]
+##                                     [--seed 0] [--batch-size 1000] [--output stats.json]
+##
+## Migrates an empty database (model.schema.migrate) and bulk-loads it with multi-row
+## INSERTs, then prints summary statistics of the graph it built as JSON.
+##   users       ids 1..N in popularity order: user 1 is the most followed.
+##   follows     out-degrees are log-normal around --avg-follows. Targets are drawn from a
+##               Zipf distribution over the ids (--popularity-exponent), so follower counts
+##               follow a power law; on top of that each of the first --celebrities users is
+##               followed by about --celebrity-reach of everyone.
+##   tweets      --avg-tweets per user on average, authors weighted by a log-normal activity
+##               level, spread over --days from --start (UTC) with --bursts short spikes of volume.
+##               Tweet ids increase with created_at, like they would in production.
+## Users and follows are created at --start. The same arguments and --seed always build the
+## same data, timestamps and password hashes included. Nothing is held per edge or per tweet,
+## so memory stays proportional to the number of users.
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bcrypt
+from sqlalchemy import create_engine, text
+
+from model.schema import migrate
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+         'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua')
+## Every user's password is 'password', hashed with a fixed salt so the rows are the same on every run
+PASSWORD_SALT = b'$2b$12$miniterbenchmarksalt..'
+
+
+########################################################################
+#           Bulk loading
+########################################################################
+## Buffers rows and writes them `batch_size` at a time with one multi-row INSERT.
+## The statement for a full batch is built once and reused.
+class BulkInserter:
+    def __init__(self, connection, table, columns, batch_size=1000):
+        self.connection = connection
+        self.table = table
+        self.columns = columns
+        self.batch_size = max(1, min(batch_size, max_parameters(connection) // len(columns)))
+        self.statements = {}
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        self.connection.execute(self.statement(len(self.rows)), {
+            f'{column}_{i}': value
+            for i, row in enumerate(self.rows) for column, value in zip(self.columns, row)
+        })
+        self.count += len(self.rows)
+        self.rows = []
+
+    def statement(self, row_count):
+        statement = self.statements.get(row_count)
+        if statement is None:
+            values = ', '.join('(' + ', '.join(f':{column}_{i}' for column in self.columns) + ')'
+                               for i in range(row_count))
+            statement = self.statements[row_count] = text(
+                f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES {values}")
+
+        return statement
+
+## Bound parameters allowed in one statement
+def max_parameters(connection):
+    if connection.dialect.name == 'sqlite':
+        return 32766 if sqlite3.sqlite_version_info >= (3, 32) else 999
+
+    return 65535
+
+
+########################################################################
+#           Generator
+########################################################################
+def cumulative(weights):
+    return array('d', itertools.accumulate(weights))
+
+def lognormal_count(rand, mean, sigma, cap):
+    return min(cap, int(round(rand.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma))))
+
+def load_users(connection, args, rand):
+    hashed_password = bcrypt.hashpw(b'password', PASSWORD_SALT).decode('utf-8')
+    created_at = datetime.fromisoformat(args.start)
+
+    inserter = BulkInserter(connection, 'users', ('id', 'name', 'email', 'hashed_password', 'profile', 'created_at'),
+                            args.batch_size)
+    for user_id in range(1, args.users + 1):
+        inserter.add((user_id, f'user{user_id}', f'user{user_id}@example.com', hashed_password,
+                      f'profile of user {user_id}', created_at))
+    inserter.flush()
+
+    return inserter.count
+
+def load_follows(connection, args, rand, followers, following):
+    users = args.users
+    popularity = cumulative(1 / rank ** args.popularity_exponent for rank in range(1, users + 1))
+    user_ids = range(1, users + 1)
+    celebrities = range(1, min(args.celebrities, users) + 1)
+
+    created_at = datetime.fromisoformat(args.start)
+
+    inserter = BulkInserter(connection, 'users_follow_list', ('user_id', 'follow_user_id', 'created_at'),
+                            args.batch_size)
+    for user_id in user_ids:
+        degree = lognormal_count(rand, args.avg_follows, 1.0, min(args.max_follows, users - 1))
+
+        follow_ids = {celebrity for celebrity in celebrities if rand.random() < args.celebrity_reach}
+        follow_ids.discard(user_id)
+        ## Zipf draws repeat popular ids (and may draw user_id itself, dropped again),
+        ## so draw until the degree is reached (or give up)
+        for _ in range(4):
+            missing = degree - len(follow_ids)
+            if missing <= 0:
+                break
+            follow_ids.update(rand.choices(user_ids, cum_weights=popularity, k=missing))
+            follow_ids.discard(user_id)
+
+        for follow_id in sorted(follow_ids):
+            inserter.add((user_id, follow_id, created_at))
+            followers[follow_id - 1] += 1
+        following[user_id - 1] = len(follow_ids)
+    inserter.flush()
+
+    return inserter.count
+
+## Tweets per minute of the window: a base rate with some noise, plus short bursts
+## (gaussian, a few minutes to an hour wide) that together carry about a third of the volume.
+def minute_rates(args, rand):
+    minutes = args.days * 24 * 60
+    rates = [rand.lognormvariate(0, 0.3) for _ in range(minutes)]
+    base = sum(rates)
+
+    for _ in range(args.bursts):
+        center = rand.randrange(minutes)
+        width = rand.uniform(3, 60)
+        height = base / max(args.bursts, 1) / 2 / (width * math.sqrt(2 * math.pi))
+        for minute in range(max(0, int(center - 4 * width)), min(minutes, int(center + 4 * width) + 1)):
+            rates[minute] += height * math.exp(-((minute - center) / width) ** 2 / 2)
+
+    return rates
+
+def load_tweets(connection, args, rand, tweet_counts, minute_counts):
+    users = args.users
+    activity = cumulative(rand.lognormvariate(0, 1.5) for _ in range(users))
+    user_ids = range(1, users + 1)
+
+    rates = minute_rates(args, rand)
+    total_rate = sum(rates)
+    total = users * args.avg_tweets
+    start = datetime.fromisoformat(args.start)
+
+    inserter = BulkInserter(connection, 'tweets', ('id', 'user_id', 'tweet', 'created_at'), args.batch_size)
+    tweet_id = 0
+    carry = 0.0
+    for minute, rate in enumerate(rates):
+        expected = total * rate / total_rate + carry
+        count = int(expected)
+        carry = expected - count
+        minute_counts.append(count)
+        if not count:
+            continue
+
+        minute_start = start + timedelta(minutes=minute)
+        seconds = sorted(rand.random() * 60 for _ in range(count))
+        for author, second in zip(rand.choices(user_ids, cum_weights=activity, k=count), seconds):
+            tweet_id += 1
+            words = rand.choices(WORDS, k=rand.randint(3, 45))
+            inserter.add((tweet_id, author, ' '.join(words)[:300], minute_start + timedelta(seconds=second)))
+            tweet_counts[author - 1] += 1
+    inserter.flush()
+
+    return inserter.count
+
+
+########################################################################
+#           Statistics
+########################################################################
+def distribution(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+    return {
+        'mean': sum(values) / len(values),
+        'median': at(0.5),
+        'p90': at(0.9),
+        'p99': at(0.99),
+        'p999': at(0.999),
+        'max': values[-1]
+    }
+
+## Maximum likelihood exponent of a discrete power law above x_min (Clauset et al. 2009, eq. 3.7)
+def power_law_alpha(values, x_min=5):
+    tail = [value for value in values if value >= x_min]
+    if not tail:
+        return None
+
+    return 1 + len(tail) / sum(math.log(value / (x_min - 0.5)) for value in tail)
+
+def graph_stats(args, followers, following, tweet_counts, minute_counts):
+    edges = sum(following)
+    top = sorted(range(args.users), key=followers.__getitem__, reverse=True)[:10]
+    top_percent = max(1, args.users // 100)
+    top_percent_edges = sum(sorted(followers, reverse=True)[:top_percent])
+
+    return {
+        'seed': args.seed,
+        'users': args.users,
+        'follow_edges': edges,
+        'tweets': sum(tweet_counts),
+        'followers': dict(distribution(followers), power_law_alpha=power_law_alpha(followers)),
+        'following': distribution(following),
+        'tweets_per_user': distribution(tweet_counts),
+        'users_without_followers': sum(1 for count in followers if count == 0),
+        'users_without_tweets': sum(1 for count in tweet_counts if count == 0),
+        'top_accounts': [{'user_id': index + 1, 'followers': followers[index]} for index in top],
+        'top_1_percent_edge_share': top_percent_edges / edges if edges else 0.0,
+        'tweets_per_minute': distribution(minute_counts)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db-url', required=True, help='an empty database, e.g. sqlite:///scale.db')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--avg-follows', type=float, default=20)
+    parser.add_argument('--max-follows', type=int, default=5000)
+    parser.add_argument('--popularity-exponent', type=float, default=1.0)
+    parser.add_argument('--celebrities', type=int, default=5)
+    parser.add_argument('--celebrity-reach', type=float, default=0.2)
+    parser.add_argument('--avg-tweets', type=float, default=10)
+    parser.add_argument('--start', default='2024-01-01', help='first day of tweets (UTC), YYYY-MM-DD')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT')
+    parser.add_argument('--output', help='JSON statistics file, stdout by default')
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+
+    database = create_engine(args.db_url, encoding='utf-8')
+    migrate(database)
+    with database.connect() as connection:
+        if connection.execute(text("SELECT COUNT(*) FROM users")).scalar():
+            sys.exit('the users table is not empty')
+
+    rand = random.Random(args.seed)
+    followers = array('i', bytes(4 * args.users))
+    following = array('i', bytes(4 * args.users))
+    tweet_counts = array('i', bytes(4 * args.users))
+    minute_counts = array('i')
+
+    timings = {}
+    with database.connect() as connection:
+        for name, load in (('users', lambda: load_users(connection, args, rand)),
+                           ('follows', lambda: load_follows(connection, args, rand, followers, following)),
+                           ('tweets', lambda: load_tweets(connection, args, rand, tweet_counts, minute_counts))):
+            start = time.perf_counter()
+            rows = load()
+            seconds = time.perf_counter() - start
+            timings[name] = {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else None}
+            print(f'{name}: {rows} rows in {seconds:.1f}s', file=sys.stderr)
+
+    stats = graph_stats(args, followers, following, tweet_counts, minute_counts)
+    stats['load'] = timings
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(stats, output, indent=2)
+    else:
+        json.dump(stats, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,9 +17,107 @@ DB_URL = (
     f"mysql+mysqlconnector://{db['user']}:{db['password']}@{db['host']}:{db['port']}/"
     f"{db['database']}?charset=utf8"
 )
+## Read replicas of DB_URL (the primary). DAO reads go to them, picked 'round-robin' or by
+## 'least-connections'; a user's reads stay on the primary for DB_READ_YOUR_WRITES_WINDOW
+## seconds after they wrote, longer than the replication lag should ever be.
+DB_REPLICA_URLS = []
+DB_REPLICA_POLICY = 'round-robin'
+DB_READ_YOUR_WRITES_WINDOW = 5
+## Where users, tweets and follows are stored: 'database' (DB_URL) or 'memory'
+## (model.MemoryStore, per process and lost on exit, for tests and profiling)
+STORAGE_BACKEND = 'database'
+## Connection pool (QueuePool) sizing, see sqlalchemy.create_engine
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 0
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 3600
+DB_POOL_PRE_PING = True
+## Same database through an async driver, for async_app.create_async_app
+ASYNC_DB_URL = (
+    f"mysql+aiomysql://{db['user']}:{db['password']}@{db['host']}:{db['port']}/"
+    f"{db['database']}?charset=utf8"
+)
 JWT_SECRET_KEY = 'difficult secret key'
 JWT_EXP_DELTA_SECONDS = 7 * 24 * 60 * 60
+## Verified token cache of login_required (JWT_CACHE_SIZE = 0 disables it)
+JWT_CACHE_SIZE = 1024
+JWT_CACHE_TTL = 300
+## Credential rows cached by email for logins (CREDENTIAL_CACHE_SIZE = 0 disables it)
+CREDENTIAL_CACHE_SIZE = 4096
+CREDENTIAL_CACHE_TTL = 30
 UPLOAD_DIRECTORY = './profile_pictures'
+## Profile pictures: Cache-Control max-age of GET /profile-picture/file/<name> (GET
+## /profile-picture/<user_id> is always revalidated), per-process cache of
+## user id -> (path, ETag), and 'x-sendfile' / 'x-accel-redirect' to let the proxy send the file
+PROFILE_PICTURE_MAX_AGE = 86400
+PROFILE_PICTURE_CACHE_SIZE = 10000
+PROFILE_PICTURE_CACHE_TTL = 60
+PROFILE_PICTURE_SENDFILE = None
+PROFILE_PICTURE_ACCEL_PREFIX = '/profile-pictures/'
+## Resized variants made after an upload, served with ?size=
+PROFILE_PICTURE_SIZES = (48, 96, 200)
+THUMBNAILER_WORKERS = 2
+## bcrypt process pool: hashes running at once, and waiting before sign-up/login answer 503
+PASSWORD_HASHER_WORKERS = 4
+PASSWORD_HASHER_QUEUE = 16
+## Home timeline store: 'memory' (per process), 'table' (shared) or None (join on every read).
+## Timelines keep their newest TIMELINE_MAX_LENGTH tweets; 'memory' keeps the
+## TIMELINE_MAX_USERS most recently read timelines.
+TIMELINE_STORE = 'memory'
+TIMELINE_MAX_LENGTH = 800
+TIMELINE_MAX_USERS = 10000
+## Default and maximum 'limit' of /timeline pages
+TIMELINE_PAGE_SIZE = 50
+TIMELINE_MAX_PAGE_SIZE = 200
+## Write-behind mode of POST /tweet: tweets are queued (at most TWEET_BUFFER_SIZE) and
+## committed in groups of TWEET_BUFFER_BATCH_SIZE or every TWEET_BUFFER_FLUSH_INTERVAL seconds
+TWEET_WRITE_BEHIND = False
+TWEET_BUFFER_SIZE = 10000
+TWEET_BUFFER_BATCH_SIZE = 500
+TWEET_BUFFER_FLUSH_INTERVAL = 0.05
+TWEET_BUFFER_PUT_TIMEOUT = 0.1
+## A group that fails to commit is retried TWEET_BUFFER_FLUSH_ATTEMPTS times in all, after
+## TWEET_BUFFER_RETRY_BACKOFF seconds (doubling), then appended to TWEET_BUFFER_SPOOL if set
+TWEET_BUFFER_FLUSH_ATTEMPTS = 5
+TWEET_BUFFER_RETRY_BACKOFF = 0.1
+TWEET_BUFFER_SPOOL = None
+## Most tweets accepted by one POST /tweets/batch
+TWEET_BATCH_MAX_SIZE = 500
+## Most users in one POST /follow/batch or /unfollow/batch
+FOLLOW_BATCH_MAX_SIZE = 500
+## Requests served at once per route class ('auth', 'writes', 'reads', 'static', see
+## view.admission.ROUTE_CLASSES); beyond that they wait up to ADMISSION_QUEUE_TIMEOUT seconds
+## for a slot, then get 503 with Retry-After: ADMISSION_RETRY_AFTER. None or 0: no limit.
+## 'auth' admits PASSWORD_HASHER_WORKERS + PASSWORD_HASHER_QUEUE, the database classes a few
+## times DB_POOL_SIZE + DB_MAX_OVERFLOW: more would only wait for a connection.
+ADMISSION_LIMITS = {'auth': 20, 'writes': 8, 'reads': 16, 'static': 32}
+ADMISSION_QUEUE_TIMEOUT = 0.05
+ADMISSION_RETRY_AFTER = 1
+## Per-user token buckets, {route class: (requests per second, burst)}: 429 once empty
+USER_RATE_LIMITS = {'writes': (5, 20)}
+USER_RATE_LIMIT_MAX_USERS = 100000
+## Remote addresses allowed to read /stats and /metrics
+INTERNAL_ADDRESSES = ['127.0.0.1']
+## JSON response encoder: 'orjson' (falls back to 'json' when orjson isn't installed) or 'json'
+JSON_ENCODER = 'orjson'
+## Response compression, in order of preference ('br' needs brotli, 'zstd' needs zstandard).
+## Responses below COMPRESSION_MIN_SIZE bytes are sent uncompressed.
+COMPRESSION_ENCODINGS = ('br', 'zstd', 'gzip')
+COMPRESSION_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_MIMETYPES = ('application/json', 'text/html', 'text/plain')
+## Compressed bodies of responses with an ETag
+COMPRESSION_CACHE_SIZE = 256
+COMPRESSION_CACHE_TTL = 300
+## Statements slower than this (seconds) go to the 'model.slow_query' logger, and to
+## SQL_SLOW_QUERY_LOG if set. Values of parameters whose name matches SQL_SLOW_QUERY_REDACT are left out.
+SQL_SLOW_QUERY_THRESHOLD = 0.5
+SQL_SLOW_QUERY_LOG = None
+SQL_SLOW_QUERY_REDACT = r'password|email|token|tweet|profile|name'
+## Send the number of SQL statements a request ran in X-Query-Count
+SQL_QUERY_COUNT_HEADER = False
+## Upper bounds (seconds) of the /metrics request latency histogram buckets
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
 test_db = {
     'user': 'root',
@@ -1,7 +1,18 @@
 from .tweet_dao import TweetDao
 from .user_dao import UserDao
+from .timeline_store import InMemoryTimelineStore, TableTimelineStore
+from .memory_store import MemoryStore, MemoryTweetDao, MemoryUserDao
+from .async_tweet_dao import AsyncTweetDao
+from .async_user_dao import AsyncUserDao
 
 __all__ = [
     'TweetDao',
-    'UserDao'
-]
\ No newline at end of file
+    'UserDao',
+    'InMemoryTimelineStore',
+    'TableTimelineStore',
+    'MemoryStore',
+    'MemoryTweetDao',
+    'MemoryUserDao',
+    'AsyncTweetDao',
+    'AsyncUserDao'
+]
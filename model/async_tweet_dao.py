@@ -0,0 +1,42 @@
+from sqlalchemy import text
+
+from .tweet_dao import TweetDao
+
+
+## TweetDao over an AsyncEngine (sqlalchemy.ext.asyncio), for the ASGI app.
+class AsyncTweetDao:
+    def __init__(self, database):
+        self.db = database
+    
+    async def insert_tweet(self, user_id, tweet):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                    INSERT INTO tweets (
+                        user_id,
+                        tweet
+                    ) VALUES (
+                        :id,
+                        :tweet
+                    )
+                """), {
+                    'id': user_id,
+                    'tweet': tweet
+                })
+            
+            return result.lastrowid
+    
+    async def get_timeline_page(self, user_id, limit, max_id=None, since_id=None):
+        async with self.db.connect() as connection:
+            result = await connection.execute(TweetDao.timeline_page_query(max_id, since_id), {
+                    'user_id': user_id,
+                    'limit': limit,
+                    'max_id': max_id,
+                    'since_id': since_id
+                })
+            rows = result.mappings().all()
+        
+        return [{
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'tweet': row['tweet']
+        } for row in rows]
@@ -0,0 +1,138 @@
+from sqlalchemy import text
+
+
+## UserDao over an AsyncEngine (sqlalchemy.ext.asyncio), for the ASGI app.
+class AsyncUserDao:
+    def __init__(self, database):
+        self.db = database
+    
+    async def insert_user(self, user):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                    INSERT INTO users (
+                        name,
+                        email,
+                        profile,
+                        hashed_password
+                    ) VALUES (
+                        :name,
+                        :email,
+                        :profile,
+                        :password
+                    )
+                """), user)
+            
+            return result.lastrowid
+    
+    async def get_user_id_and_password(self, email):
+        async with self.db.connect() as connection:
+            result = await connection.execute(text("""
+                    SELECT
+                        id,
+                        hashed_password
+                    FROM users
+                    WHERE email = :email
+                """), {'email': email})
+            row = result.mappings().first()
+        
+        return {
+            'id': row['id'],
+            'hashed_password': row['hashed_password']
+        } if row else None
+    
+    async def update_password(self, email, hashed_password):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                    UPDATE users
+                    SET hashed_password = :hashed_password
+                    WHERE email = :email
+                """), {
+                    'email': email,
+                    'hashed_password': hashed_password
+                })
+            
+            return result.rowcount
+    
+    ## See UserDao._bump_follow_version
+    @staticmethod
+    async def _bump_follow_version(connection, user_id):
+        await connection.execute(text("""
+                UPDATE users
+                SET
+                    follow_version = follow_version + 1,
+                    follows_updated_at = CURRENT_TIMESTAMP
+                WHERE id = :id
+            """), {'id': user_id})
+    
+    async def insert_follow(self, user_id, follow_id):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                    INSERT INTO users_follow_list (
+                        user_id,
+                        follow_user_id
+                    ) VALUES (
+                        :id,
+                        :follow
+                    )
+                """), {'id': user_id, 'follow': follow_id})
+            await self._bump_follow_version(connection, user_id)
+            
+            return result.rowcount
+    
+    async def insert_unfollow(self, user_id, unfollow_id):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                    DELETE FROM users_follow_list
+                    WHERE user_id = :id AND follow_user_id = :unfollow
+                """), {'id': user_id, 'unfollow': unfollow_id})
+            if result.rowcount:
+                await self._bump_follow_version(connection, user_id)
+            
+            return result.rowcount
+    
+    async def save_profile_picture(self, profile_pic_path, user_id, picture_hash=None):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                    UPDATE users
+                    SET
+                        profile_picture = :profile_pic_path,
+                        profile_picture_hash = :picture_hash
+                    WHERE id = :user_id
+                """), {
+                    'user_id': user_id,
+                    'profile_pic_path': profile_pic_path,
+                    'picture_hash': picture_hash
+                })
+            
+            return result.rowcount
+    
+    async def get_profile_picture(self, user_id):
+        async with self.db.connect() as connection:
+            result = await connection.execute(text("""
+                    SELECT profile_picture
+                    FROM users
+                    WHERE id = :user_id
+                """), {
+                    'user_id': user_id
+                })
+            row = result.mappings().first()
+        
+        return row['profile_picture'] if row else None
+    
+    async def get_profile_picture_file(self, user_id):
+        async with self.db.connect() as connection:
+            result = await connection.execute(text("""
+                    SELECT
+                        profile_picture,
+                        profile_picture_hash
+                    FROM users
+                    WHERE id = :user_id
+                """), {
+                    'user_id': user_id
+                })
+            row = result.mappings().first()
+        
+        return {
+            'path': row['profile_picture'],
+            'hash': row['profile_picture_hash']
+        } if row and row['profile_picture'] else None
@@ -0,0 +1,401 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+import config
+
+
+## create_engine / create_async_engine options from the DB_POOL_* config keys.
+## SQLite doesn't use a QueuePool, so it gets none of the pool sizing options.
+## With pool_stats, the QueuePool times how long checkouts wait, see PoolStats.
+def engine_options(config, db_url, pool_stats=None):
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite':
+        return {}
+
+    options = {} if pool_stats is None else {
+        'poolclass': pool_stats.pool_class(AsyncAdaptedQueuePool if url.get_dialect().is_async else QueuePool)
+    }
+
+    return {
+        **options,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 0),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', -1),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', False),
+    }
+
+
+## Connection pool instrumentation: how long requests wait for a connection,
+## how many connections are in use, and how often the pool has to open
+## overflow connections or gives up waiting (pool_timeout).
+## Slow queries with a quiet pool, or long checkout waits with every
+## connection in use, tell pool starvation apart from slow queries.
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.timeouts = 0
+        self.in_use = 0
+        self.in_use_max = 0
+        self.connects = 0
+        self.overflow_events = 0
+
+    ## Listens to the pool events of `engine` (a sync Engine, or an AsyncEngine's
+    ## sync_engine). Listeners carry over to the new pool engine.dispose() creates.
+    def attach(self, engine):
+        self.engine = engine
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+        return self
+
+    ## There is no pool event for the start of a checkout, so checkout waits are only
+    ## timed by engines whose pool is this class (poolclass, see engine_options):
+    ## `base` with the wait timed around its public connect(). The pool dispose()
+    ## creates is of the same class.
+    def pool_class(self, base=QueuePool):
+        stats = self
+
+        class TimedPool(base):
+            def connect(self):
+                start = time.perf_counter()
+                try:
+                    return super().connect()
+                except PoolTimeoutError:
+                    with stats.lock:
+                        stats.timeouts += 1
+                    raise
+                finally:
+                    stats.record_wait(time.perf_counter() - start)
+
+        TimedPool.__name__ = TimedPool.__qualname__ = f'Timed{base.__name__}'
+
+        return TimedPool
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    ## QueuePool counts a new connection in overflow() before opening it,
+    ## so overflow() > 0 means this one is beyond pool_size.
+    def on_connect(self, dbapi_connection, connection_record):
+        pool = self.engine.pool
+        overflow = hasattr(pool, 'overflow') and pool.overflow() > 0
+        with self.lock:
+            self.connects += 1
+            if overflow:
+                self.overflow_events += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.in_use += 1
+            self.in_use_max = max(self.in_use_max, self.in_use)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.in_use -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pool': self.engine.pool.status() if self.engine is not None else None,
+                'checkouts': self.checkouts,
+                'checkout_wait_avg': self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+                'checkout_wait_max': self.checkout_wait_max,
+                'timeouts': self.timeouts,
+                'in_use': self.in_use,
+                'in_use_max': self.in_use_max,
+                'connects': self.connects,
+                'overflow_events': self.overflow_events
+            }
+
+
+## Statement text without its values: placeholders and literals become ?,
+## IN lists and multi-row VALUES collapse to one entry, whitespace is squeezed.
+PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+")
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r"\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+VALUES_LIST = re.compile(r"(\bVALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+
+def normalize_statement(statement):
+    statement = PLACEHOLDER.sub('?', statement)
+    statement = STRING_LITERAL.sub('?', statement)
+    statement = NUMBER_LITERAL.sub('?', statement)
+    statement = ' '.join(statement.split())
+    statement = IN_LIST.sub('IN (...)', statement)
+
+    return VALUES_LIST.sub(r'\1', statement)
+
+
+slow_query_logger = logging.getLogger('model.slow_query')
+
+## Parameter names whose values are left out of the slow-query log, see config.py
+DEFAULT_REDACT = config.SQL_SLOW_QUERY_REDACT
+
+## Statement instrumentation: execution time and row counts of every statement,
+## aggregated by normalized statement, a slow-query log, and the number of
+## statements (and their time) run by the current thread since start_request(),
+## which RequestMetrics reports per HTTP request.
+## Statements slower than slow_threshold seconds are logged to 'model.slow_query'
+## (and log_path, if given) with their parameters; values of parameters whose name
+## matches `redact`, and every positional value, are replaced with '?'.
+## Row counts are what the driver reports in cursor.rowcount: affected rows,
+## or rows returned by buffered drivers. Statements with no row count are counted as 0.
+class QueryStats:
+    def __init__(self, slow_threshold=None, redact=DEFAULT_REDACT, log_path=None):
+        self.slow_threshold = slow_threshold
+        self.redact = re.compile(redact, re.IGNORECASE) if redact else None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.statements = {}
+        self.normalized = {}
+        self.slow_queries = 0
+
+        if log_path is not None and not any(getattr(handler, 'baseFilename', None) == log_path
+                                            for handler in slow_query_logger.handlers):
+            handler = logging.FileHandler(log_path)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_query_logger.addHandler(handler)
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+        return self
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        rows = max(cursor.rowcount, 0)
+        normalized = self.normalize(statement)
+
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+        self.local.seconds = getattr(self.local, 'seconds', 0.0) + seconds
+
+        slow = self.slow_threshold is not None and seconds >= self.slow_threshold
+        with self.lock:
+            stats = self.statements.get(normalized)
+            if stats is None:
+                stats = self.statements[normalized] = {
+                    'count': 0,
+                    'seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'rows': 0
+                }
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['rows'] += rows
+            if slow:
+                self.slow_queries += 1
+
+        if slow:
+            slow_query_logger.warning('%.3fs rows=%d %s params=%s',
+                                      seconds, rows, normalized, self.redact_parameters(parameters, executemany))
+
+    def handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_start'):
+            connection.info['query_start'].pop()
+
+    ## Normalized text of each raw statement, remembered: the same few statements run all the time.
+    def normalize(self, statement):
+        normalized = self.normalized.get(statement)
+        if normalized is None:
+            normalized = normalize_statement(statement)
+            if len(self.normalized) >= 4096:
+                self.normalized.clear()
+            self.normalized[statement] = normalized
+
+        return normalized
+
+    def redact_parameters(self, parameters, executemany):
+        if executemany:
+            return f'[{len(parameters)} parameter sets]'
+        if isinstance(parameters, dict):
+            return {name: '?' if self.redact is None or self.redact.search(name) else value
+                    for name, value in parameters.items()}
+
+        return tuple('?' for _ in parameters or ())
+
+    ## Per-request counting, for the current thread
+    def start_request(self):
+        self.local.queries = 0
+        self.local.seconds = 0.0
+
+    def request_queries(self):
+        return getattr(self.local, 'queries', 0), getattr(self.local, 'seconds', 0.0)
+
+    ## Normalized statements by total time spent in them, the slowest `limit` ones.
+    def stats(self, limit=20):
+        with self.lock:
+            statements = sorted(self.statements.items(), key=lambda item: item[1]['seconds'], reverse=True)
+
+            return {
+                'statements': [dict(stats, statement=statement) for statement, stats in statements[:limit]],
+                'distinct_statements': len(self.statements),
+                'slow_queries': self.slow_queries
+            }
+
+    ## The per-statement counters for RequestMetrics.add_collector
+    def metrics(self):
+        with self.lock:
+            statements = [(statement, dict(stats)) for statement, stats in self.statements.items()]
+
+        return [
+            (f'sql_statement_{name}', metric_type, description,
+             [({'statement': statement}, stats[key]) for statement, stats in statements])
+            for name, metric_type, key, description in (
+                ('executions_total', 'counter', 'count', 'Executions, by normalized statement.'),
+                ('seconds_total', 'counter', 'seconds', 'Execution time, by normalized statement.'),
+                ('max_seconds', 'gauge', 'max_seconds', 'Slowest execution, by normalized statement.'),
+                ('rows_total', 'counter', 'rows', 'Rows affected or returned, by normalized statement.'))
+        ]
+
+
+## Replica index ReplicaRouter uses for the primary
+PRIMARY = -1
+
+## Sends reads to read replicas and writes to the primary engine.
+## reader() picks a replica round-robin, or with policy 'least-connections' the one
+## with the fewest checked out connections (ties taken in round-robin order).
+## Read-your-writes: DAOs call wrote(key) after a write about `key` (a user id, or
+## ('email', email)), and for `read_your_writes` seconds reads about that key go to
+## the primary, which has the write even when the replicas are still behind.
+## Writes are remembered per process only, so that guarantee holds for requests of a
+## user served by the same process (sticky sessions) within the window.
+## Between start_request() and end_request() (hooked to every request by attach()) the
+## current thread keeps reading from the engine its first read picked (the primary for
+## a recent writer), so the parts of one response, like a timeline's validator and its
+## body, come from the same engine and agree.
+class ReplicaRouter:
+    def __init__(self, primary, replicas=(), policy='round-robin', read_your_writes=5.0):
+        if policy not in ('round-robin', 'least-connections'):
+            raise ValueError(f'Unknown replica policy: {policy}')
+
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.policy = policy
+        self.read_your_writes = read_your_writes
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.turn = 0
+        ## key -> monotonic time its window ends, oldest first
+        self.recent_writes = OrderedDict()
+        self.reads = [0] * len(self.replicas)
+        self.primary_reads = 0
+
+    def reader(self, key=None):
+        if not self.replicas:
+            return self.primary
+
+        now = time.monotonic()
+        with self.lock:
+            ## The engine this request reads from, once its first read picked it
+            index = getattr(self.local, 'index', None)
+            if index is None:
+                expires_at = self.recent_writes.get(key) if key is not None else None
+                index = PRIMARY if expires_at is not None and expires_at > now else self.pick()
+                if getattr(self.local, 'pinned', False):
+                    self.local.index = index
+            elif index != PRIMARY and key is not None and self.recent_writes.get(key, 0) > now:
+                index = PRIMARY
+
+            if index == PRIMARY:
+                self.primary_reads += 1
+                return self.primary
+            self.reads[index] += 1
+
+        return self.replicas[index]
+
+    ## Index of the replica for a new read, with the lock held
+    def pick(self):
+        start = self.turn
+        self.turn = (self.turn + 1) % len(self.replicas)
+        if self.policy == 'least-connections':
+            order = list(range(start, len(self.replicas))) + list(range(start))
+            return min(order, key=lambda i: checked_out(self.replicas[i]))
+
+        return start
+
+    def attach(self, app):
+        app.before_request(self.start_request)
+        app.teardown_request(self.end_request)
+
+        return self
+
+    def start_request(self):
+        self.local.pinned = True
+        self.local.index = None
+
+    def end_request(self, exception=None):
+        self.local.pinned = False
+        self.local.index = None
+
+    def wrote(self, *keys):
+        if not self.replicas or not self.read_your_writes:
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                self.recent_writes[key] = now + self.read_your_writes
+                self.recent_writes.move_to_end(key)
+
+            while self.recent_writes:
+                key, expires_at = next(iter(self.recent_writes.items()))
+                if expires_at > now:
+                    break
+                del self.recent_writes[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'policy': self.policy,
+                'replicas': [{
+                    'url': replica.url.render_as_string(hide_password=True),
+                    'reads': reads,
+                    'pool': replica.pool.status()
+                } for replica, reads in zip(self.replicas, self.reads)],
+                'primary_reads': self.primary_reads,
+                'recent_writers': len(self.recent_writes)
+            }
+
+def checked_out(engine):
+    pool = engine.pool
+    return pool.checkedout() if hasattr(pool, 'checkedout') else 0
+
+
+## Base of the DAOs reading through a ReplicaRouter (or only from `database` without one).
+class RoutedDao:
+    def __init__(self, database, router=None):
+        self.db = database
+        self.router = router
+
+    ## Engine for a read about `key`
+    def reader(self, key=None):
+        return self.db if self.router is None else self.router.reader(key)
+
+    ## After a write about `keys`: their reads stay on the primary for a while
+    def wrote(self, *keys):
+        if self.router is not None:
+            self.router.wrote(*keys)
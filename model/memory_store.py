@@ -0,0 +1,310 @@
+import bisect
+import heapq
+import itertools
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+
+## In-process storage backend (STORAGE_BACKEND = 'memory'): the users, tweets and
+## users_follow_list tables kept in indexed dicts and lists, for running and profiling
+## the service and view layers without a database. Only a single process sees the data,
+## and it is gone when the process exits.
+## Tweet ids are 1, 2, 3... so tweets[tweet_id - 1] is a tweet, and every user's
+## tweet ids are kept in ascending order, like the (user_id, id) index of the tweets table.
+## Violations of the table constraints (unique email, foreign keys, primary keys)
+## raise sqlalchemy's IntegrityError, like the database would.
+class MemoryStore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        ## user_id -> user dict (the users row)
+        self.users = {}
+        self.last_user_id = 0
+        ## email -> user_id
+        self.emails = {}
+        ## user_id -> set of followed user ids, and the reverse index
+        self.followees = {}
+        self.followers = {}
+        ## (id, user_id, tweet, created_at), by id - 1
+        self.tweets = []
+        ## user_id -> ascending tweet ids
+        self.user_tweets = {}
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc).replace(microsecond=0)
+
+    def check_user(self, user_id, constraint):
+        if user_id not in self.users:
+            raise IntegrityError(None, None, ValueError(f'{constraint}: no user {user_id}'))
+
+    def add_tweet(self, user_id, tweet):
+        self.check_user(user_id, 'tweets.user_id')
+
+        tweet_id = len(self.tweets) + 1
+        self.tweets.append((tweet_id, user_id, tweet, self.now()))
+        self.user_tweets.setdefault(user_id, []).append(tweet_id)
+
+        return tweet_id
+
+    def bump_follow_version(self, user_id):
+        user = self.users.get(user_id)
+        if user is not None:
+            user['follow_version'] += 1
+            user['follows_updated_at'] = self.now()
+
+    ## Tweet ids of a user's timeline (own tweets and tweets of followed users) with
+    ## id <= max_id and id > since_id, one ascending list per author.
+    def timeline_id_lists(self, user_id, max_id=None, since_id=None):
+        authors = {user_id} | self.followees.get(user_id, set())
+        id_lists = []
+        for author_id in authors:
+            tweet_ids = self.user_tweets.get(author_id)
+            if not tweet_ids:
+                continue
+
+            start = 0 if since_id is None else bisect.bisect_right(tweet_ids, since_id)
+            end = len(tweet_ids) if max_id is None else bisect.bisect_right(tweet_ids, max_id)
+            if start < end:
+                id_lists.append(tweet_ids[start:end])
+
+        return id_lists
+
+    def stats(self):
+        with self.lock:
+            return {
+                'users': len(self.users),
+                'tweets': len(self.tweets),
+                'follows': sum(len(followees) for followees in self.followees.values())
+            }
+
+
+class MemoryUserDao:
+    def __init__(self, store):
+        self.store = store
+
+    def insert_user(self, user):
+        hashed_password = user['password']
+        if isinstance(hashed_password, bytes):
+            hashed_password = hashed_password.decode('utf-8')
+
+        store = self.store
+        with store.lock:
+            if user['email'] in store.emails:
+                raise IntegrityError(None, None, ValueError(f"users.email: duplicate {user['email']}"))
+
+            user_id = store.last_user_id = store.last_user_id + 1
+            store.users[user_id] = {
+                'id': user_id,
+                'name': user['name'],
+                'email': user['email'],
+                'hashed_password': hashed_password,
+                'profile': user['profile'],
+                'profile_picture': None,
+                'profile_picture_hash': None,
+                'follow_version': 0,
+                'follows_updated_at': None,
+                'created_at': store.now()
+            }
+            store.emails[user['email']] = user_id
+
+        return user_id
+
+    def get_user_id_and_password(self, email):
+        with self.store.lock:
+            user = self.store.users.get(self.store.emails.get(email))
+
+            return {
+                'id': user['id'],
+                'hashed_password': user['hashed_password']
+            } if user else None
+
+    def update_password(self, email, hashed_password):
+        if isinstance(hashed_password, bytes):
+            hashed_password = hashed_password.decode('utf-8')
+
+        with self.store.lock:
+            user = self.store.users.get(self.store.emails.get(email))
+            if user is None:
+                return 0
+
+            user['hashed_password'] = hashed_password
+            return 1
+
+    def insert_follow(self, user_id, follow_id):
+        store = self.store
+        with store.lock:
+            store.check_user(user_id, 'users_follow_list.user_id')
+            store.check_user(follow_id, 'users_follow_list.follow_user_id')
+            followees = store.followees.setdefault(user_id, set())
+            if follow_id in followees:
+                raise IntegrityError(None, None, ValueError(f'users_follow_list: duplicate ({user_id}, {follow_id})'))
+
+            followees.add(follow_id)
+            store.followers.setdefault(follow_id, set()).add(user_id)
+            store.bump_follow_version(user_id)
+
+        return 1
+
+    def insert_unfollow(self, user_id, unfollow_id):
+        store = self.store
+        with store.lock:
+            followees = store.followees.get(user_id, set())
+            if unfollow_id not in followees:
+                return 0
+
+            followees.discard(unfollow_id)
+            store.followers[unfollow_id].discard(user_id)
+            store.bump_follow_version(user_id)
+
+        return 1
+
+    ## Same as UserDao.insert_follows: returns the ids that were added.
+    def insert_follows(self, user_id, follow_ids):
+        store = self.store
+        with store.lock:
+            followees = store.followees.get(user_id, set())
+            new_follow_ids = sorted({follow_id for follow_id in follow_ids if follow_id in store.users} - followees)
+            if new_follow_ids:
+                store.check_user(user_id, 'users_follow_list.user_id')
+                store.followees.setdefault(user_id, set()).update(new_follow_ids)
+                for follow_id in new_follow_ids:
+                    store.followers.setdefault(follow_id, set()).add(user_id)
+                store.bump_follow_version(user_id)
+
+        return new_follow_ids
+
+    def insert_unfollows(self, user_id, unfollow_ids):
+        store = self.store
+        with store.lock:
+            followees = store.followees.get(user_id, set())
+            removed_ids = sorted(followees.intersection(unfollow_ids))
+            if removed_ids:
+                followees.difference_update(removed_ids)
+                for unfollow_id in removed_ids:
+                    store.followers[unfollow_id].discard(user_id)
+                store.bump_follow_version(user_id)
+
+        return removed_ids
+
+    def save_profile_picture(self, profile_pic_path, user_id, picture_hash=None):
+        with self.store.lock:
+            user = self.store.users.get(user_id)
+            if user is None:
+                return 0
+
+            user['profile_picture'] = profile_pic_path
+            user['profile_picture_hash'] = picture_hash
+            return 1
+
+    def get_profile_picture(self, user_id):
+        with self.store.lock:
+            user = self.store.users.get(user_id)
+
+            return user['profile_picture'] if user else None
+
+    def get_profile_picture_file(self, user_id):
+        with self.store.lock:
+            user = self.store.users.get(user_id)
+
+            return {
+                'path': user['profile_picture'],
+                'hash': user['profile_picture_hash']
+            } if user and user['profile_picture'] else None
+
+
+class MemoryTweetDao:
+    def __init__(self, store):
+        self.store = store
+
+    def insert_tweet(self, user_id, tweet):
+        with self.store.lock:
+            return self.store.add_tweet(user_id, tweet)
+
+    def insert_tweets(self, user_id, tweets):
+        if not tweets:
+            return []
+
+        return self.insert_tweet_groups({user_id: tweets})[user_id]
+
+    ## All or nothing, like the transaction of TweetDao.insert_tweet_groups.
+    def insert_tweet_groups(self, groups):
+        groups = {user_id: tweets for user_id, tweets in groups.items() if tweets}
+
+        store = self.store
+        with store.lock:
+            for user_id in groups:
+                store.check_user(user_id, 'tweets.user_id')
+
+            return {user_id: [store.add_tweet(user_id, tweet) for tweet in tweets]
+                    for user_id, tweets in groups.items()}
+
+    def get_timeline(self, user_id):
+        return list(self.iter_timeline(user_id))
+
+    def get_follower_ids(self, user_id):
+        with self.store.lock:
+            return list(self.store.followers.get(user_id, ()))
+
+    ## See TweetDao.get_timeline_version
+    def get_timeline_version(self, user_id):
+        store = self.store
+        with store.lock:
+            user = store.users.get(user_id)
+            if user is None:
+                return None
+
+            authors = {user_id} | store.followees.get(user_id, set())
+            max_tweet_id = max((store.user_tweets[author_id][-1] for author_id in authors
+                                if store.user_tweets.get(author_id)), default=0)
+            modified_at = user['follows_updated_at']
+            if max_tweet_id:
+                created_at = store.tweets[max_tweet_id - 1][3]
+                if modified_at is None or created_at > modified_at:
+                    modified_at = created_at
+
+            return {
+                'max_tweet_id': max_tweet_id,
+                'follow_version': user['follow_version'],
+                'modified_at': modified_at
+            }
+
+    ## Newest first: the per-author id lists merged from their ends.
+    def get_timeline_page(self, user_id, limit, max_id=None, since_id=None):
+        store = self.store
+        with store.lock:
+            id_lists = [tweet_ids[-limit:] for tweet_ids in store.timeline_id_lists(user_id, max_id, since_id)]
+            tweet_ids = itertools.islice(heapq.merge(*(reversed(ids) for ids in id_lists), reverse=True), limit)
+
+            return [dict(zip(('id', 'user_id', 'tweet'), store.tweets[tweet_id - 1])) for tweet_id in tweet_ids]
+
+    ## The timeline as of the call, oldest first. Only the tweet ids are copied up front.
+    def iter_timeline(self, user_id, max_id=None, since_id=None, batch_size=500):
+        store = self.store
+        with store.lock:
+            id_lists = store.timeline_id_lists(user_id, max_id, since_id)
+
+        for tweet_id in heapq.merge(*id_lists):
+            _, author_id, tweet, _ = store.tweets[tweet_id - 1]
+            yield {
+                'user_id': author_id,
+                'tweet': tweet
+            }
+
+    def get_timeline_entries(self, user_id, limit):
+        return [(tweet['id'], tweet['user_id']) for tweet in self.get_timeline_page(user_id, limit)]
+
+    def get_user_tweet_entries(self, user_id, limit):
+        with self.store.lock:
+            tweet_ids = self.store.user_tweets.get(user_id, [])[-limit:]
+
+        return [(tweet_id, user_id) for tweet_id in reversed(tweet_ids)]
+
+    def get_tweets(self, tweet_ids):
+        tweets = self.store.tweets
+        with self.store.lock:
+            return [{
+                'user_id': tweets[tweet_id - 1][1],
+                'tweet': tweets[tweet_id - 1][2]
+            } for tweet_id in tweet_ids if 0 < tweet_id <= len(tweets)]
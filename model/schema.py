@@ -0,0 +1,170 @@
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        MetaData, String, Table, func, inspect, text)
+
+from .tweet_dao import TweetDao
+
+## Bump SCHEMA_VERSION and append a step to MIGRATIONS for every schema change.
+## The version a database is at is kept in the schema_version table.
+SCHEMA_VERSION = 6
+
+metadata = MetaData()
+
+users = Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('email', String(255), nullable=False, unique=True),
+    Column('hashed_password', String(255), nullable=False),
+    Column('profile', String(2000), nullable=False),
+    Column('profile_picture', String(255)),
+    ## sha256 of the picture, see service.PictureStorage
+    Column('profile_picture_hash', String(64)),
+    ## Bumped on every follow / unfollow, part of the timeline validator (TweetDao.get_timeline_version)
+    Column('follow_version', Integer, nullable=False, server_default=text('0')),
+    Column('follows_updated_at', DateTime),
+    Column('created_at', DateTime, nullable=False, server_default=func.now()),
+)
+
+tweets = Table(
+    'tweets', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('tweet', String(300), nullable=False),
+    Column('created_at', DateTime, nullable=False, server_default=func.now()),
+    ## A user's tweets, newest first: own timeline branch and fan-out backfill
+    Index('ix_tweets_user_id_id', 'user_id', 'id'),
+)
+
+users_follow_list = Table(
+    'users_follow_list', metadata,
+    ## The primary key is the (user_id, follow_user_id) index of the followed-ids lookup,
+    ## and what UserDao.insert_follows relies on to skip existing follows (see add_follow_list_key)
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('follow_user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('created_at', DateTime, nullable=False, server_default=func.now()),
+    ## Followers of a user: fan-out on write
+    Index('ix_users_follow_list_follow_user_id', 'follow_user_id', 'user_id'),
+)
+
+home_timeline_users = Table(
+    'home_timeline_users', metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('truncated', Boolean, nullable=False, server_default=text('0')),
+)
+
+home_timelines = Table(
+    'home_timelines', metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('tweet_id', Integer, primary_key=True),
+    Column('author_id', Integer, nullable=False),
+    Index('ix_home_timelines_user_id_author_id', 'user_id', 'author_id'),
+)
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, nullable=False),
+)
+
+
+########################################################################
+#           Migrations
+########################################################################
+def create_base_tables(connection):
+    metadata.create_all(connection, tables=[users, tweets, users_follow_list])
+
+def create_timeline_indexes(connection):
+    for table in (tweets, users_follow_list):
+        existing = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+def create_home_timeline_tables(connection):
+    metadata.create_all(connection, tables=[home_timeline_users, home_timelines])
+
+def add_profile_picture_hash(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('users')}
+    if 'profile_picture_hash' not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN profile_picture_hash VARCHAR(64)"))
+
+def add_follow_version(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('users')}
+    if 'follow_version' not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN follow_version INTEGER NOT NULL DEFAULT 0"))
+    if 'follows_updated_at' not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN follows_updated_at DATETIME"))
+
+## Tables created before this schema was managed may lack the (user_id, follow_user_id)
+## primary key, which create_all doesn't add to an existing table. Adds it as a unique index.
+def add_follow_list_key(connection):
+    keys = [inspect(connection).get_pk_constraint('users_follow_list')['constrained_columns']]
+    keys += [index['column_names'] for index in inspect(connection).get_indexes('users_follow_list')
+             if index['unique']]
+    if ['user_id', 'follow_user_id'] not in keys:
+        connection.execute(text("""
+                CREATE UNIQUE INDEX ix_users_follow_list_user_id_follow_user_id
+                ON users_follow_list (user_id, follow_user_id)
+            """))
+
+MIGRATIONS = [
+    (1, create_base_tables),
+    (2, create_timeline_indexes),
+    (3, create_home_timeline_tables),
+    (4, add_profile_picture_hash),
+    (5, add_follow_version),
+    (6, add_follow_list_key),
+]
+
+
+def get_schema_version(database):
+    if not inspect(database).has_table('schema_version'):
+        return 0
+
+    return database.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+## Bring the database up to SCHEMA_VERSION. Returns the list of applied versions.
+def migrate(database):
+    metadata.create_all(database, tables=[schema_version])
+    current = get_schema_version(database)
+
+    applied = []
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+
+        with database.begin() as connection:
+            step(connection)
+            connection.execute(schema_version.delete())
+            connection.execute(schema_version.insert(), {'version': version})
+        applied.append(version)
+
+    return applied
+
+
+########################################################################
+#           Query plan check
+########################################################################
+## EXPLAIN the timeline page query and return the plan steps that read
+## tweets or users_follow_list without an index. An empty list means
+## every branch is an index lookup or range scan.
+def check_timeline_plan(database, user_id=1, limit=50, max_id=None, since_id=None):
+    query = TweetDao(database).timeline_page_query(max_id, since_id)
+    params = {
+        'user_id': user_id,
+        'limit': limit,
+        'max_id': max_id,
+        'since_id': since_id
+    }
+
+    if database.dialect.name == 'sqlite':
+        rows = database.execute(text('EXPLAIN QUERY PLAN ' + query.text), params).fetchall()
+
+        return [row['detail'] for row in rows
+                if row['detail'].startswith('SCAN')
+                and row['detail'].split()[1] in ('t', 'ufl')]
+
+    rows = database.execute(text('EXPLAIN ' + query.text), params).fetchall()
+
+    return [dict(row) for row in rows
+            if row['table'] in ('t', 'ufl')
+            and (row['type'] in ('ALL', 'index') or row['key'] is None)]
@@ -0,0 +1,330 @@
+import bisect
+import sys
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, text
+
+
+## Home timeline stores (fan-out on write).
+## Every user's home timeline is kept as a bounded list of (tweet_id, author_id)
+## pairs, so reading a timeline doesn't have to join tweets and users_follow_list.
+## A timeline is materialized (built from the tweets table) on its first read.
+## push/backfill/trim skip timelines that aren't materialized yet, because the
+## rebuild will see those changes anyway.
+## A timeline that lost its oldest entries to the length bound is 'truncated'.
+## get() returns None when a page reaches past the oldest entry of a truncated
+## timeline, and the caller reads that page from the tweets table instead.
+## Both stores have the same methods: get, push, backfill, trim, replace and rebuild.
+
+
+## In-process store. Only consistent when a single process serves the app,
+## because tweets posted through another process are never pushed into it.
+## At most max_users timelines are kept; the least recently read one is dropped
+## first (pushes don't count, or followers who never read would stay forever)
+## and rebuilt on its next read.
+class InMemoryTimelineStore:
+    def __init__(self, tweet_dao, max_length=800, max_users=10000):
+        self.tweet_dao = tweet_dao
+        self.max_length = max_length
+        self.max_users = max_users
+        self.timelines = OrderedDict()
+        self.truncated = set()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, count, max_id=None, since_id=None):
+        with self.lock:
+            timeline = self.timelines.get(user_id)
+            if timeline is not None:
+                self.timelines.move_to_end(user_id)
+
+        ## Rebuilt when it isn't materialized, or was dropped since
+        if timeline is None:
+            timeline = self.rebuild(user_id)
+
+        with self.lock:
+            end = len(timeline) if max_id is None else bisect.bisect_right(timeline, (max_id, sys.maxsize))
+            start = 0 if since_id is None else bisect.bisect_right(timeline, (since_id, sys.maxsize))
+            page = timeline[max(start, end - count):end]
+
+            if len(page) < count and start == 0 and user_id in self.truncated:
+                return None
+
+            return [tweet_id for tweet_id, _ in reversed(page)]
+
+    def push(self, user_ids, tweet_id, author_id):
+        with self.lock:
+            for user_id in user_ids:
+                timeline = self.timelines.get(user_id)
+                if timeline is None:
+                    continue
+
+                self._insert(user_id, timeline, (tweet_id, author_id))
+
+    def backfill(self, user_id, author_id):
+        with self.lock:
+            if user_id not in self.timelines:
+                return
+
+        entries = self.tweet_dao.get_user_tweet_entries(author_id, self.max_length)
+
+        with self.lock:
+            timeline = self.timelines.get(user_id)
+            if timeline is None:
+                return
+
+            for entry in entries:
+                self._insert(user_id, timeline, entry)
+
+            if len(entries) >= self.max_length:
+                self.truncated.add(user_id)
+
+    def trim(self, user_id, author_id):
+        with self.lock:
+            timeline = self.timelines.get(user_id)
+            if timeline is None:
+                return
+
+            timeline[:] = [entry for entry in timeline if entry[1] != author_id]
+
+    def replace(self, user_id, entries, truncated):
+        timeline = sorted(set(entries))[-self.max_length:]
+
+        with self.lock:
+            self.timelines[user_id] = timeline
+            self.timelines.move_to_end(user_id)
+
+            if truncated:
+                self.truncated.add(user_id)
+            else:
+                self.truncated.discard(user_id)
+
+            while len(self.timelines) > self.max_users:
+                dropped_id, _ = self.timelines.popitem(last=False)
+                self.truncated.discard(dropped_id)
+
+        return timeline
+
+    ## The timeline's entries, as stored
+    def rebuild(self, user_id):
+        entries = self.tweet_dao.get_timeline_entries(user_id, self.max_length)
+
+        return self.replace(user_id, entries, len(entries) >= self.max_length)
+
+    ## Timelines are kept in ascending tweet id order, so a new tweet is
+    ## usually appended at the end and the oldest ones fall off the front.
+    def _insert(self, user_id, timeline, entry):
+        if timeline and timeline[-1][0] < entry[0]:
+            timeline.append(entry)
+        else:
+            index = bisect.bisect_left(timeline, entry)
+            if index < len(timeline) and timeline[index] == entry:
+                return
+            timeline.insert(index, entry)
+
+        if len(timeline) > self.max_length:
+            del timeline[:len(timeline) - self.max_length]
+            self.truncated.add(user_id)
+
+
+## Table backed store. Shared by every process pointing at the same database.
+## home_timeline_users marks which timelines are materialized (and truncated),
+## and home_timelines holds their entries, keyed by (user_id, tweet_id).
+class TableTimelineStore:
+    def __init__(self, database, tweet_dao, max_length=800):
+        self.db = database
+        self.tweet_dao = tweet_dao
+        self.max_length = max_length
+
+    def get(self, user_id, count, max_id=None, since_id=None):
+        row = self.db.execute(text("""
+                SELECT truncated
+                FROM home_timeline_users
+                WHERE user_id = :user_id
+            """), {'user_id': user_id}).fetchone()
+
+        if row is None:
+            truncated = len(self.rebuild(user_id)) >= self.max_length
+        else:
+            truncated = bool(row['truncated'])
+
+        conditions = ''
+        if max_id is not None:
+            conditions += ' AND tweet_id <= :max_id'
+        if since_id is not None:
+            conditions += ' AND tweet_id > :since_id'
+
+        rows = self.db.execute(text(f"""
+                SELECT tweet_id
+                FROM home_timelines
+                WHERE user_id = :user_id{conditions}
+                ORDER BY tweet_id DESC
+                LIMIT :count
+            """), {
+                'user_id': user_id,
+                'count': count,
+                'max_id': max_id,
+                'since_id': since_id
+            }).fetchall()
+
+        if len(rows) < count and truncated:
+            oldest = self.db.execute(text("""
+                    SELECT MIN(tweet_id) AS tweet_id
+                    FROM home_timelines
+                    WHERE user_id = :user_id
+                """), {'user_id': user_id}).fetchone()['tweet_id']
+
+            if since_id is None or oldest is None or oldest > since_id:
+                return None
+
+        return [row['tweet_id'] for row in rows]
+
+    def push(self, user_ids, tweet_id, author_id):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+
+        with self.db.begin() as connection:
+            connection.execute(text("""
+                    INSERT INTO home_timelines (
+                        user_id,
+                        tweet_id,
+                        author_id
+                    )
+                    SELECT
+                        htu.user_id,
+                        :tweet_id,
+                        :author_id
+                    FROM home_timeline_users htu
+                    WHERE htu.user_id IN :user_ids
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM home_timelines ht
+                        WHERE ht.user_id = htu.user_id AND ht.tweet_id = :tweet_id
+                    )
+                """).bindparams(bindparam('user_ids', expanding=True)), {
+                    'user_ids': user_ids,
+                    'tweet_id': tweet_id,
+                    'author_id': author_id
+                })
+            self._cut_to_length(connection, user_ids)
+
+    def backfill(self, user_id, author_id):
+        entries = self.tweet_dao.get_user_tweet_entries(author_id, self.max_length)
+        if not entries:
+            return
+
+        with self.db.begin() as connection:
+            connection.execute(text("""
+                    INSERT INTO home_timelines (
+                        user_id,
+                        tweet_id,
+                        author_id
+                    )
+                    SELECT
+                        htu.user_id,
+                        :tweet_id,
+                        :author_id
+                    FROM home_timeline_users htu
+                    WHERE htu.user_id = :user_id
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM home_timelines ht
+                        WHERE ht.user_id = :user_id AND ht.tweet_id = :tweet_id
+                    )
+                """), [{
+                    'user_id': user_id,
+                    'tweet_id': tweet_id,
+                    'author_id': author_id
+                } for tweet_id, author_id in entries])
+
+            if len(entries) >= self.max_length:
+                connection.execute(text("""
+                        UPDATE home_timeline_users
+                        SET truncated = 1
+                        WHERE user_id = :user_id
+                    """), {'user_id': user_id})
+            self._cut_to_length(connection, [user_id])
+
+    ## Deletes the entries of user_ids below their newest max_length, and marks the
+    ## timelines that lost entries as truncated. Ranks only the timelines of user_ids,
+    ## each at most max_length + the entries just added, on the (user_id, tweet_id) key.
+    def _cut_to_length(self, connection, user_ids):
+        rows = connection.execute(text("""
+                SELECT user_id, tweet_id FROM (
+                    SELECT
+                        user_id,
+                        tweet_id,
+                        ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY tweet_id DESC) AS position
+                    FROM home_timelines
+                    WHERE user_id IN :user_ids
+                ) ranked
+                WHERE position > :max_length
+            """).bindparams(bindparam('user_ids', expanding=True)), {
+                'user_ids': list(user_ids),
+                'max_length': self.max_length
+            }).fetchall()
+        if not rows:
+            return
+
+        connection.execute(text("""
+                DELETE FROM home_timelines
+                WHERE user_id = :user_id AND tweet_id = :tweet_id
+            """), [{'user_id': row['user_id'], 'tweet_id': row['tweet_id']} for row in rows])
+        connection.execute(text("""
+                UPDATE home_timeline_users
+                SET truncated = 1
+                WHERE user_id IN :user_ids
+            """).bindparams(bindparam('user_ids', expanding=True)), {
+                'user_ids': sorted({row['user_id'] for row in rows})
+            })
+
+    def trim(self, user_id, author_id):
+        self.db.execute(text("""
+                DELETE FROM home_timelines
+                WHERE user_id = :user_id AND author_id = :author_id
+            """), {'user_id': user_id, 'author_id': author_id})
+
+    def replace(self, user_id, entries, truncated):
+        with self.db.begin() as connection:
+            connection.execute(text("""
+                    DELETE FROM home_timelines
+                    WHERE user_id = :user_id
+                """), {'user_id': user_id})
+
+            if entries:
+                connection.execute(text("""
+                        INSERT INTO home_timelines (
+                            user_id,
+                            tweet_id,
+                            author_id
+                        ) VALUES (
+                            :user_id,
+                            :tweet_id,
+                            :author_id
+                        )
+                    """), [{
+                        'user_id': user_id,
+                        'tweet_id': tweet_id,
+                        'author_id': author_id
+                    } for tweet_id, author_id in set(entries)])
+
+            connection.execute(text("""
+                    DELETE FROM home_timeline_users
+                    WHERE user_id = :user_id
+                """), {'user_id': user_id})
+            connection.execute(text("""
+                    INSERT INTO home_timeline_users (
+                        user_id,
+                        truncated
+                    ) VALUES (
+                        :user_id,
+                        :truncated
+                    )
+                """), {'user_id': user_id, 'truncated': int(truncated)})
+
+    def rebuild(self, user_id):
+        entries = self.tweet_dao.get_timeline_entries(user_id, self.max_length)
+        self.replace(user_id, entries, len(entries) >= self.max_length)
+
+        return entries
@@ -1,12 +1,16 @@
-from sqlalchemy import text
+from datetime import timedelta, timezone
 
+from sqlalchemy import DateTime, bindparam, text
 
-class TweetDao:
-    def __init__(self, database):
-        self.db = database
-    
+from .database import RoutedDao
+
+
+## Reads go through reader() (a replica with a ReplicaRouter), writes to self.db.
+## The reads that fill the home timeline store (get_follower_ids, get_timeline_entries,
+## get_user_tweet_entries) stay on the primary: a stale result would stay in the store.
+class TweetDao(RoutedDao):
     def insert_tweet(self, user_id, tweet):
-        return self.db.execute(text("""
+        tweet_id = self.db.execute(text("""
                 INSERT INTO tweets (
                     user_id,
                     tweet
@@ -17,19 +21,285 @@ class TweetDao:
             """), {
                 'id': user_id,
                 'tweet': tweet
-            }).rowcount
+            }).lastrowid
+        self.wrote(user_id)
+        
+        return tweet_id
+        
+    ## Inserts all tweets of one author in one transaction.
+    ## Returns their ids in insert order.
+    def insert_tweets(self, user_id, tweets):
+        if not tweets:
+            return []
+        
+        return self.insert_tweet_groups({user_id: tweets})[user_id]
+    
+    ## Inserts the tweets of several authors ({user_id: [tweet, ...]}) with one multi-row
+    ## INSERT and returns their ids as {user_id: [tweet_id, ...]} in insert order.
+    ## The ids of one statement are consecutive (InnoDB allocates the ids of a multi-row
+    ## INSERT of known size at once, and SQLite has a single writer), so they follow from
+    ## lastrowid and the row count: MySQL reports the first row's id, SQLite the last one's.
+    def insert_tweet_groups(self, groups):
+        groups = {user_id: tweets for user_id, tweets in groups.items() if tweets}
+        if not groups:
+            return {}
+        
+        rows = [(user_id, tweet) for user_id, tweets in groups.items() for tweet in tweets]
+        values = ',\n'.join(f'(:user_id_{i}, :tweet_{i})' for i in range(len(rows)))
+        params = {}
+        for i, (user_id, tweet) in enumerate(rows):
+            params[f'user_id_{i}'] = user_id
+            params[f'tweet_{i}'] = tweet
+        
+        with self.db.begin() as connection:
+            result = connection.execute(text(f"""
+                    INSERT INTO tweets (
+                        user_id,
+                        tweet
+                    ) VALUES {values}
+                """), params)
+            first_id = result.lastrowid
+            if connection.dialect.name == 'sqlite':
+                first_id -= len(rows) - 1
+        self.wrote(*groups)
         
+        tweet_ids = iter(range(first_id, first_id + len(rows)))
+        
+        return {user_id: [next(tweet_ids) for _ in tweets] for user_id, tweets in groups.items()}
+        
+    ## The author's own tweets UNION the tweets of the users they follow.
+    ## Each branch is an index range scan, on tweets (user_id, id) and on
+    ## users_follow_list (user_id, follow_user_id) -> tweets (user_id, id).
     def get_timeline(self, user_id):
-        timeline = self.db.execute(text("""
+        timeline = self.reader(user_id).execute(text("""
                 SELECT
+                    t.id,
                     t.user_id,
                     t.tweet
                 FROM tweets t
-                LEFT JOIN users_follow_list ufl ON ufl.user_id = :user_id
-                WHERE t.user_id = :user_id OR t.user_id = ufl.follow_user_id
+                WHERE t.user_id = :user_id
+                UNION ALL
+                SELECT
+                    t.id,
+                    t.user_id,
+                    t.tweet
+                FROM users_follow_list ufl
+                JOIN tweets t ON t.user_id = ufl.follow_user_id
+                WHERE ufl.user_id = :user_id AND ufl.follow_user_id <> :user_id
+                ORDER BY id
             """), {'user_id': user_id}).fetchall()
         
         return [{
             'user_id': tweet['user_id'],
             'tweet': tweet['tweet']
-        } for tweet in timeline]
\ No newline at end of file
+        } for tweet in timeline]
+    
+    def get_follower_ids(self, user_id):
+        rows = self.db.execute(text("""
+                SELECT user_id
+                FROM users_follow_list
+                WHERE follow_user_id = :user_id
+            """), {'user_id': user_id}).fetchall()
+        
+        return [row['user_id'] for row in rows]
+    
+    ## Seconds to add to a CURRENT_TIMESTAMP / now() value to get UTC. MySQL writes them in
+    ## the session time zone; SQLite always in UTC.
+    @staticmethod
+    def _utc_offset(dialect):
+        if dialect.name == 'sqlite':
+            return '0'
+        
+        return 'TIMESTAMPDIFF(SECOND, NOW(), UTC_TIMESTAMP())'
+    
+    ## Validator of a user's timeline: the newest tweet id on it, the user's follow_version
+    ## and when either last changed, as an aware UTC datetime. Both change whenever the
+    ## timeline does (tweets are never edited or deleted). The newest followed tweet is one
+    ## (user_id, id) index probe per followed user, so this stays cheap next to the timeline
+    ## query. None for unknown users.
+    def get_timeline_version(self, user_id):
+        database = self.reader(user_id)
+        row = database.execute(text(f"""
+                SELECT
+                    u.follow_version,
+                    u.follows_updated_at,
+                    {self._utc_offset(database.dialect)} AS utc_offset,
+                    (
+                        SELECT MAX(t.id)
+                        FROM tweets t
+                        WHERE t.user_id = u.id
+                    ) AS own_max_id,
+                    (
+                        SELECT MAX((
+                            SELECT MAX(t.id)
+                            FROM tweets t
+                            WHERE t.user_id = ufl.follow_user_id
+                        ))
+                        FROM users_follow_list ufl
+                        WHERE ufl.user_id = u.id AND ufl.follow_user_id <> u.id
+                    ) AS followed_max_id
+                FROM users u
+                WHERE u.id = :user_id
+            """).columns(follows_updated_at=DateTime), {'user_id': user_id}).fetchone()
+        
+        if row is None:
+            return None
+        
+        max_tweet_id = max(row['own_max_id'] or 0, row['followed_max_id'] or 0)
+        modified_at = row['follows_updated_at']
+        if max_tweet_id:
+            created_at = database.execute(text("""
+                    SELECT created_at
+                    FROM tweets
+                    WHERE id = :id
+                """).columns(created_at=DateTime), {'id': max_tweet_id}).scalar()
+            if created_at is not None and (modified_at is None or created_at > modified_at):
+                modified_at = created_at
+        if modified_at is not None:
+            modified_at = (modified_at + timedelta(seconds=int(row['utc_offset']))).replace(tzinfo=timezone.utc)
+        
+        return {
+            'max_tweet_id': max_tweet_id,
+            'follow_version': row['follow_version'],
+            'modified_at': modified_at
+        }
+    
+    ## Keyset predicates on the tweet primary key, for cursor based pagination.
+    @staticmethod
+    def _cursor_conditions(max_id, since_id):
+        conditions = ''
+        if max_id is not None:
+            conditions += ' AND t.id <= :max_id'
+        if since_id is not None:
+            conditions += ' AND t.id > :since_id'
+        
+        return conditions
+    
+    ## Same UNION as get_timeline, each branch limited to the page before merging.
+    ## Newest first, or oldest first with ascending=True.
+    @staticmethod
+    def timeline_page_query(max_id=None, since_id=None, ascending=False):
+        conditions = TweetDao._cursor_conditions(max_id, since_id)
+        order = 'ASC' if ascending else 'DESC'
+        
+        return text(f"""
+                SELECT id, user_id, tweet FROM (
+                    SELECT
+                        t.id,
+                        t.user_id,
+                        t.tweet
+                    FROM tweets t
+                    WHERE t.user_id = :user_id{conditions}
+                    ORDER BY t.id {order}
+                    LIMIT :limit
+                ) own_tweets
+                UNION ALL
+                SELECT id, user_id, tweet FROM (
+                    SELECT
+                        t.id,
+                        t.user_id,
+                        t.tweet
+                    FROM users_follow_list ufl
+                    JOIN tweets t ON t.user_id = ufl.follow_user_id
+                    WHERE ufl.user_id = :user_id AND ufl.follow_user_id <> :user_id{conditions}
+                    ORDER BY t.id {order}
+                    LIMIT :limit
+                ) followed_tweets
+                ORDER BY id {order}
+                LIMIT :limit
+            """)
+    
+    ## Newest tweets of a user's timeline (newest first), at most `limit` of them,
+    ## with id <= max_id and id > since_id.
+    def get_timeline_page(self, user_id, limit, max_id=None, since_id=None):
+        return self._get_timeline_page(self.reader(user_id), user_id, limit, max_id, since_id)
+    
+    def _get_timeline_page(self, database, user_id, limit, max_id, since_id):
+        rows = database.execute(self.timeline_page_query(max_id, since_id), {
+                'user_id': user_id,
+                'limit': limit,
+                'max_id': max_id,
+                'since_id': since_id
+            }).fetchall()
+        
+        return [{
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'tweet': row['tweet']
+        } for row in rows]
+    
+    ## Every tweet of a user's timeline with id <= max_id and id > since_id, oldest first,
+    ## without holding the whole timeline in memory: keyset batches of `batch_size` rows,
+    ## each a short query (mysql-connector buffers every result, so one streamed query
+    ## would still be read whole).
+    def iter_timeline(self, user_id, max_id=None, since_id=None, batch_size=500):
+        return self._iter_timeline_batched(self.reader(user_id), user_id, max_id, since_id, batch_size)
+    
+    def _iter_timeline_batched(self, database, user_id, max_id, since_id, batch_size):
+        while True:
+            rows = database.execute(self.timeline_page_query(max_id, since_id, ascending=True), {
+                    'user_id': user_id,
+                    'limit': batch_size,
+                    'max_id': max_id,
+                    'since_id': since_id
+                }).fetchall()
+            
+            for row in rows:
+                yield {
+                    'user_id': row['user_id'],
+                    'tweet': row['tweet']
+                }
+            
+            if len(rows) < batch_size:
+                return
+            since_id = rows[-1]['id']
+    
+    ## (tweet_id, author_id) pairs of the newest tweets on a user's timeline,
+    ## used to build the home timeline store.
+    def get_timeline_entries(self, user_id, limit):
+        return [(tweet['id'], tweet['user_id'])
+                for tweet in self._get_timeline_page(self.db, user_id, limit, None, None)]
+    
+    def get_user_tweet_entries(self, user_id, limit):
+        rows = self.db.execute(text("""
+                SELECT
+                    id,
+                    user_id
+                FROM tweets
+                WHERE user_id = :user_id
+                ORDER BY id DESC
+                LIMIT :limit
+            """), {'user_id': user_id, 'limit': limit}).fetchall()
+        
+        return [(row['id'], row['user_id']) for row in rows]
+    
+    ## Tweets by id, in the order of tweet_ids. The ids come from the timeline store, which
+    ## can be ahead of a replica: ids a replica doesn't have yet are read from the primary.
+    def get_tweets(self, tweet_ids):
+        if not tweet_ids:
+            return []
+        
+        database = self.reader()
+        tweets = self._get_tweets(database, tweet_ids)
+        missing_ids = [tweet_id for tweet_id in tweet_ids if tweet_id not in tweets]
+        if missing_ids and database is not self.db:
+            tweets.update(self._get_tweets(self.db, missing_ids))
+        
+        return [{
+            'user_id': tweets[tweet_id]['user_id'],
+            'tweet': tweets[tweet_id]['tweet']
+        } for tweet_id in tweet_ids if tweet_id in tweets]
+    
+    def _get_tweets(self, database, tweet_ids):
+        rows = database.execute(text("""
+                SELECT
+                    id,
+                    user_id,
+                    tweet
+                FROM tweets
+                WHERE id IN :tweet_ids
+            """).bindparams(bindparam('tweet_ids', expanding=True)), {
+                'tweet_ids': list(tweet_ids)
+            }).fetchall()
+        
+        return {row['id']: row for row in rows}
\ No newline at end of file
@@ -1,12 +1,11 @@
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 
-class UserDao:
-    def __init__(self, database):
-        self.db = database
-    
+from .database import RoutedDao
+
+## Reads go through reader() (a replica with a ReplicaRouter), writes to self.db.
+class UserDao(RoutedDao):
     def insert_user(self, user):
-        print(user)
-        return self.db.execute(text("""
+        user_id = self.db.execute(text("""
                 INSERT INTO users (
                     name,
                     email,
@@ -19,9 +18,12 @@ class UserDao:
                     :password
                 )
             """), user).lastrowid
+        self.wrote(('email', user['email']), user_id)
+        
+        return user_id
         
     def get_user_id_and_password(self, email):
-        row = self.db.execute(text("""
+        row = self.reader(('email', email)).execute(text("""
                 SELECT
                     id,
                     hashed_password
@@ -34,35 +36,160 @@ class UserDao:
             'hashed_password': row['hashed_password']
         } if row else None
         
+    def update_password(self, email, hashed_password):
+        rowcount = self.db.execute(text("""
+                UPDATE users
+                SET hashed_password = :hashed_password
+                WHERE email = :email
+            """), {
+                'email': email,
+                'hashed_password': hashed_password
+            }).rowcount
+        self.wrote(('email', email))
+        
+        return rowcount
+        
+    ## Every change to a user's follow list bumps their follow_version,
+    ## in the same transaction, so cached timelines of that user go stale.
+    @staticmethod
+    def _bump_follow_version(connection, user_id):
+        connection.execute(text("""
+                UPDATE users
+                SET
+                    follow_version = follow_version + 1,
+                    follows_updated_at = CURRENT_TIMESTAMP
+                WHERE id = :id
+            """), {'id': user_id})
+        
     def insert_follow(self, user_id, follow_id):
-        return self.db.execute(text("""
-                INSERT INTO users_follow_list (
+        with self.db.begin() as connection:
+            result = connection.execute(text("""
+                    INSERT INTO users_follow_list (
+                        user_id,
+                        follow_user_id
+                    ) VALUES (
+                        :id,
+                        :follow
+                    )
+                """), {'id': user_id, 'follow': follow_id})
+            self._bump_follow_version(connection, user_id)
+        self.wrote(user_id)
+        
+        return result
+        
+    def insert_unfollow(self, user_id, unfollow_id):
+        with self.db.begin() as connection:
+            rowcount = connection.execute(text("""
+                    DELETE FROM users_follow_list
+                    WHERE user_id = :id AND follow_user_id = :unfollow
+                """), {'id': user_id, 'unfollow': unfollow_id}).rowcount
+            if rowcount:
+                self._bump_follow_version(connection, user_id)
+        self.wrote(user_id)
+        
+        return rowcount
+        
+    ## Multi-row INSERT of (user_id, follow_id) rows that skips follows which already exist
+    ## instead of failing on the users_follow_list primary key
+    @staticmethod
+    def _insert_follows_ignore(dialect, count):
+        values = ', '.join(f'(:id, :follow_{i})' for i in range(count))
+        if dialect.name == 'sqlite':
+            return text(f"""
+                    INSERT INTO users_follow_list (
+                        user_id,
+                        follow_user_id
+                    ) VALUES {values}
+                    ON CONFLICT DO NOTHING
+                """)
+        
+        return text(f"""
+                INSERT IGNORE INTO users_follow_list (
                     user_id,
                     follow_user_id
-                ) VALUES (
-                    :id,
-                    :follow
-                )
-            """), {'id': user_id, 'follow': follow_id})
+                ) VALUES {values}
+            """)
         
-    def insert_unfollow(self, user_id, unfollow_id):
-        return self.db.execute(text("""
-                DELETE FROM users_follow_list
-                WHERE user_id = :id AND follow_user_id = :unfollow
-            """), {'id': user_id, 'unfollow': unfollow_id}).rowcount
+    ## Follows every existing user in follow_ids that isn't followed yet, with one INSERT.
+    ## Returns the ids that weren't followed when the transaction started; a follow added
+    ## by a concurrent request in between is skipped by the INSERT, not reported as an error.
+    def insert_follows(self, user_id, follow_ids):
+        follow_ids = set(follow_ids)
+        if not follow_ids:
+            return []
+        
+        with self.db.begin() as connection:
+            rows = connection.execute(text("""
+                    SELECT
+                        u.id,
+                        ufl.follow_user_id
+                    FROM users u
+                    LEFT JOIN users_follow_list ufl ON ufl.user_id = :id AND ufl.follow_user_id = u.id
+                    WHERE u.id IN :follow_ids
+                """).bindparams(bindparam('follow_ids', expanding=True)), {
+                    'id': user_id,
+                    'follow_ids': list(follow_ids)
+                }).fetchall()
+            
+            new_follow_ids = sorted(row['id'] for row in rows if row['follow_user_id'] is None)
+            if new_follow_ids:
+                params = {f'follow_{i}': follow_id for i, follow_id in enumerate(new_follow_ids)}
+                params['id'] = user_id
+                connection.execute(self._insert_follows_ignore(connection.dialect, len(new_follow_ids)), params)
+                self._bump_follow_version(connection, user_id)
+        self.wrote(user_id)
+        
+        return new_follow_ids
+    
+    ## Unfollows every followed user in unfollow_ids with one DELETE.
+    ## Returns the ids that were removed.
+    def insert_unfollows(self, user_id, unfollow_ids):
+        unfollow_ids = list(set(unfollow_ids))
+        if not unfollow_ids:
+            return []
         
-    def save_profile_picture(self, profile_pic_path, user_id):
-        return self.db.execute(text("""
+        with self.db.begin() as connection:
+            following = connection.execute(text("""
+                    SELECT follow_user_id
+                    FROM users_follow_list
+                    WHERE user_id = :id AND follow_user_id IN :unfollow_ids
+                """).bindparams(bindparam('unfollow_ids', expanding=True)), {
+                    'id': user_id,
+                    'unfollow_ids': unfollow_ids
+                }).fetchall()
+            
+            removed_ids = sorted(row['follow_user_id'] for row in following)
+            if removed_ids:
+                connection.execute(text("""
+                        DELETE FROM users_follow_list
+                        WHERE user_id = :id AND follow_user_id IN :unfollow_ids
+                    """).bindparams(bindparam('unfollow_ids', expanding=True)), {
+                        'id': user_id,
+                        'unfollow_ids': removed_ids
+                    })
+                self._bump_follow_version(connection, user_id)
+        self.wrote(user_id)
+        
+        return removed_ids
+        
+    def save_profile_picture(self, profile_pic_path, user_id, picture_hash=None):
+        rowcount = self.db.execute(text("""
                 UPDATE users
-                SET profile_picture = :profile_pic_path
+                SET
+                    profile_picture = :profile_pic_path,
+                    profile_picture_hash = :picture_hash
                 WHERE id = :user_id
             """), {
                 'user_id': user_id,
-                'profile_pic_path': profile_pic_path 
+                'profile_pic_path': profile_pic_path,
+                'picture_hash': picture_hash
             }).rowcount
+        self.wrote(user_id)
+        
+        return rowcount
         
     def get_profile_picture(self, user_id):
-        row = self.db.execute(text("""
+        row = self.reader(user_id).execute(text("""
                 SELECT profile_picture
                 FROM users
                 WHERE id = :user_id
@@ -70,4 +197,20 @@ class UserDao:
                 'user_id': user_id
             }).fetchone()
         
-        return row['profile_picture'] if row else None
\ No newline at end of file
+        return row['profile_picture'] if row else None
+    
+    def get_profile_picture_file(self, user_id):
+        row = self.reader(user_id).execute(text("""
+                SELECT
+                    profile_picture,
+                    profile_picture_hash
+                FROM users
+                WHERE id = :user_id
+            """), {
+                'user_id': user_id
+            }).fetchone()
+        
+        return {
+            'path': row['profile_picture'],
+            'hash': row['profile_picture_hash']
+        } if row and row['profile_picture'] else None
\ No newline at end of file
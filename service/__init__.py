@@ -1,7 +1,19 @@
 from .user_service import UserService
 from .tweet_service import TweetService
+from .password_hasher import PasswordHasher, PasswordHasherBusy
+from .tweet_buffer import TweetBuffer, TweetBufferFull
+from .thumbnailer import Thumbnailer
+from .async_user_service import AsyncUserService
+from .async_tweet_service import AsyncTweetService
 
 __all__ = [
     'UserService',
-    'TweetService'
+    'TweetService',
+    'PasswordHasher',
+    'PasswordHasherBusy',
+    'TweetBuffer',
+    'TweetBufferFull',
+    'Thumbnailer',
+    'AsyncUserService',
+    'AsyncTweetService'
 ]
\ No newline at end of file
@@ -0,0 +1,23 @@
+## TweetService for the ASGI app. Timelines are always read from the tweets
+## table: the home timeline stores are synchronous and not used here.
+class AsyncTweetService:
+    def __init__(self, tweet_dao):
+        self.tweet_dao = tweet_dao
+        
+    async def tweet(self, user_id, tweet):
+        if len(tweet) > 300:
+            return None
+        
+        return await self.tweet_dao.insert_tweet(user_id, tweet)
+    
+    async def timeline_page(self, user_id, limit, max_id=None, since_id=None):
+        tweets = await self.tweet_dao.get_timeline_page(user_id, limit + 1, max_id, since_id)
+        next_cursor = tweets[limit - 1]['id'] - 1 if len(tweets) > limit else None
+        
+        return {
+            'timeline': [{
+                'user_id': tweet['user_id'],
+                'tweet': tweet['tweet']
+            } for tweet in tweets[:limit][::-1]],
+            'next_cursor': next_cursor
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import jwt
+import os
+from datetime import datetime, timedelta
+
+from .ttl_cache import TTLCache
+from .password_hasher import PasswordHasher
+from .picture_storage import PictureStorage
+
+
+## UserService for the ASGI app, over AsyncUserDao.
+class AsyncUserService:
+    
+    def __init__(self, user_dao, config, password_hasher=None):
+        self.user_dao = user_dao
+        self.config = config
+        self.password_hasher = password_hasher or PasswordHasher()
+        self.credential_cache = TTLCache(config.get('CREDENTIAL_CACHE_SIZE', 0),
+                                         config.get('CREDENTIAL_CACHE_TTL', 30))
+        self.picture_storage = PictureStorage(config.get('UPLOAD_DIRECTORY'))
+        self.picture_cache = TTLCache(config.get('PROFILE_PICTURE_CACHE_SIZE', 0),
+                                      config.get('PROFILE_PICTURE_CACHE_TTL', 60))
+        
+    async def create_new_user(self, new_user):
+        new_user['password'] = await self.password_hasher.hash_async(new_user['password'])
+        new_user_id = await self.user_dao.insert_user(new_user)
+        self.credential_cache.invalidate(new_user['email'])
+
+        return new_user_id
+
+    async def login(self, credential):
+        email = credential['email']
+        password = credential['password']
+        user_credential = await self.get_user_id_and_password(email)
+        
+        authorized = user_credential and await self.password_hasher.check_async(password,
+                                                                                user_credential['hashed_password'])
+        if not authorized:
+            return None
+        
+        return {
+            'user_id': user_credential['id'],
+            'access_token': self.generate_access_token(user_credential['id'])
+        }
+    
+    async def get_user_id_and_password(self, user_email):
+        user_credential = self.credential_cache.get(user_email)
+        if user_credential is None:
+            user_credential = await self.user_dao.get_user_id_and_password(user_email)
+            if user_credential is not None:
+                self.credential_cache.put(user_email, user_credential)
+        
+        return user_credential
+    
+    async def change_password(self, email, new_password):
+        hashed_password = await self.password_hasher.hash_async(new_password)
+        result = await self.user_dao.update_password(email, hashed_password)
+        self.credential_cache.invalidate(email)
+        
+        return result
+    
+    def generate_access_token(self, user_id):
+        payload = {
+            'user_id': user_id,
+            'exp': datetime.utcnow() + timedelta(seconds=60*60*24)
+        }
+        token = jwt.encode(payload, self.config['JWT_SECRET_KEY'], 'HS256')
+        
+        return token
+        
+    async def follow(self, user_id, follow_id):
+        return await self.user_dao.insert_follow(user_id, follow_id)
+    
+    async def unfollow(self, user_id, unfollow_id):
+        return await self.user_dao.insert_unfollow(user_id, unfollow_id)
+    
+    ## File I/O and hashing run in the default thread pool, off the event loop.
+    async def save_profile_picture(self, picture, filename, user_id):
+        extension = os.path.splitext(filename)[1]
+        picture_hash, profile_pic_path = await asyncio.get_running_loop().run_in_executor(
+            None, self.picture_storage.save, picture.stream, extension)
+        
+        result = await self.user_dao.save_profile_picture(profile_pic_path, user_id, picture_hash)
+        self.picture_cache.invalidate(user_id)
+        
+        return result
+    
+    async def get_profile_picture(self, user_id):
+        return await self.user_dao.get_profile_picture(user_id)
+    
+    ## Path, strong ETag (content hash) and stored file name of a user's picture, cached per user id.
+    ## Pictures stored before content addressing have no name, and are hashed on their first request.
+    async def get_profile_picture_file(self, user_id):
+        picture_file = self.picture_cache.get(user_id)
+        if picture_file is not None:
+            return picture_file
+        
+        picture = await self.user_dao.get_profile_picture_file(user_id)
+        if picture is None:
+            return None
+        
+        if picture['hash'] is None:
+            try:
+                picture['hash'] = await asyncio.get_running_loop().run_in_executor(
+                    None, self.picture_storage.hash_file, picture['path'])
+            except FileNotFoundError:
+                return None
+        
+        picture_file = {
+            'path': picture['path'],
+            'etag': picture['hash'],
+            'name': self.picture_storage.name_of(picture['path'], picture['hash'])
+        }
+        self.picture_cache.put(user_id, picture_file)
+        
+        return picture_file
+    
+    async def get_stored_picture(self, name):
+        path = self.picture_storage.find(name)
+        
+        return {'path': path, 'etag': name, 'name': name} if path else None
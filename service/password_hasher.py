@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+## Run in the worker processes, so they have to be module level functions.
+def hash_password(password):
+    return bcrypt.hashpw(password, bcrypt.gensalt())
+
+def check_password(password, hashed_password):
+    return bcrypt.checkpw(password, hashed_password)
+
+
+## bcrypt is slow on purpose and holds the worker's CPU while it runs.
+## PasswordHasher runs it in a bounded process pool instead: at most
+## max_workers hashes run at once and max_queue more wait for a worker.
+## Anything beyond that raises PasswordHasherBusy right away instead of queueing.
+## With max_workers = 0 bcrypt runs inline on the calling thread.
+class PasswordHasher:
+    def __init__(self, max_workers=0, max_queue=0):
+        self.max_workers = max_workers
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue) if max_workers else None
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run(hash_password, password.encode('UTF-8'))
+
+    def check(self, password, hashed_password):
+        if isinstance(hashed_password, str):
+            hashed_password = hashed_password.encode('UTF-8')
+
+        return self._run(check_password, password.encode('UTF-8'), hashed_password)
+
+    async def hash_async(self, password):
+        return await self._run_async(hash_password, password.encode('UTF-8'))
+
+    async def check_async(self, password, hashed_password):
+        if isinstance(hashed_password, str):
+            hashed_password = hashed_password.encode('UTF-8')
+
+        return await self._run_async(check_password, password.encode('UTF-8'), hashed_password)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def _run(self, function, *args):
+        if self.slots is None:
+            return function(*args)
+
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+
+        try:
+            future = self._get_executor().submit(function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    ## Same as _run, but awaits the worker instead of blocking the event loop.
+    ## Inline mode runs bcrypt in the loop's default thread pool.
+    async def _run_async(self, function, *args):
+        if self.slots is None:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+
+        try:
+            future = self._get_executor().submit(function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return await asyncio.wrap_future(future)
+
+    ## The pool is started on first use, not when the app is created.
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.max_workers)
+
+            return self.executor
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import re
+import tempfile
+
+
+## Content-addressed picture storage.
+## An upload is streamed to a temp file in chunks while it is hashed (sha256), then
+## moved to <root>/<h[0:2]>/<h[2:4]>/<h><ext>. Identical pictures end up at the same
+## path and are stored once, and no directory holds more than a slice of the files.
+class PictureStorage:
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    ## <h><ext>, or a file made from it next to it (a thumbnail variant, <h>@w<N><ext>)
+    stored_name = re.compile(r'([0-9a-f]{64})([\w@.-]*)')
+
+    def path_of(self, picture_hash, extension=''):
+        return os.path.join(self.root, picture_hash[0:2], picture_hash[2:4], picture_hash + extension)
+
+    ## File name of a stored picture, which changes with its content.
+    ## None for pictures stored elsewhere (before content addressing).
+    def name_of(self, path, picture_hash):
+        name = os.path.basename(path)
+        if not name.startswith(picture_hash):
+            return None
+
+        return name if os.path.abspath(path) == os.path.abspath(self.path_of(picture_hash, name[64:])) else None
+
+    ## Path of the stored file `name`, None when there is no such file.
+    def find(self, name):
+        match = self.stored_name.fullmatch(name)
+        if match is None:
+            return None
+
+        path = self.path_of(*match.groups())
+
+        return path if os.path.isfile(path) else None
+
+    ## sha256 of a stored file, for pictures saved before they were content addressed.
+    def hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as picture:
+            for chunk in iter(lambda: picture.read(self.chunk_size), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    ## Returns (picture_hash, path) of the stored picture.
+    def save(self, stream, extension=''):
+        temp_directory = os.path.join(self.root, 'tmp')
+        os.makedirs(temp_directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        temp_file = tempfile.NamedTemporaryFile(dir=temp_directory, delete=False)
+        try:
+            with temp_file:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            picture_hash = digest.hexdigest()
+            path = self.path_of(picture_hash, extension.lower())
+
+            if os.path.exists(path):
+                os.remove(temp_file.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_file.name, path)
+        except BaseException:
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
+            raise
+
+        return picture_hash, path
@@ -0,0 +1,80 @@
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+## Resized variants of profile pictures, made in a background worker pool.
+## The variant of <name><ext> for size N is <name>@w<N><ext> next to it, scaled to fit
+## in N x N keeping its aspect ratio. Until a variant exists the original is served.
+## Originals are named by their hash, or by secure_filename before that, so their
+## names never hold an '@' and can't be taken for a variant.
+class Thumbnailer:
+    variant_pattern = re.compile(r'@w\d+$')
+
+    def __init__(self, sizes=(48, 96, 200), max_workers=2):
+        self.sizes = tuple(sizes)
+        self.max_workers = max_workers
+        ## Starts its threads on the first submit
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='thumbnailer')
+
+    def variant_path(self, path, size):
+        name, extension = os.path.splitext(path)
+
+        return f'{name}@w{size}{extension}'
+
+    def is_variant(self, path):
+        return self.variant_pattern.search(os.path.splitext(path)[0]) is not None
+
+    def submit(self, path):
+        return self.executor.submit(self.make_variants, path)
+
+    ## Writes the missing variants of one picture. Returns how many were written.
+    def make_variants(self, path):
+        missing = [size for size in self.sizes if not os.path.exists(self.variant_path(path, size))]
+        if not missing:
+            return 0
+
+        try:
+            with Image.open(path) as picture:
+                picture.load()
+                for size in missing:
+                    variant = picture.copy()
+                    variant.thumbnail((size, size))
+                    self._save(variant, self.variant_path(path, size), picture.format)
+        except Exception:
+            logger.exception('Failed to make thumbnails of %s', path)
+            return 0
+
+        return len(missing)
+
+    ## Makes the missing variants of every picture under root, in the worker pool.
+    ## Returns how many variants were written.
+    def backfill(self, root):
+        paths = []
+        for directory, directories, filenames in os.walk(root):
+            directories[:] = [name for name in directories if name != 'tmp']
+            paths.extend(os.path.join(directory, filename) for filename in filenames
+                         if not self.is_variant(filename))
+
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix='thumbnailer') as executor:
+            return sum(executor.map(self.make_variants, paths))
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    ## Written to a temp file first, so a half written variant is never served.
+    def _save(self, variant, path, format):
+        temp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+        try:
+            with temp_file:
+                variant.save(temp_file, format=format)
+            os.replace(temp_file.name, path)
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
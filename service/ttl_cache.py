@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+## Small LRU cache whose entries expire ttl seconds after they were put.
+## Used for rows that are read far more often than they change:
+## credential rows by email, profile picture files by user id.
+## Writers invalidate their key in this process; the ttl bounds how long
+## a change made through another process goes unseen.
+class TTLCache:
+    def __init__(self, max_size=0, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
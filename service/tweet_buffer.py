@@ -0,0 +1,227 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class TweetBufferFull(Exception):
+    pass
+
+
+## Write-behind buffer for TweetService.tweet.
+## Tweets wait in a bounded queue and a background thread commits them in groups,
+## when batch_size tweets are waiting or flush_interval seconds after the first one,
+## so a posting spike pays one commit per group instead of one per tweet.
+## When the queue is full, add() waits up to put_timeout and then raises TweetBufferFull.
+## A group whose commit fails is tried again, up to flush_attempts times in all, waiting
+## retry_backoff seconds before the first retry and twice as long before each next one.
+## If every attempt fails, each author's tweets are committed on their own, and the tweets
+## that still fail are appended to spool_path (one JSON object per line) to be inserted
+## by hand, or only logged and counted as failed without a spool_path.
+## start() starts the flusher, and closes the buffer at exit; close() stops the flusher
+## and commits what is left.
+## Tweets are only in memory until their group commits: a crash loses them.
+class TweetBuffer:
+    def __init__(self, tweet_dao, max_size=10000, batch_size=500, flush_interval=0.05, put_timeout=0.1,
+                 flush_attempts=5, retry_backoff=0.1, spool_path=None):
+        self.tweet_dao = tweet_dao
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.flush_attempts = max(flush_attempts, 1)
+        self.retry_backoff = retry_backoff
+        self.spool_path = spool_path
+        self.on_flush = None
+        self.queue = queue.Queue(max_size)
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.committed = 0
+        self.retries = 0
+        self.spooled = 0
+        self.failed = 0
+        self.flushes = 0
+        self.batch_size_max = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.delay_seconds_max = 0.0
+
+        self.thread = threading.Thread(target=self.run, name='tweet-buffer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        atexit.register(self.close)
+
+        return self
+
+    def add(self, user_id, tweet):
+        if self.closed.is_set():
+            raise TweetBufferFull()
+
+        try:
+            self.queue.put((user_id, tweet, time.monotonic()), timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            raise TweetBufferFull()
+
+        with self.lock:
+            self.accepted += 1
+
+    def run(self):
+        while not (self.closed.is_set() and self.queue.empty()):
+            batch = self.take_batch()
+            if batch:
+                self.flush(batch)
+
+    ## Waits for a first tweet, then collects more until the batch is full
+    ## or flush_interval has passed since the first one arrived.
+    ## close() wakes the flusher up with a None in the queue.
+    def take_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first] if first is not None else []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0 and not self.closed.is_set():
+                    item = self.queue.get(timeout=timeout)
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is not None:
+                batch.append(item)
+
+        return batch
+
+    def flush(self, batch):
+        groups = {}
+        for user_id, tweet, _ in batch:
+            groups.setdefault(user_id, []).append(tweet)
+
+        start = time.monotonic()
+        tweet_ids = self.commit(groups, len(batch), self.flush_attempts)
+        if tweet_ids is None:
+            tweet_ids = self.commit_per_author(groups) if len(groups) > 1 else {}
+            self.spool([item for item in batch if item[0] not in tweet_ids])
+        end = time.monotonic()
+
+        committed = [item for item in batch if item[0] in tweet_ids]
+        if committed:
+            with self.lock:
+                self.flushes += 1
+                self.committed += len(committed)
+                self.batch_size_max = max(self.batch_size_max, len(committed))
+                self.flush_seconds_total += end - start
+                self.flush_seconds_max = max(self.flush_seconds_max, end - start)
+                self.delay_seconds_max = max(self.delay_seconds_max,
+                                             end - min(added for _, _, added in committed))
+
+        if self.on_flush is not None:
+            for user_id, ids in tweet_ids.items():
+                try:
+                    self.on_flush(user_id, ids)
+                except Exception:
+                    logger.exception('Failed to fan out buffered tweets of user %s', user_id)
+
+    ## insert_tweet_groups commits all of a group or none of it, so a failed attempt can be
+    ## repeated as is. An IntegrityError (a tweet of a deleted user) fails the same way every
+    ## time and isn't retried. None once every attempt failed.
+    def commit(self, groups, count, attempts):
+        backoff = self.retry_backoff
+        for attempt in range(1, attempts + 1):
+            try:
+                return self.tweet_dao.insert_tweet_groups(groups)
+            except IntegrityError:
+                logger.exception('Failed to commit %d buffered tweets', count)
+                return None
+            except Exception:
+                if attempt == attempts:
+                    logger.exception('Failed to commit %d buffered tweets after %d attempts', count, attempt)
+                    return None
+                logger.warning('Failed to commit %d buffered tweets, retrying in %.2fs',
+                               count, backoff, exc_info=True)
+
+            with self.lock:
+                self.retries += 1
+            time.sleep(backoff)
+            backoff *= 2
+
+    ## After a group failed: one commit per author, without retries (the group's retries
+    ## are spent), so the tweets of one bad author don't take everybody else's with them.
+    ## Returns the ids of the authors that committed.
+    def commit_per_author(self, groups):
+        tweet_ids = {}
+        for user_id, tweets in groups.items():
+            ids = self.commit({user_id: tweets}, len(tweets), 1)
+            if ids is not None:
+                tweet_ids.update(ids)
+
+        return tweet_ids
+
+    def spool(self, batch):
+        if not batch:
+            return
+
+        if self.spool_path is not None:
+            try:
+                with open(self.spool_path, 'a', encoding='utf-8') as spool:
+                    for user_id, tweet, _ in batch:
+                        spool.write(json.dumps({'user_id': user_id, 'tweet': tweet}) + '\n')
+            except OSError:
+                logger.exception('Failed to spool %d buffered tweets to %s', len(batch), self.spool_path)
+            else:
+                with self.lock:
+                    self.spooled += len(batch)
+                return
+
+        with self.lock:
+            self.failed += len(batch)
+
+    def close(self):
+        atexit.unregister(self.close)
+        self.closed.set()
+        if self.thread.is_alive():
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                pass
+            self.thread.join()
+
+        ## Tweets added while the flusher was stopping, or never started
+        while not self.queue.empty():
+            batch = self.take_batch()
+            if batch:
+                self.flush(batch)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': self.queue.qsize(),
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'committed': self.committed,
+                'retries': self.retries,
+                'spooled': self.spooled,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'batch_size_avg': self.committed / self.flushes if self.flushes else 0.0,
+                'batch_size_max': self.batch_size_max,
+                'flush_seconds_avg': self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+                'flush_seconds_max': self.flush_seconds_max,
+                'delay_seconds_max': self.delay_seconds_max
+            }
@@ -1,12 +1,111 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 class TweetService:
-    def __init__(self, tweet_dao):
+    def __init__(self, tweet_dao, timeline_store=None, tweet_buffer=None):
         self.tweet_dao = tweet_dao
+        self.timeline_store = timeline_store
+        self.tweet_buffer = tweet_buffer
         
+        if tweet_buffer is not None:
+            tweet_buffer.on_flush = self.fan_out
+        
+    ## Returns the new tweet's id, or True when it was accepted by the write-behind buffer
+    ## (raises TweetBufferFull when the buffer is full). None when the tweet is over 300.
     def tweet(self, user_id, tweet):
         if len(tweet) > 300:
             return None
         
-        return self.tweet_dao.insert_tweet(user_id, tweet)
+        if self.tweet_buffer is not None:
+            self.tweet_buffer.add(user_id, tweet)
+            return True
+        
+        tweet_id = self.tweet_dao.insert_tweet(user_id, tweet)
+        self.fan_out(user_id, [tweet_id])
+        
+        return tweet_id
+    
+    ## Validates every tweet like tweet() does and inserts the valid ones in one transaction.
+    ## Returns one result per tweet, in the same order.
+    def tweet_batch(self, user_id, tweets):
+        results = []
+        valid_tweets = []
+        for tweet in tweets:
+            if not isinstance(tweet, str):
+                results.append({'created': False, 'error': 'Tweet is missing'})
+            elif len(tweet) > 300:
+                results.append({'created': False, 'error': 'Your tweet is over 300'})
+            else:
+                results.append({'created': True})
+                valid_tweets.append(tweet)
+        
+        tweet_ids = self.tweet_dao.insert_tweets(user_id, valid_tweets)
+        self.fan_out(user_id, tweet_ids)
+        
+        created = iter(tweet_ids)
+        for result in results:
+            if result['created']:
+                result['id'] = next(created)
+        
+        return results
+    
+    ## Fan-out on write: push new tweets into the author's and followers' home timelines.
+    ## The tweets are committed by then, so a failed push is logged rather than raised:
+    ## the client would take the error for a failed tweet and post it again.
+    def fan_out(self, user_id, tweet_ids):
+        if self.timeline_store is None or not tweet_ids:
+            return
+        
+        try:
+            follower_ids = set(self.tweet_dao.get_follower_ids(user_id))
+            follower_ids.add(user_id)
+            for tweet_id in tweet_ids:
+                self.timeline_store.push(follower_ids, tweet_id, user_id)
+        except Exception:
+            logger.exception('Failed to fan out tweets %s of user %s', tweet_ids, user_id)
     
     def timeline(self, user_id):
-        return self.tweet_dao.get_timeline(user_id)
\ No newline at end of file
+        if self.timeline_store is None:
+            return self.tweet_dao.get_timeline(user_id)
+        
+        tweet_ids = self.timeline_store.get(user_id, self.timeline_store.max_length)
+        if tweet_ids is None:
+            return self.tweet_dao.get_timeline(user_id)
+        
+        ## The store returns newest first, the timeline is shown oldest first.
+        return self.tweet_dao.get_tweets(tweet_ids[::-1])
+    
+    ## Validator of the timeline, see TweetDao.get_timeline_version.
+    def timeline_version(self, user_id):
+        return self.tweet_dao.get_timeline_version(user_id)
+    
+    ## Iterator over the whole timeline (id <= max_id and id > since_id), oldest first,
+    ## read from the tweets table as it is consumed. See TweetDao.iter_timeline.
+    def iter_timeline(self, user_id, max_id=None, since_id=None):
+        return self.tweet_dao.iter_timeline(user_id, max_id, since_id)
+    
+    ## One page of the timeline: the newest `limit` tweets with id <= max_id and id > since_id,
+    ## oldest first. next_cursor is the max_id of the next (older) page, None on the last page.
+    def timeline_page(self, user_id, limit, max_id=None, since_id=None):
+        tweet_ids = None
+        if self.timeline_store is not None:
+            tweet_ids = self.timeline_store.get(user_id, limit + 1, max_id, since_id)
+        
+        if tweet_ids is None:
+            tweets = self.tweet_dao.get_timeline_page(user_id, limit + 1, max_id, since_id)
+            tweet_ids = [tweet['id'] for tweet in tweets]
+            tweets = [{
+                'user_id': tweet['user_id'],
+                'tweet': tweet['tweet']
+            } for tweet in tweets[:limit]]
+        else:
+            tweets = self.tweet_dao.get_tweets(tweet_ids[:limit])
+        
+        next_cursor = tweet_ids[limit - 1] - 1 if len(tweet_ids) > limit else None
+        
+        return {
+            'timeline': tweets[::-1],
+            'next_cursor': next_cursor
+        }
@@ -1,35 +1,65 @@
 
-import bcrypt
 import jwt
 import os
 from datetime import datetime, timedelta
 
+from .ttl_cache import TTLCache
+from .password_hasher import PasswordHasher
+from .picture_storage import PictureStorage
+
 
 class UserService:
     
-    def __init__(self, user_dao, config):
+    def __init__(self, user_dao, config, timeline_store=None, password_hasher=None, thumbnailer=None):
         self.user_dao = user_dao
         self.config = config
+        self.timeline_store = timeline_store
+        self.password_hasher = password_hasher or PasswordHasher()
+        self.thumbnailer = thumbnailer
+        self.credential_cache = TTLCache(config.get('CREDENTIAL_CACHE_SIZE', 0),
+                                         config.get('CREDENTIAL_CACHE_TTL', 30))
+        self.picture_storage = PictureStorage(config.get('UPLOAD_DIRECTORY'))
+        self.picture_cache = TTLCache(config.get('PROFILE_PICTURE_CACHE_SIZE', 0),
+                                      config.get('PROFILE_PICTURE_CACHE_TTL', 60))
         
     def create_new_user(self, new_user):
-        new_user['password'] = bcrypt.hashpw(new_user['password'].encode('UTF-8'), 
-                                            bcrypt.gensalt())
+        new_user['password'] = self.password_hasher.hash(new_user['password'])
         new_user_id = self.user_dao.insert_user(new_user)
+        self.credential_cache.invalidate(new_user['email'])
 
         return new_user_id
 
+    ## Returns the authenticated user's id and a new access token, None when the credential is wrong.
     def login(self, credential):
         email = credential['email']
         password = credential['password']
-        user_credential = self.user_dao.get_user_id_and_password(email)
+        user_credential = self.get_user_id_and_password(email)
         
-        authorized = user_credential and bcrypt.checkpw(password.encode('UTF-8'), 
-                                                        user_credential['hashed_password'].encode('UTF-8'))
+        authorized = user_credential and self.password_hasher.check(password,
+                                                                    user_credential['hashed_password'])
+        if not authorized:
+            return None
         
-        return authorized
+        return {
+            'user_id': user_credential['id'],
+            'access_token': self.generate_access_token(user_credential['id'])
+        }
     
     def get_user_id_and_password(self, user_email):
-        return self.user_dao.get_user_id_and_password(user_email)
+        user_credential = self.credential_cache.get(user_email)
+        if user_credential is None:
+            user_credential = self.user_dao.get_user_id_and_password(user_email)
+            if user_credential is not None:
+                self.credential_cache.put(user_email, user_credential)
+        
+        return user_credential
+    
+    def change_password(self, email, new_password):
+        hashed_password = self.password_hasher.hash(new_password)
+        result = self.user_dao.update_password(email, hashed_password)
+        self.credential_cache.invalidate(email)
+        
+        return result
     
     def generate_access_token(self, user_id):
         payload = {
@@ -41,16 +71,102 @@ class UserService:
         return token
         
     def follow(self, user_id, follow_id):
-        return self.user_dao.insert_follow(user_id, follow_id)
+        result = self.user_dao.insert_follow(user_id, follow_id)
+        
+        if self.timeline_store is not None:
+            self.timeline_store.backfill(user_id, follow_id)
+        
+        return result
     
     def unfollow(self, user_id, unfollow_id):
-        return self.user_dao.insert_unfollow(user_id, unfollow_id)
+        result = self.user_dao.insert_unfollow(user_id, unfollow_id)
+        
+        if self.timeline_store is not None and user_id != unfollow_id:
+            self.timeline_store.trim(user_id, unfollow_id)
+        
+        return result
+    
+    def follow_many(self, user_id, follow_ids):
+        followed = self.user_dao.insert_follows(user_id, follow_ids)
+        
+        if self.timeline_store is not None:
+            for follow_id in followed:
+                self.timeline_store.backfill(user_id, follow_id)
+        
+        return followed
+    
+    def unfollow_many(self, user_id, unfollow_ids):
+        unfollowed = self.user_dao.insert_unfollows(user_id, unfollow_ids)
+        
+        if self.timeline_store is not None:
+            for unfollow_id in unfollowed:
+                if unfollow_id != user_id:
+                    self.timeline_store.trim(user_id, unfollow_id)
+        
+        return unfollowed
     
+    ## Stores the picture under its content hash, keeping the upload's file extension.
     def save_profile_picture(self, picture, filename, user_id):
-        profile_pic_path_and_name = os.path.join(self.config['UPLOAD_DIRECTORY'], filename)
-        picture.save(profile_pic_path_and_name)
+        extension = os.path.splitext(filename)[1]
+        picture_hash, profile_pic_path = self.picture_storage.save(picture.stream, extension)
         
-        return self.user_dao.save_profile_picture(profile_pic_path_and_name, user_id)
+        result = self.user_dao.save_profile_picture(profile_pic_path, user_id, picture_hash)
+        self.picture_cache.invalidate(user_id)
+        
+        if self.thumbnailer is not None:
+            self.thumbnailer.submit(profile_pic_path)
+        
+        return result
     
     def get_profile_picture(self, user_id):
-        return self.user_dao.get_profile_picture(user_id)
\ No newline at end of file
+        return self.user_dao.get_profile_picture(user_id)
+    
+    ## Path, strong ETag (content hash) and stored file name of a user's picture, cached per user id.
+    ## Pictures stored before content addressing have no name, and are hashed on their first request.
+    def get_profile_picture_file(self, user_id):
+        picture_file = self.picture_cache.get(user_id)
+        if picture_file is not None:
+            return picture_file
+        
+        picture = self.user_dao.get_profile_picture_file(user_id)
+        if picture is None:
+            return None
+        
+        if picture['hash'] is None:
+            try:
+                picture['hash'] = self.picture_storage.hash_file(picture['path'])
+            except FileNotFoundError:
+                return None
+        
+        picture_file = {
+            'path': picture['path'],
+            'etag': picture['hash'],
+            'name': self.picture_storage.name_of(picture['path'], picture['hash'])
+        }
+        self.picture_cache.put(user_id, picture_file)
+        
+        return picture_file
+    
+    ## Path and ETag of a stored picture or variant by its content-addressed file name.
+    def get_stored_picture(self, name):
+        path = self.picture_storage.find(name)
+        
+        return {'path': path, 'etag': name, 'name': name} if path else None
+    
+    ## Path and ETag of the resized variant of a user's picture,
+    ## or of the original while the variant isn't made yet.
+    def get_profile_picture_variant(self, user_id, size):
+        picture_file = self.get_profile_picture_file(user_id)
+        if picture_file is None or self.thumbnailer is None:
+            return picture_file
+        
+        variant_path = self.thumbnailer.variant_path(picture_file['path'], size)
+        if not os.path.exists(variant_path):
+            return picture_file
+        
+        return {
+            'path': variant_path,
+            'etag': f"{picture_file['etag']}-{size}",
+            'name': os.path.basename(variant_path) if picture_file['name'] else None,
+            'size': size
+        }
@@ -14,4 +14,22 @@ if __name__ == '__main__':
     app.logger.info(f'Running the app...')
     
     manager = Manager(app)
+    
+    @manager.command
+    def migrate():
+        from sqlalchemy import create_engine
+        from model.schema import SCHEMA_VERSION, migrate as migrate_schema
+        
+        applied = migrate_schema(create_engine(app.config['DB_URL'], encoding='utf-8'))
+        app.logger.info(f'Applied schema versions {applied}, now at {SCHEMA_VERSION}')
+    
+    @manager.command
+    def thumbnails():
+        from service import Thumbnailer
+        
+        thumbnailer = Thumbnailer(app.config.get('PROFILE_PICTURE_SIZES', (48, 96, 200)),
+                                  app.config.get('THUMBNAILER_WORKERS', 2))
+        written = thumbnailer.backfill(app.config['UPLOAD_DIRECTORY'])
+        app.logger.info(f'Wrote {written} profile picture variants')
+    
     manager.run()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import threading
+
+import jwt
+import pytest
+from flask import Flask
+
+from view import AdmissionController, TokenCache, login_required
+
+
+## Plain Flask apps around the controller, no database needed.
+def test_admission_control():
+    app = Flask(__name__)
+    admission = AdmissionController({'ADMISSION_LIMITS': {'reads': 1}, 'ADMISSION_RETRY_AFTER': 2}).attach(app)
+    started = threading.Event()
+    release = threading.Event()
+
+    @app.route('/timeline')
+    def user_timeline():
+        started.set()
+        release.wait(5)
+        return ''
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    first = threading.Thread(target=lambda: app.test_client().get('/timeline'))
+    first.start()
+    assert started.wait(5)
+
+    # the reads class is full, other routes are still admitted
+    res = app.test_client().get('/timeline')
+    assert res.status_code == 503
+    assert res.headers['Retry-After'] == '2'
+    assert app.test_client().get('/ping').status_code == 200
+
+    release.set()
+    first.join()
+    assert app.test_client().get('/timeline').status_code == 200
+
+    stats = admission.stats()['classes']['reads']
+    assert (stats['admitted'], stats['rejected'], stats['in_flight']) == (2, 1, 0)
+
+def test_user_rate_limit():
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = 'secret'
+    app.extensions['token_cache'] = TokenCache(0)
+    app.extensions['admission'] = AdmissionController({'USER_RATE_LIMITS': {'writes': (0.5, 2)}}).attach(app)
+
+    @app.route('/tweet', methods=['POST'])
+    @login_required
+    def tweet():
+        return ''
+
+    client = app.test_client()
+    headers = {'Authorization': jwt.encode({'user_id': 1}, 'secret', 'HS256')}
+    assert [client.post('/tweet', headers=headers).status_code for _ in range(3)] == [200, 200, 429]
+    assert client.post('/tweet', headers=headers).headers['Retry-After'] == '2'
+
+    # buckets are per user
+    other = {'Authorization': jwt.encode({'user_id': 2}, 'secret', 'HS256')}
+    assert client.post('/tweet', headers=other).status_code == 200
+
+def test_config_validation():
+    # an endpoint mapped to None is exempt
+    admission = AdmissionController({'ADMISSION_ROUTE_CLASSES': {'get_profile_picture': None}})
+    assert 'get_profile_picture' not in admission.route_classes
+    assert admission.metrics()
+
+    with pytest.raises(ValueError):
+        AdmissionController({'ADMISSION_ROUTE_CLASSES': {'tweet': 1}})
+    with pytest.raises(ValueError):
+        AdmissionController({'USER_RATE_LIMITS': {'writes': (0, 20)}})
+    with pytest.raises(ValueError):
+        AdmissionController({'USER_RATE_LIMITS': {'writes': (5, 0)}})
@@ -0,0 +1,145 @@
+import asyncio
+
+import bcrypt
+import pytest
+from sqlalchemy import create_engine, text
+
+from async_app import create_async_app
+from model.schema import migrate
+
+
+## The async app runs against a SQLite file through aiosqlite, no MySQL needed.
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / 'miniter_test.db'
+    database = create_engine(f'sqlite:///{path}')
+    migrate(database)
+
+    hashed_password = bcrypt.hashpw(b'rlawjdgns', bcrypt.gensalt())
+    database.execute(text("""
+        INSERT INTO users (
+            id,
+            name,
+            email,
+            hashed_password,
+            profile
+        ) VALUES (
+            :id,
+            :name,
+            :email,
+            :hashed_password,
+            :profile
+        )
+    """), [{
+            'id': 1,
+            'name': 'testName',
+            'email': 'test@email.com',
+            'hashed_password': hashed_password,
+            'profile': 'test profile'
+        }, {
+            'id': 2,
+            'name': 'test2Name',
+            'email': 'test2@email.com',
+            'hashed_password': hashed_password,
+            'profile': 'test2 profile'
+        }])
+    database.execute(text("""
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            2,
+            'test tweet!'
+        )
+    """))
+    database.dispose()
+
+    return path
+
+def run_with_app(db_path, scenario):
+    async def run():
+        app = create_async_app({
+            'DB_URL': f'sqlite+aiosqlite:///{db_path}',
+            'JWT_SECRET_KEY': 'some dificult secret key'
+        })
+        async with app.test_app() as test_app:
+            await scenario(test_app.test_client())
+
+    asyncio.run(run())
+
+def test_ping(db_path):
+    async def scenario(api):
+        res = await api.get('/ping')
+        assert b'pong' in await res.get_data()
+
+    run_with_app(db_path, scenario)
+
+def test_unauthorization(db_path):
+    async def scenario(api):
+        res = await api.post('/tweet', json={'tweet': 'tweet test'})
+        assert res.status_code == 401
+
+        res = await api.post('/follow', json={'follow': 2})
+        assert res.status_code == 401
+
+    run_with_app(db_path, scenario)
+
+def test_follow_and_tweet(db_path):
+    async def scenario(api):
+        res = await api.post('/login', json={'email': 'test@email.com', 'password': 'rlawjdgns'})
+        res_json = await res.get_json()
+        access_token = res_json['access_token']
+        assert res_json['user_id'] == 1
+
+        res = await api.post('/follow', json={'follow': 2}, headers={'Authorization': access_token})
+        assert res.status_code == 200
+
+        res = await api.post('/tweet', json={'tweet': 'test_tweet!!'}, headers={'Authorization': access_token})
+        assert res.status_code == 200
+
+        res = await api.get('/timeline', headers={'Authorization': access_token})
+        assert await res.get_json() == {
+            'user_id': 1,
+            'timeline': [
+                {
+                    'user_id': 2,
+                    'tweet': 'test tweet!'
+                },
+                {
+                    'user_id': 1,
+                    'tweet': 'test_tweet!!'
+                }
+            ],
+            'next_cursor': None
+        }
+
+        res = await api.get('/timeline/1?limit=1')
+        page = await res.get_json()
+        assert page['timeline'] == [{'user_id': 1, 'tweet': 'test_tweet!!'}]
+        assert page['next_cursor'] is not None
+
+        res = await api.post('/unfollow', json={'unfollow': 2}, headers={'Authorization': access_token})
+        assert res.status_code == 200
+
+        res = await api.get('/timeline/1')
+        assert (await res.get_json())['timeline'] == [{'user_id': 1, 'tweet': 'test_tweet!!'}]
+
+    run_with_app(db_path, scenario)
+
+def test_sign_up(db_path):
+    async def scenario(api):
+        res = await api.post('/sign-up', json={
+            'name': 'new_user',
+            'email': 'new_user@email.com',
+            'profile': 'new user profile',
+            'password': 'new_password'
+        })
+        assert res.status_code == 200
+
+        res = await api.post('/login', json={'email': 'new_user@email.com', 'password': 'new_password'})
+        assert res.status_code == 200
+
+        res = await api.post('/login', json={'email': 'new_user@email.com', 'password': 'wrong_password'})
+        assert res.status_code == 401
+
+    run_with_app(db_path, scenario)
@@ -0,0 +1,28 @@
+import gzip
+import json
+
+from flask import Flask, jsonify
+
+from view import Compressor
+
+
+## A plain Flask app around the compressor, no database needed.
+def test_compression_cache():
+    app = Flask(__name__)
+    compressor = Compressor({'COMPRESSION_ENCODINGS': ('gzip',), 'COMPRESSION_MIN_SIZE': 10}).attach(app)
+    
+    @app.route('/data')
+    def data():
+        response = jsonify({'data': 'x' * 100})
+        response.set_etag('v1')
+        return response
+    
+    client = app.test_client()
+    for _ in range(2):
+        res = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+        assert json.loads(gzip.decompress(res.data)) == {'data': 'x' * 100}
+        assert res.headers['ETag'] == 'W/"v1"'
+    
+    # the second response reused the compressed bytes of the first one
+    assert compressor.stats()['encodings']['gzip']['responses'] == 2
+    assert compressor.stats()['encodings']['gzip']['cache_hits'] == 1
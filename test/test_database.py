@@ -0,0 +1,175 @@
+import shutil
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from model import TweetDao, UserDao
+from model.database import PoolStats, ReplicaRouter, normalize_statement
+from model.schema import migrate
+
+
+## Engine instrumentation, routing and migrations on SQLite files, no MySQL needed.
+def test_pool_stats(tmp_path):
+    pool_stats = PoolStats()
+    database = create_engine(f"sqlite:///{tmp_path / 'miniter_test.db'}",
+                             poolclass=pool_stats.pool_class(QueuePool),
+                             pool_size=1, max_overflow=0, pool_timeout=0.05)
+    pool_stats.attach(database)
+
+    with database.connect() as connection:
+        assert pool_stats.stats()['in_use'] == 1
+
+        # the only connection is checked out
+        with pytest.raises(PoolTimeoutError):
+            database.connect()
+
+    stats = pool_stats.stats()
+    assert (stats['checkouts'], stats['timeouts'], stats['in_use'], stats['connects']) == (2, 1, 0, 1)
+    assert stats['checkout_wait_max'] >= 0.05
+
+    # the pool dispose() puts in place is timed and listened to as well
+    database.dispose()
+    database.execute(text('SELECT 1'))
+
+    stats = pool_stats.stats()
+    assert (stats['checkouts'], stats['in_use'], stats['connects'], stats['in_use_max']) == (3, 0, 2, 1)
+
+def test_normalize_statement():
+    assert normalize_statement("""
+        SELECT id
+        FROM users
+        WHERE id IN (%(ids_1)s, %(ids_2)s, %(ids_3)s) AND email = 'a@b.c' AND id > 10
+    """) == "SELECT id FROM users WHERE id IN (...) AND email = ? AND id > ?"
+    assert normalize_statement(
+        "INSERT INTO users_follow_list (user_id, follow_user_id) VALUES (?, ?), (?, ?), (?, ?)"
+    ) == "INSERT INTO users_follow_list (user_id, follow_user_id) VALUES (?, ?)"
+
+## A primary with users 1 and 2 and a tweet of user 2
+@pytest.fixture
+def primary_path(tmp_path):
+    path = tmp_path / 'primary.db'
+    database = create_engine(f'sqlite:///{path}')
+    migrate(database)
+
+    user_dao = UserDao(database)
+    for i in (1, 2):
+        user_dao.insert_user({
+            'name': f'testName{i}',
+            'email': f'test{i}@email.com',
+            'profile': f'test{i} profile',
+            'password': 'hashed'
+        })
+    TweetDao(database).insert_tweet(2, 'Hello World')
+    database.dispose()
+
+    return path
+
+## A replica that hasn't replicated anything yet
+def lagging_replica(tmp_path, name):
+    replica = create_engine(f"sqlite:///{tmp_path / name}")
+    migrate(replica)
+
+    return replica
+
+def test_read_your_writes(tmp_path, primary_path):
+    primary = create_engine(f'sqlite:///{primary_path}')
+    router = ReplicaRouter(primary, [lagging_replica(tmp_path, 'replica.db')], read_your_writes=60)
+    user_dao = UserDao(primary, router)
+    tweet_dao = TweetDao(primary, router)
+
+    # reads go to the replica, which doesn't have user 2's tweet yet
+    assert tweet_dao.get_timeline_page(2, 10) == []
+    assert user_dao.get_user_id_and_password('test1@email.com') is None
+
+    # right after a write, the writer's reads go to the primary
+    tweet_id = tweet_dao.insert_tweet(2, 'read your writes')
+    assert [tweet['tweet'] for tweet in tweet_dao.get_timeline_page(2, 10)] == ['read your writes', 'Hello World']
+    assert tweet_dao.get_timeline_version(2)['max_tweet_id'] == tweet_id
+
+    user_dao.update_password('test1@email.com', 'new_password')
+    assert user_dao.get_user_id_and_password('test1@email.com') == {'id': 1, 'hashed_password': 'new_password'}
+
+    # everybody else still reads the lagging replica
+    assert tweet_dao.get_timeline_page(1, 10) == []
+    assert tweet_dao.get_timeline_version(1) is None
+
+def test_replica_per_request(tmp_path, primary_path):
+    primary = create_engine(f'sqlite:///{primary_path}')
+    shutil.copy(primary_path, tmp_path / 'replica1.db')
+    replicas = [lagging_replica(tmp_path, 'replica0.db'), create_engine(f"sqlite:///{tmp_path / 'replica1.db'}")]
+    router = ReplicaRouter(primary, replicas)
+    tweet_dao = TweetDao(primary, router)
+
+    # round-robin outside of requests
+    assert tweet_dao.get_timeline_version(2) is None
+    assert tweet_dao.get_timeline_version(2)['max_tweet_id'] == 1
+
+    # within a request, the validator and the body come from the same replica
+    for _ in range(2):
+        router.start_request()
+        version = tweet_dao.get_timeline_version(2)
+        page = tweet_dao.get_timeline_page(2, 10)
+        router.end_request()
+
+        if version is None:
+            assert page == []
+        else:
+            assert [tweet['id'] for tweet in page] == [version['max_tweet_id']]
+
+    assert [replica['reads'] for replica in router.stats()['replicas']] == [3, 3]
+
+def test_replica_router_policies(tmp_path):
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replicas = [create_engine(f"sqlite:///{tmp_path / f'replica{i}.db'}") for i in range(2)]
+
+    router = ReplicaRouter(primary, replicas)
+    assert [router.reader() for _ in range(4)] == replicas * 2
+
+    router = ReplicaRouter(primary, replicas, policy='least-connections')
+    assert {router.reader(), router.reader()} == set(replicas)
+
+    router = ReplicaRouter(primary, replicas, read_your_writes=0)
+    router.wrote(1)
+    assert router.reader(1) in replicas
+
+def test_migrate_adds_follow_list_key(tmp_path):
+    database = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    # the tables as they were created before migrations, without the follow list key
+    database.execute(text("""
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL UNIQUE,
+            hashed_password VARCHAR(255) NOT NULL,
+            profile VARCHAR(2000) NOT NULL,
+            profile_picture VARCHAR(255),
+            created_at DATETIME
+        )
+    """))
+    database.execute(text("""
+        CREATE TABLE users_follow_list (
+            user_id INTEGER NOT NULL,
+            follow_user_id INTEGER NOT NULL,
+            created_at DATETIME
+        )
+    """))
+    migrate(database)
+
+    user_dao = UserDao(database)
+    for i in (1, 2):
+        user_dao.insert_user({
+            'name': f'testName{i}',
+            'email': f'test{i}@email.com',
+            'profile': f'test{i} profile',
+            'password': 'hashed'
+        })
+
+    assert user_dao.insert_follows(1, [2]) == [2]
+
+    # the key the follow INSERT IGNORE deduplicates on
+    with pytest.raises(IntegrityError):
+        user_dao.insert_follow(1, 2)
+    assert database.execute(text('SELECT COUNT(*) FROM users_follow_list')).scalar() == 1
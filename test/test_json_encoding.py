@@ -0,0 +1,20 @@
+import json
+
+from view import CustomJSONEcoder, OrjsonEncoder
+
+
+## The JSON encoders on their own, no database needed.
+def test_orjson_encoder():
+    payload = {
+        'user_id': 1,
+        'timeline': [{'user_id': 2, 'tweet': 'hello 세상'}],
+        'follow': {3, 4},
+        'next_cursor': None
+    }
+    
+    # same JSON as the stdlib encoder, sets included
+    assert json.loads(OrjsonEncoder(sort_keys=True).encode(payload)) == \
+        json.loads(CustomJSONEcoder(sort_keys=True).encode(payload))
+    
+    # values orjson can't encode fall back to the stdlib encoder
+    assert OrjsonEncoder().encode({'id': 2 ** 70}) == '{"id": 1180591620717411303424}'
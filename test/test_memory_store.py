@@ -0,0 +1,131 @@
+import json
+
+import bcrypt
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import create_app
+from model import MemoryStore, MemoryTweetDao, MemoryUserDao
+
+
+## The in-memory backend runs without a database, like test_async_app.
+@pytest.fixture
+def store():
+    store = MemoryStore()
+    user_dao = MemoryUserDao(store)
+    hashed_password = bcrypt.hashpw(b'test_password', bcrypt.gensalt())
+    for i in (1, 2, 3):
+        user_dao.insert_user({
+            'name': f'testName{i}',
+            'email': f'test{i}@email.com',
+            'profile': f'test{i} profile',
+            'password': hashed_password
+        })
+    MemoryTweetDao(store).insert_tweet(2, 'Hello World')
+
+    return store
+
+@pytest.fixture
+def user_dao(store):
+    return MemoryUserDao(store)
+
+@pytest.fixture
+def tweet_dao(store):
+    return MemoryTweetDao(store)
+
+def test_insert_user(user_dao):
+    new_user_id = user_dao.insert_user({
+        'name': 'new user',
+        'email': 'new@email.com',
+        'profile': 'new profile',
+        'password': 'hashed'
+    })
+    assert new_user_id == 4
+    assert user_dao.get_user_id_and_password('new@email.com') == {'id': 4, 'hashed_password': 'hashed'}
+    assert user_dao.get_user_id_and_password('unknown@email.com') is None
+
+    with pytest.raises(IntegrityError):
+        user_dao.insert_user({'name': 'copy', 'email': 'new@email.com', 'profile': '', 'password': 'x'})
+
+def test_follow(user_dao, tweet_dao):
+    user_dao.insert_follow(1, 2)
+    assert tweet_dao.get_follower_ids(2) == [1]
+    assert tweet_dao.get_timeline(1) == [{'user_id': 2, 'tweet': 'Hello World'}]
+
+    with pytest.raises(IntegrityError):
+        user_dao.insert_follow(1, 2)
+    with pytest.raises(IntegrityError):
+        user_dao.insert_follow(1, 99)
+
+    assert user_dao.insert_follows(1, [2, 3, 99]) == [3]
+    assert user_dao.insert_unfollows(1, [2, 3]) == [2, 3]
+    assert user_dao.insert_unfollow(1, 2) == 0
+    assert tweet_dao.get_timeline(1) == []
+
+def test_timeline_page(user_dao, tweet_dao):
+    user_dao.insert_follow(1, 2)
+    tweet_ids = tweet_dao.insert_tweet_groups({1: ['a', 'b'], 2: ['c']})
+    assert tweet_ids == {1: [2, 3], 2: [4]}
+    tweet_dao.insert_tweet(3, 'not followed')
+
+    page = tweet_dao.get_timeline_page(1, 2)
+    assert [tweet['id'] for tweet in page] == [4, 3]
+    page = tweet_dao.get_timeline_page(1, 10, max_id=2)
+    assert [tweet['id'] for tweet in page] == [2, 1]
+    page = tweet_dao.get_timeline_page(1, 10, since_id=2)
+    assert [tweet['id'] for tweet in page] == [4, 3]
+
+    assert [tweet['tweet'] for tweet in tweet_dao.iter_timeline(1)] == ['Hello World', 'a', 'b', 'c']
+    assert tweet_dao.get_timeline_entries(1, 2) == [(4, 2), (3, 1)]
+    assert tweet_dao.get_user_tweet_entries(1, 10) == [(3, 1), (2, 1)]
+    assert tweet_dao.get_tweets([4, 1, 99]) == [{'user_id': 2, 'tweet': 'c'}, {'user_id': 2, 'tweet': 'Hello World'}]
+
+    with pytest.raises(IntegrityError):
+        tweet_dao.insert_tweet_groups({1: ['d'], 99: ['e']})
+    assert tweet_dao.get_user_tweet_entries(1, 10) == [(3, 1), (2, 1)]
+
+def test_timeline_version(user_dao, tweet_dao):
+    version = tweet_dao.get_timeline_version(1)
+    assert version['max_tweet_id'] == 0
+    assert version['follow_version'] == 0
+
+    user_dao.insert_follow(1, 2)
+    version = tweet_dao.get_timeline_version(1)
+    assert version['max_tweet_id'] == 1
+    assert version['follow_version'] == 1
+    assert version['modified_at'] is not None
+
+    assert tweet_dao.get_timeline_version(99) is None
+
+def test_app(tmp_path):
+    app = create_app({
+        'STORAGE_BACKEND': 'memory',
+        'TIMELINE_STORE': 'memory',
+        'JWT_SECRET_KEY': 'test secret key',
+        'UPLOAD_DIRECTORY': str(tmp_path)
+    })
+    api = app.test_client()
+
+    for name in ('first', 'second'):
+        res = api.post('/sign-up', json={
+            'name': name,
+            'email': f'{name}@email.com',
+            'password': 'test_password',
+            'profile': f'{name} profile'
+        })
+        assert res.status_code == 200
+
+    tokens = {}
+    for user_id, name in ((1, 'first'), (2, 'second')):
+        res = api.post('/login', json={'email': f'{name}@email.com', 'password': 'test_password'})
+        assert json.loads(res.data)['user_id'] == user_id
+        tokens[user_id] = json.loads(res.data)['access_token']
+
+    assert api.post('/tweet', json={'tweet': 'Hello'}, headers={'Authorization': tokens[2]}).status_code == 200
+    assert api.post('/follow', json={'follow': 2}, headers={'Authorization': tokens[1]}).status_code == 200
+
+    res = api.get('/timeline/1')
+    assert json.loads(res.data)['timeline'] == [{'user_id': 2, 'tweet': 'Hello'}]
+
+    res = api.get('/stats')
+    assert json.loads(res.data)['memory_store'] == {'users': 2, 'tweets': 1, 'follows': 1}
@@ -1,10 +1,14 @@
+from datetime import datetime, timedelta, timezone
+
 import bcrypt
 import pytest
 from sqlalchemy.sql.functions import user
 import config
 
 from model import UserDao, TweetDao
-from sqlalchemy import create_engine, text
+from model.database import QueryStats, ReplicaRouter
+from model.schema import check_timeline_plan, migrate
+from sqlalchemy import create_engine, event, text
 
 database = create_engine(config.test_config['DB_URL'], encoding='utf-8',
                          max_overflow=0)
@@ -18,6 +22,9 @@ def tweet_dao():
     return TweetDao(database)
 
 def setup_function():
+    ## Bring the test database up to the current schema
+    migrate(database)
+    
     ## Create a test user
     hashed_password = bcrypt.hashpw(b"test_password", bcrypt.gensalt())
     new_users = [
@@ -149,6 +156,17 @@ def test_insert_unfollow(user_dao):
     follow_list = get_follow_list(1)
     assert follow_list == []
     
+def test_insert_follows(user_dao):
+    # user 3 doesn't exist, user 2 is followed once even if listed twice
+    assert user_dao.insert_follows(user_id=1, follow_ids=[2, 2, 3]) == [2]
+    assert get_follow_list(1) == [2]
+    
+    # following again changes nothing
+    assert user_dao.insert_follows(user_id=1, follow_ids=[2]) == []
+    
+    assert user_dao.insert_unfollows(user_id=1, unfollow_ids=[2, 3]) == [2]
+    assert get_follow_list(1) == []
+    
 def test_insert_tweet(tweet_dao):
     tweet_dao.insert_tweet(1, 'test tweet')
     timeline = tweet_dao.get_timeline(1)
@@ -181,4 +199,95 @@ def test_timeline(user_dao, tweet_dao):
             'tweet': 'test_tweet 2'
         }
     ]
-    
\ No newline at end of file
+    
+
+def test_timeline_version(user_dao, tweet_dao):
+    version = tweet_dao.get_timeline_version(1)
+    
+    # a tweet of a user who isn't followed yet doesn't change it, following them does
+    tweet_id = tweet_dao.insert_tweet(2, 'test_tweet 2')
+    assert tweet_dao.get_timeline_version(1) == version
+    user_dao.insert_follow(1, 2)
+    followed = tweet_dao.get_timeline_version(1)
+    assert followed['max_tweet_id'] == tweet_id
+    assert followed['follow_version'] == version['follow_version'] + 1
+    # UTC, whatever the server's time zone
+    assert abs(followed['modified_at'] - datetime.now(timezone.utc)) < timedelta(minutes=5)
+    
+    # so does unfollowing, even though the newest tweet id goes back
+    user_dao.insert_unfollow(1, 2)
+    unfollowed = tweet_dao.get_timeline_version(1)
+    assert unfollowed['follow_version'] == followed['follow_version'] + 1
+    
+    assert tweet_dao.get_timeline_version(100) is None
+
+def test_timeline_query_plan():
+    # enough rows that a full table scan is never the cheaper plan
+    database.execute(text("""
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            :user_id,
+            :tweet
+        )
+        """), [{'user_id': i % 2 + 1, 'tweet': f'tweet {i}'} for i in range(500)])
+    database.execute(text("""
+        INSERT INTO users_follow_list (
+            user_id,
+            follow_user_id
+        ) VALUES (
+            1,
+            2
+        )
+        """))
+    
+    # every branch of the timeline read must be an index lookup or range scan
+    assert check_timeline_plan(database, user_id=1) == []
+    assert check_timeline_plan(database, user_id=1, max_id=300, since_id=100) == []
+
+def test_query_stats(user_dao):
+    query_stats = QueryStats(slow_threshold=0).attach(database)
+    try:
+        query_stats.start_request()
+        user_dao.get_user_id_and_password('test1@email.com')
+        user_dao.get_user_id_and_password('test2@email.com')
+        
+        # both calls are the same normalized statement
+        assert query_stats.request_queries()[0] == 2
+        stats = query_stats.stats()
+        assert stats['distinct_statements'] == 1
+        assert stats['statements'][0]['count'] == 2
+        assert stats['slow_queries'] == 2
+        
+        # named parameters matching the redact pattern are left out of the slow-query log
+        assert query_stats.redact_parameters({'email': 'test1@email.com', 'id': 1}, False) == {'email': '?', 'id': 1}
+    finally:
+        event.remove(database, 'before_cursor_execute', query_stats.before_cursor_execute)
+        event.remove(database, 'after_cursor_execute', query_stats.after_cursor_execute)
+        event.remove(database, 'handle_error', query_stats.handle_error)
+
+def test_replica_router(tmp_path):
+    # an empty replica, far behind the primary
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    migrate(replica)
+    router = ReplicaRouter(database, [replica], read_your_writes=60)
+    user_dao = UserDao(database, router)
+    tweet_dao = TweetDao(database, router)
+    
+    assert user_dao.get_user_id_and_password('test1@email.com') is None
+    assert tweet_dao.get_timeline(2) == []
+    
+    # after a write, the writer's reads go to the primary
+    user_dao.update_password('test1@email.com', 'new_password')
+    assert user_dao.get_user_id_and_password('test1@email.com')['id'] == 1
+    tweet_dao.insert_tweet(2, 'read your writes')
+    assert len(tweet_dao.get_timeline(2)) == 2
+    assert tweet_dao.get_timeline(1) == []
+    
+    # ids the replica doesn't have yet are read from the primary
+    assert tweet_dao.get_tweets([1]) == [{'user_id': 2, 'tweet': 'Hello World'}]
+    
+    stats = router.stats()
+    assert stats['primary_reads'] == 2
+    assert stats['replicas'][0]['reads'] == 4
@@ -0,0 +1,20 @@
+import pytest
+
+from service import PasswordHasher, PasswordHasherBusy
+
+
+## bcrypt in the worker pool only, no database needed.
+def test_password_hasher():
+    password_hasher = PasswordHasher(max_workers=1, max_queue=0)
+    hashed_password = password_hasher.hash('test_password').decode('UTF-8')
+
+    assert password_hasher.check('test_password', hashed_password)
+    assert not password_hasher.check('wrong_password', hashed_password)
+
+    # every slot taken: fail fast instead of queueing
+    password_hasher.slots.acquire()
+    with pytest.raises(PasswordHasherBusy):
+        password_hasher.hash('test_password')
+    password_hasher.slots.release()
+
+    password_hasher.shutdown()
@@ -0,0 +1,16 @@
+import io
+
+from service.picture_storage import PictureStorage
+
+
+## Files on disk only, no database needed.
+def test_picture_storage(tmp_path):
+    picture_storage = PictureStorage(str(tmp_path), chunk_size=4)
+
+    picture_hash, path = picture_storage.save(io.BytesIO(b'picture bytes'), '.PNG')
+    assert path == str(tmp_path / picture_hash[0:2] / picture_hash[2:4] / f'{picture_hash}.png')
+    assert open(path, 'rb').read() == b'picture bytes'
+
+    # the same picture is stored once, and no temp file is left behind
+    assert picture_storage.save(io.BytesIO(b'picture bytes'), '.png') == (picture_hash, path)
+    assert list((tmp_path / 'tmp').iterdir()) == []
@@ -2,8 +2,8 @@ import bcrypt
 import config
 import jwt
 import pytest
-from model import TweetDao, UserDao
-from service import TweetService, UserService
+from model import InMemoryTimelineStore, TweetDao, UserDao
+from service import TweetBuffer, TweetBufferFull, TweetService, UserService
 from sqlalchemy import create_engine, text
 
 database = create_engine(config.test_config['DB_URL'], encoding='utf-8',
@@ -17,6 +17,10 @@ def user_service():
 def tweet_service():
     return TweetService(TweetDao(database))
 
+@pytest.fixture
+def timeline_store():
+    return InMemoryTimelineStore(TweetDao(database), max_length=3)
+
 def setup_function():
     ## Create a test user
     hashed_password = bcrypt.hashpw(b"test_password", bcrypt.gensalt())
@@ -132,6 +136,34 @@ def test_login(user_service):
         'password': 'wrong_password'
     })
     
+def test_login_credential_cache():
+    user_service = UserService(UserDao(database), {
+        **config.test_config,
+        'CREDENTIAL_CACHE_SIZE': 10
+    })
+    
+    # login returns the user id and an access token for it
+    authorized_user = user_service.login({
+        'email': 'test1@email.com',
+        'password': 'test_password'
+    })
+    payload = jwt.decode(authorized_user['access_token'], config.test_config['JWT_SECRET_KEY'], 'HS256')
+    assert authorized_user['user_id'] == 1
+    assert payload['user_id'] == 1
+    assert user_service.credential_cache.get('test1@email.com')['id'] == 1
+    
+    # changing the password drops the cached credential
+    user_service.change_password('test1@email.com', 'new_password')
+    assert user_service.credential_cache.get('test1@email.com') is None
+    assert not user_service.login({
+        'email': 'test1@email.com',
+        'password': 'test_password'
+    })
+    assert user_service.login({
+        'email': 'test1@email.com',
+        'password': 'new_password'
+    })
+    
 def test_generate_access_token(user_service):
     # check if the user_id is the same as the decoded token's user_id
     token = user_service.generate_access_token(1)
@@ -184,3 +216,93 @@ def test_timeline(user_service, tweet_service):
             'tweet': 'test tweet 2'
         }
     ]
+
+def test_timeline_store(timeline_store):
+    user_service = UserService(UserDao(database), config.test_config, timeline_store)
+    tweet_service = TweetService(TweetDao(database), timeline_store)
+    
+    # first read builds user 1's timeline from the tweets table
+    assert tweet_service.timeline(1) == []
+    
+    tweet_service.tweet(1, 'test tweet 1')
+    user_service.follow(1, 2)
+    tweet_service.tweet(2, 'test tweet 2')
+    
+    assert tweet_service.timeline(1) == [
+        {
+            'user_id': 2,
+            'tweet': 'Hello World'
+        },
+        {
+            'user_id': 1,
+            'tweet': 'test tweet 1'
+        },
+        {
+            'user_id': 2,
+            'tweet': 'test tweet 2'
+        }
+    ]
+    
+    # the store only keeps the newest max_length tweets
+    tweet_service.tweet(1, 'test tweet 3')
+    assert [tweet['tweet'] for tweet in tweet_service.timeline(1)] == [
+        'test tweet 1',
+        'test tweet 2',
+        'test tweet 3'
+    ]
+    
+    # unfollowing removes user 2's tweets from user 1's timeline
+    user_service.unfollow(1, 2)
+    assert tweet_service.timeline(1) == [
+        {
+            'user_id': 1,
+            'tweet': 'test tweet 1'
+        },
+        {
+            'user_id': 1,
+            'tweet': 'test tweet 3'
+        }
+    ]
+
+def test_tweet_batch(tweet_service):
+    results = tweet_service.tweet_batch(1, ['batch tweet 1', 'a' * 301, 'batch tweet 2'])
+    
+    assert [result['created'] for result in results] == [True, False, True]
+    assert results[1]['error'] == 'Your tweet is over 300'
+    assert results[0]['id'] < results[2]['id']
+    assert tweet_service.timeline(1) == [
+        {
+            'user_id': 1,
+            'tweet': 'batch tweet 1'
+        },
+        {
+            'user_id': 1,
+            'tweet': 'batch tweet 2'
+        }
+    ]
+
+def test_tweet_buffer():
+    tweet_buffer = TweetBuffer(TweetDao(database), max_size=2, batch_size=10,
+                               flush_interval=60, put_timeout=0)
+    tweet_service = TweetService(TweetDao(database), tweet_buffer=tweet_buffer)
+    
+    # the flusher isn't started yet, so the third tweet finds the buffer full
+    assert tweet_service.tweet(1, 'buffered tweet 1')
+    assert tweet_service.tweet(1, 'buffered tweet 2')
+    with pytest.raises(TweetBufferFull):
+        tweet_service.tweet(1, 'buffered tweet 3')
+    
+    # closing wakes the flusher up and commits what is buffered as one group
+    tweet_buffer.start()
+    tweet_buffer.close()
+    assert tweet_buffer.stats()['committed'] == 2
+    assert tweet_service.timeline(1) == [
+        {
+            'user_id': 1,
+            'tweet': 'buffered tweet 1'
+        },
+        {
+            'user_id': 1,
+            'tweet': 'buffered tweet 2'
+        }
+    ]
@@ -0,0 +1,27 @@
+from PIL import Image
+
+from service import Thumbnailer
+
+
+## Pictures on disk only, no database needed.
+def test_thumbnailer(tmp_path):
+    Image.new('RGB', (400, 200)).save(tmp_path / 'picture.png')
+    thumbnailer = Thumbnailer(sizes=(48, 96), max_workers=1)
+
+    # variants keep the aspect ratio and are only made once
+    assert thumbnailer.submit(str(tmp_path / 'picture.png')).result() == 2
+    assert Image.open(tmp_path / 'picture@w48.png').size == (48, 24)
+    assert Image.open(tmp_path / 'picture@w96.png').size == (96, 48)
+    assert thumbnailer.backfill(str(tmp_path)) == 0
+
+    # backfill makes the variants of pictures uploaded before
+    Image.new('RGB', (100, 100)).save(tmp_path / 'old_picture.png')
+    assert thumbnailer.backfill(str(tmp_path)) == 2
+
+    # an original named like a size is an original all the same
+    Image.new('RGB', (100, 100)).save(tmp_path / 'avatar_48.png')
+    assert not thumbnailer.is_variant('avatar_48.png')
+    assert thumbnailer.backfill(str(tmp_path)) == 2
+    assert (tmp_path / 'avatar_48@w48.png').exists()
+
+    thumbnailer.shutdown()
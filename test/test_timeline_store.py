@@ -0,0 +1,126 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from model import InMemoryTimelineStore, TableTimelineStore, TweetDao, UserDao
+from model.schema import migrate
+from service import TweetService
+
+
+## The stores run against a SQLite file, no MySQL needed.
+@pytest.fixture
+def database(tmp_path):
+    database = create_engine(f"sqlite:///{tmp_path / 'miniter_test.db'}")
+    migrate(database)
+
+    user_dao = UserDao(database)
+    for i in (1, 2, 3):
+        user_dao.insert_user({
+            'name': f'testName{i}',
+            'email': f'test{i}@email.com',
+            'profile': f'test{i} profile',
+            'password': 'hashed'
+        })
+    user_dao.insert_follow(1, 2)
+    user_dao.insert_follow(3, 2)
+
+    return database
+
+def post(database, user_id, count):
+    return TweetDao(database).insert_tweets(user_id, [f'tweet {i}' for i in range(count)])
+
+def get_entries(database, user_id):
+    rows = database.execute(text("""
+        SELECT tweet_id
+        FROM home_timelines
+        WHERE user_id = :user_id
+        ORDER BY tweet_id
+    """), {'user_id': user_id}).fetchall()
+
+    return [row['tweet_id'] for row in rows]
+
+def is_truncated(database, user_id):
+    return bool(database.execute(text("""
+        SELECT truncated
+        FROM home_timeline_users
+        WHERE user_id = :user_id
+    """), {'user_id': user_id}).scalar())
+
+def test_table_store_push_keeps_max_length(database):
+    timeline_store = TableTimelineStore(database, TweetDao(database), max_length=3)
+    tweet_ids = post(database, 2, 2)
+
+    # materializes the timelines of users 1 and 3
+    assert timeline_store.get(1, 10) == tweet_ids[::-1]
+    assert timeline_store.get(3, 10) == tweet_ids[::-1]
+    assert not is_truncated(database, 1)
+
+    # every push cuts each follower's timeline back to its newest 3 tweets
+    for _ in range(3):
+        tweet_id = post(database, 2, 1)[0]
+        timeline_store.push([1, 2, 3], tweet_id, 2)
+        tweet_ids.append(tweet_id)
+
+    assert get_entries(database, 1) == tweet_ids[-3:]
+    assert get_entries(database, 3) == tweet_ids[-3:]
+    assert is_truncated(database, 1)
+    assert is_truncated(database, 3)
+
+    # the part cut off is left to the tweets table
+    assert timeline_store.get(1, 3) == tweet_ids[:-4:-1]
+    assert timeline_store.get(1, 4) is None
+
+def test_table_store_push_skips_existing_entries(database):
+    timeline_store = TableTimelineStore(database, TweetDao(database))
+    assert timeline_store.get(1, 10) == []
+
+    # a rebuild that already saw the tweet, racing the push
+    tweet_id = post(database, 2, 1)[0]
+    timeline_store.rebuild(1)
+    timeline_store.push([1, 2, 3], tweet_id, 2)
+
+    assert get_entries(database, 1) == [tweet_id]
+
+def test_fan_out_failure_is_logged(database, caplog):
+    class FailingTimelineStore:
+        max_length = 10
+
+        def push(self, user_ids, tweet_id, author_id):
+            raise ConnectionError('database is away')
+
+    tweet_service = TweetService(TweetDao(database), FailingTimelineStore())
+
+    # the tweet is committed, so the push failure doesn't fail the request
+    tweet_id = tweet_service.tweet(2, 'fanned out later')
+    assert [tweet['id'] for tweet in TweetDao(database).get_timeline_page(2, 10)] == [tweet_id]
+    assert 'Failed to fan out' in caplog.text
+
+def test_table_store_backfill_keeps_max_length(database):
+    timeline_store = TableTimelineStore(database, TweetDao(database), max_length=3)
+    assert timeline_store.get(1, 10) == []
+
+    tweet_ids = post(database, 3, 5)
+    timeline_store.backfill(1, 3)
+
+    assert get_entries(database, 1) == tweet_ids[-3:]
+    assert is_truncated(database, 1)
+
+def test_memory_store_max_users(database):
+    tweet_dao = TweetDao(database)
+    timeline_store = InMemoryTimelineStore(tweet_dao, max_length=3, max_users=2)
+    tweet_ids = post(database, 2, 1)
+
+    for user_id in (1, 2, 3):
+        assert timeline_store.get(user_id, 10) == tweet_ids
+
+    # only the two most recently read timelines stay
+    assert list(timeline_store.timelines) == [2, 3]
+
+    # pushes don't keep a timeline, reads do
+    timeline_store.get(2, 10)
+    tweet_id = post(database, 2, 1)[0]
+    timeline_store.push([1, 2, 3], tweet_id, 2)
+    timeline_store.get(1, 10)
+    assert list(timeline_store.timelines) == [2, 1]
+
+    # a dropped timeline is rebuilt on its next read
+    assert timeline_store.get(3, 10) == [tweet_id] + tweet_ids
@@ -0,0 +1,100 @@
+import atexit
+import json
+
+from model import MemoryStore, MemoryTweetDao, MemoryUserDao
+from service import TweetBuffer
+
+
+## Runs without a database, on the in-memory backend.
+class FailingTweetDao:
+    def __init__(self, tweet_dao, failures):
+        self.tweet_dao = tweet_dao
+        self.failures = failures
+        self.calls = 0
+
+    def insert_tweet_groups(self, groups):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError('database is away')
+
+        return self.tweet_dao.insert_tweet_groups(groups)
+
+def create_tweet_dao():
+    store = MemoryStore()
+    MemoryUserDao(store).insert_user({
+        'name': 'testName1',
+        'email': 'test1@email.com',
+        'profile': 'test1 profile',
+        'password': 'hashed'
+    })
+
+    return MemoryTweetDao(store)
+
+def test_flush_retry():
+    tweet_dao = create_tweet_dao()
+    failing_dao = FailingTweetDao(tweet_dao, failures=2)
+    tweet_buffer = TweetBuffer(failing_dao, flush_attempts=3, retry_backoff=0)
+    flushed = []
+    tweet_buffer.on_flush = lambda user_id, tweet_ids: flushed.append((user_id, tweet_ids))
+
+    tweet_buffer.add(1, 'buffered tweet')
+    tweet_buffer.close()
+
+    assert failing_dao.calls == 3
+    assert flushed == [(1, [1])]
+    assert tweet_dao.get_timeline(1) == [{'user_id': 1, 'tweet': 'buffered tweet'}]
+
+    stats = tweet_buffer.stats()
+    assert (stats['committed'], stats['retries'], stats['failed']) == (1, 2, 0)
+
+def test_flush_spool(tmp_path):
+    spool_path = tmp_path / 'tweets.spool'
+    tweet_dao = create_tweet_dao()
+    tweet_buffer = TweetBuffer(FailingTweetDao(tweet_dao, failures=3), flush_attempts=3,
+                               retry_backoff=0, spool_path=str(spool_path))
+
+    tweet_buffer.add(1, 'buffered tweet 1')
+    tweet_buffer.add(1, 'buffered tweet 2')
+    tweet_buffer.close()
+
+    assert tweet_dao.get_timeline(1) == []
+    assert [json.loads(line) for line in spool_path.read_text().splitlines()] == [
+        {'user_id': 1, 'tweet': 'buffered tweet 1'},
+        {'user_id': 1, 'tweet': 'buffered tweet 2'}
+    ]
+
+    stats = tweet_buffer.stats()
+    assert (stats['committed'], stats['spooled'], stats['failed']) == (0, 2, 0)
+
+def test_close_unregisters_atexit(monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    monkeypatch.setattr(atexit, 'unregister', registered.remove)
+
+    tweet_buffer = TweetBuffer(create_tweet_dao(), flush_interval=0.01).start()
+    assert registered == [tweet_buffer.close]
+
+    tweet_buffer.close()
+    assert registered == []
+
+def test_flush_per_author_fallback(tmp_path):
+    spool_path = tmp_path / 'tweets.spool'
+    tweet_dao = create_tweet_dao()
+    tweet_buffer = TweetBuffer(tweet_dao, flush_attempts=3, retry_backoff=0, spool_path=str(spool_path))
+    flushed = []
+    tweet_buffer.on_flush = lambda user_id, tweet_ids: flushed.append((user_id, tweet_ids))
+
+    # user 99 doesn't exist: only their tweet fails, and isn't retried
+    tweet_buffer.add(1, 'buffered tweet 1')
+    tweet_buffer.add(99, 'orphan tweet')
+    tweet_buffer.add(1, 'buffered tweet 2')
+    tweet_buffer.close()
+
+    assert flushed == [(1, [1, 2])]
+    assert [tweet['tweet'] for tweet in tweet_dao.get_timeline(1)] == ['buffered tweet 1', 'buffered tweet 2']
+    assert [json.loads(line) for line in spool_path.read_text().splitlines()] == [
+        {'user_id': 99, 'tweet': 'orphan tweet'}
+    ]
+
+    stats = tweet_buffer.stats()
+    assert (stats['committed'], stats['retries'], stats['spooled'], stats['failed']) == (2, 0, 1, 0)
@@ -1,9 +1,12 @@
+import gzip
+import io
 import json
 import config
 import pytest
 import bcrypt
 from sqlalchemy import create_engine, text
 from app import create_app
+from model.schema import migrate
 database = create_engine(config.test_config['DB_URL'], encoding='utf-8', max_overflow=0)
 
 
@@ -17,6 +20,9 @@ def api():
 
 
 def setup_function():
+    ## Bring the test database up to the current schema
+    migrate(database)
+    
     ## Create  a test user
     hashed_password = bcrypt.hashpw(b'rlawjdgns', bcrypt.gensalt())
     new_users = [{
@@ -136,7 +142,8 @@ def test_tweet(api):
                 'user_id': user_id,
                 'tweet': 'test_tweet!!'
             }
-        ]
+        ],
+        'next_cursor': None
     }
 
 
@@ -162,7 +169,8 @@ def test_follow(api):
     assert res.status_code == 200
     assert tweets == {
         'user_id': 1,
-        'timeline': []
+        'timeline': [],
+        'next_cursor': None
     }
 
     # follow second user
@@ -191,7 +199,8 @@ def test_follow(api):
             'user_id': 2,
             'tweet': 'test tweet!'
             }
-        ]
+        ],
+        'next_cursor': None
     }
         
 
@@ -232,7 +241,8 @@ def test_unfollow(api):
             'user_id': 2,
             'tweet': 'test tweet!'
             }
-        ]
+        ],
+        'next_cursor': None
     }
      
     # Unfollow user 2
@@ -255,13 +265,238 @@ def test_unfollow(api):
     assert res.status_code == 200
     assert tweets == {
         'user_id': 1,
-        'timeline': []
+        'timeline': [],
+        'next_cursor': None
     }
 
+def test_timeline_pagination(api):
+    # user 2 already has one tweet, post four more
+    database.execute(text("""
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            2,
+            :tweet
+        )
+    """), [{'tweet': f'tweet {i}'} for i in range(1, 5)])
+    
+    # newest two tweets first
+    res = api.get('/timeline/2?limit=2')
+    page = json.loads(res.data.decode('utf-8'))
+    assert res.status_code == 200
+    assert [tweet['tweet'] for tweet in page['timeline']] == ['tweet 3', 'tweet 4']
+    assert page['next_cursor'] is not None
+    
+    # follow the cursor to the older tweets
+    res = api.get(f"/timeline/2?limit=2&max_id={page['next_cursor']}")
+    page = json.loads(res.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in page['timeline']] == ['tweet 1', 'tweet 2']
+    
+    res = api.get(f"/timeline/2?limit=2&max_id={page['next_cursor']}")
+    page = json.loads(res.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in page['timeline']] == ['test tweet!']
+    assert page['next_cursor'] is None
+    
+    # since_id=0 means from the beginning
+    res = api.get('/timeline/2?limit=2&since_id=0')
+    assert res.status_code == 200
+    assert [tweet['tweet'] for tweet in json.loads(res.data.decode('utf-8'))['timeline']] == ['tweet 3', 'tweet 4']
+    
+    res = api.get('/timeline/2?limit=abc')
+    assert res.status_code == 400
+    res = api.get('/timeline/2?since_id=-1')
+    assert res.status_code == 400
+
+def test_timeline_conditional(api):
+    res = api.get('/timeline/1')
+    etag = res.headers['ETag']
+    assert res.status_code == 200
+    assert res.headers['Cache-Control'] == 'public, no-cache'
+    
+    res = api.get('/timeline/1', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    assert res.data == b''
+    
+    # following a user changes the timeline
+    res = api.post(
+        '/login',
+        data=json.dumps({'email': 'test@email.com', 'password': 'rlawjdgns'}),
+        content_type='application/json'
+    )
+    access_token = json.loads(res.data.decode('utf-8'))['access_token']
+    api.post(
+        '/follow',
+        data=json.dumps({'follow': 2}),
+        content_type='application/json',
+        headers={'Authorization': access_token}
+    )
+    
+    res = api.get('/timeline/1', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
+    
+    res = api.get('/timeline/1', headers={'If-Modified-Since': res.headers['Last-Modified']})
+    assert res.status_code == 304
+
+def test_timeline_stream(api):
+    database.execute(text("""
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            2,
+            :tweet
+        )
+    """), [{'tweet': f'tweet {i}'} for i in range(1, 5)])
+
+    # the whole timeline, oldest first, limit is ignored
+    res = api.get('/timeline/2?stream=1&limit=2')
+    timeline = json.loads(res.data.decode('utf-8'))
+    assert res.status_code == 200
+    assert [tweet['tweet'] for tweet in timeline['timeline']] == [
+        'test tweet!', 'tweet 1', 'tweet 2', 'tweet 3', 'tweet 4'
+    ]
+    assert timeline['next_cursor'] is None
+
+    # same tweets as the paginated response
+    res = api.get('/timeline/2?limit=5')
+    assert json.loads(res.data.decode('utf-8'))['timeline'] == timeline['timeline']
+
+def test_token_cache(api):
+    res = api.post(
+        '/login',
+        data=json.dumps({'email': 'test@email.com', 'password': 'rlawjdgns'}),
+        content_type='application/json'
+    )
+    access_token = json.loads(res.data.decode('utf-8'))['access_token']
+    token_cache = api.application.extensions['token_cache']
+
+    # first request verifies the token, the second one is served from the cache
+    for _ in range(2):
+        res = api.get('/timeline', headers={'Authorization': access_token})
+        assert res.status_code == 200
+
+    assert token_cache.stats()['misses'] == 1
+    assert token_cache.stats()['hits'] == 1
 
+    # a token that fails verification is never cached
+    res = api.get('/timeline', headers={'Authorization': access_token + 'x'})
+    assert res.status_code == 401
+    assert token_cache.stats()['size'] == 1
 
+def test_stats(api):
+    api.get('/timeline/1')
 
+    res = api.get('/stats')
+    stats = json.loads(res.data.decode('utf-8'))
+    assert res.status_code == 200
+    assert stats['pool_stats']['checkouts'] >= 1
+    assert stats['pool_stats']['in_use'] == 0
+    assert 'hits' in stats['token_cache']
 
+    # only internal addresses may read it
+    res = api.get('/stats', environ_base={'REMOTE_ADDR': '10.1.2.3'})
+    assert res.status_code == 403
+
+def test_profile_picture_etag(tmp_path):
+    app = create_app({**config.test_config, 'UPLOAD_DIRECTORY': str(tmp_path)})
+    api = app.test_client()
+    res = api.post(
+        '/login',
+        data=json.dumps({'email': 'test@email.com', 'password': 'rlawjdgns'}),
+        content_type='application/json'
+    )
+    access_token = json.loads(res.data.decode('utf-8'))['access_token']
+
+    res = api.post(
+        '/profile-picture',
+        data={'profile_pic': (io.BytesIO(b'test picture'), 'test.png')},
+        content_type='multipart/form-data',
+        headers={'Authorization': access_token}
+    )
+    assert res.status_code == 200
+
+    res = api.get('/profile-picture/1')
+    assert res.status_code == 200
+    assert res.data == b'test picture'
+    assert res.headers['Cache-Control'] == 'public, no-cache'
+    etag = res.headers['ETag']
+    picture_url = res.headers['Content-Location']
+
+    # a client holding the current picture gets a 304 without the body
+    res = api.get('/profile-picture/1', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    assert res.data == b''
+
+    # the stored file's URL changes with the content, so it can be kept for long
+    res = api.get(picture_url)
+    assert res.status_code == 200
+    assert res.data == b'test picture'
+    assert res.headers['Cache-Control'] == f'public, max-age={config.PROFILE_PICTURE_MAX_AGE}, immutable'
+    assert api.get('/profile-picture/file/' + '0' * 64 + '.png').status_code == 404
+
+    # a new upload changes the ETag
+    api.post(
+        '/profile-picture',
+        data={'profile_pic': (io.BytesIO(b'new test picture'), 'test.png')},
+        content_type='multipart/form-data',
+        headers={'Authorization': access_token}
+    )
+    res = api.get('/profile-picture/1', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.data == b'new test picture'
+    assert res.headers['Content-Location'] != picture_url
+
+def test_compression(api):
+    database.execute(text("""
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            2,
+            :tweet
+        )
+    """), [{'tweet': f'tweet {i}'} for i in range(100)])
+    
+    res = api.get('/timeline/2', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in res.headers['Vary']
+    assert len(json.loads(gzip.decompress(res.data))['timeline']) == 50
+    
+    # not asked for, or below the size threshold
+    assert 'Content-Encoding' not in api.get('/timeline/2').headers
+    assert 'Content-Encoding' not in api.get('/timeline/2?limit=1', headers={'Accept-Encoding': 'gzip'}).headers
+    
+    stats = api.application.extensions['compressor'].stats()
+    assert stats['encodings']['gzip']['responses'] == 1
+    assert stats['skipped_small'] == 1
+
+def test_metrics(api):
+    for _ in range(3):
+        api.get('/ping')
+    api.get('/timeline/1')
+    
+    res = api.get('/metrics')
+    assert res.status_code == 200
+    assert res.mimetype == 'text/plain'
+    
+    metrics = res.data.decode('utf-8')
+    assert 'http_requests_total{method="GET",route="/ping",status="200"} 3' in metrics
+    assert 'http_request_duration_seconds_count{method="GET",route="/timeline/<int:user_id>"} 1' in metrics
+    assert 'http_requests_in_flight{method="GET",route="/metrics"} 1' in metrics
+    
+    res = api.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert res.status_code == 403
+
+def test_query_count(api):
+    api.application.extensions['metrics'].query_count_header = True
+    
+    res = api.get('/timeline/2')
+    assert int(res.headers['X-Query-Count']) > 0
+    
+    res = api.get('/stats')
+    assert json.loads(res.data.decode('utf-8'))['query_stats']['distinct_statements'] > 0
 
 def teardown_function():
     database.execute(text("SET FOREIGN_KEY_CHECKS=0"))
@@ -269,5 +504,3 @@ def teardown_function():
     database.execute(text("TRUNCATE tweets"))
     database.execute(text("TRUNCATE users_follow_list"))
     database.execute(text("SET FOREIGN_KEY_CHECKS=1"))
-
-
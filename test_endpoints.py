@@ -136,7 +136,8 @@ def test_tweet(api):
                 'user_id': user_id,
                 'tweet': 'test_tweet!!'
             }
-        ]
+        ],
+        'next_cursor': None
     }
 
 
@@ -162,7 +163,8 @@ def test_follow(api):
     assert res.status_code == 200
     assert tweets == {
         'user_id': 1,
-        'timeline': []
+        'timeline': [],
+        'next_cursor': None
     }
 
     # follow second user
@@ -191,7 +193,8 @@ def test_follow(api):
             'user_id': 2,
             'tweet': 'test tweet!'
             }
-        ]
+        ],
+        'next_cursor': None
     }
         
 
@@ -232,7 +235,8 @@ def test_unfollow(api):
             'user_id': 2,
             'tweet': 'test tweet!'
             }
-        ]
+        ],
+        'next_cursor': None
     }
      
     # Unfollow user 2
@@ -255,7 +259,8 @@ def test_unfollow(api):
     assert res.status_code == 200
     assert tweets == {
         'user_id': 1,
-        'timeline': []
+        'timeline': [],
+        'next_cursor': None
     }
 
 
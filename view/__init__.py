@@ -1,38 +1,59 @@
+import mimetypes
+import os
 from functools import wraps
 
 import jwt
-from flask import Response, current_app, g, jsonify, request, send_file
-from flask.json import JSONEncoder
+from flask import Response, current_app, g, json, jsonify, request, send_file, stream_with_context
+from werkzeug.http import http_date, is_resource_modified
 from werkzeug.utils import secure_filename
 
-
-## Default Json encoder is not able to transform set to JSON.
-## By writing Custom Json Encoder, change 'set' to 'list'
-class CustomJSONEcoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-    
-        return JSONEncoder.default(self, obj)
+from service import PasswordHasherBusy, TweetBufferFull
+from .admission import AdmissionController
+from .compression import Compressor
+from .metrics import RequestMetrics
+from .json_encoding import CustomJSONEcoder, OrjsonEncoder, json_encoder_class
+from .token_cache import TokenCache
 
 
 ########################################################################
 #           Decorators
 ########################################################################
+## Decoded payload of a valid access token, None otherwise.
+## Tokens verified before skip the signature check until they expire.
+def verify_access_token(access_token, token_cache, secret_key):
+    payload = token_cache.get(access_token)
+    
+    if payload is None:
+        try:
+            payload = jwt.decode(access_token, secret_key, 'HS256')
+        except jwt.InvalidTokenError:
+            payload = None
+        
+        if payload is not None:
+            token_cache.put(access_token, payload)
+    
+    return payload
+
 def login_required(f):
     @wraps(f)
     def wrapper_function(*args, **kwargs):
         access_token = request.headers.get('Authorization')
         if access_token is not None:
-            try:
-                payload = jwt.decode(access_token, current_app.config['JWT_SECRET_KEY'], 'HS256')
-            except jwt.InvalidTokenError:
-                payload = None
+            payload = verify_access_token(access_token,
+                                          current_app.extensions['token_cache'],
+                                          current_app.config['JWT_SECRET_KEY'])
             
             if payload is None: return Response(status=401)
             
             user_id = payload['user_id']
             g.user_id = user_id
+            
+            ## Per-user rate limits, see AdmissionController
+            admission = current_app.extensions.get('admission')
+            if admission is not None:
+                retry_after = admission.take_token(user_id)
+                if retry_after is not None:
+                    return admission.rate_limited_response(retry_after)
         
         else:
             return Response(status=401)
@@ -40,8 +61,98 @@ def login_required(f):
         return f(*args, **kwargs)
     return wrapper_function
 
+## Parse limit, max_id and since_id query parameters of the timeline endpoints.
+## Returns None when limit or max_id is not a positive integer, or since_id is negative.
+def parse_timeline_page_args(query_args, config):
+    page_size = config.get('TIMELINE_PAGE_SIZE', 50)
+    max_page_size = config.get('TIMELINE_MAX_PAGE_SIZE', 200)
+    
+    args = {}
+    for name in ('limit', 'max_id', 'since_id'):
+        if name not in query_args:
+            continue
+        
+        ## since_id=0 is 'from the beginning'
+        value = query_args.get(name, type=int)
+        if value is None or value < (0 if name == 'since_id' else 1):
+            return None
+        args[name] = value
+    
+    args['limit'] = min(args.get('limit', page_size), max_page_size)
+    
+    return args
+
+def timeline_page_args():
+    return parse_timeline_page_args(request.args, current_app.config)
+
+## ?stream=1 on the timeline endpoints returns the whole timeline (bounded by max_id and
+## since_id, limit is ignored) as a streamed response instead of one page.
+def timeline_stream_requested():
+    return request.args.get('stream', type=int) == 1
+
+## Same body as the paginated timeline response, encoded and sent while `tweets` is iterated,
+## `chunk_size` tweets per chunk. next_cursor is always null: the stream is the whole timeline.
+def timeline_stream_response(user_id, tweets, chunk_size=100):
+    def generate():
+        yield '{"user_id":%s,"timeline":[' % json.dumps(user_id)
+        
+        chunk = []
+        separator = ''
+        for tweet in tweets:
+            chunk.append(json.dumps(tweet))
+            if len(chunk) == chunk_size:
+                yield separator + ','.join(chunk)
+                chunk = []
+                separator = ','
+        if chunk:
+            yield separator + ','.join(chunk)
+        
+        yield '],"next_cursor":null}\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+## ETag, Last-Modified and Cache-Control of a public timeline, from its validator
+## (TweetService.timeline_version). Clients and caches revalidate on every poll (no-cache),
+## which costs the validator query only while the timeline is unchanged.
+def timeline_cache_headers(user_id, version):
+    headers = {
+        'ETag': f'"{user_id}.{version["max_tweet_id"]}.{version["follow_version"]}"',
+        'Cache-Control': 'public, no-cache'
+    }
+    if version['modified_at'] is not None:
+        headers['Last-Modified'] = http_date(version['modified_at'])
+    
+    return headers
+
+## Cache-Control, and X-Sendfile / X-Accel-Redirect headers of profile picture responses.
+## /profile-picture/<user_id> shows whatever the user's picture is now, so it is revalidated
+## every time (no-cache), and its Content-Location names the stored file of that picture.
+## /profile-picture/file/<name> never changes (the name comes from the content): it is
+## immutable and cached for PROFILE_PICTURE_MAX_AGE.
+## PROFILE_PICTURE_SENDFILE = 'x-sendfile' or 'x-accel-redirect' lets the front proxy send the bytes;
+## X-Accel-Redirect points at PROFILE_PICTURE_ACCEL_PREFIX + the path inside UPLOAD_DIRECTORY.
+def profile_picture_headers(config, picture_file, immutable=False):
+    headers = {'ETag': f'"{picture_file["etag"]}"'}
+    if immutable:
+        headers['Cache-Control'] = f'public, max-age={config.get("PROFILE_PICTURE_MAX_AGE", 86400)}, immutable'
+    else:
+        headers['Cache-Control'] = 'public, no-cache'
+        if picture_file.get('name'):
+            headers['Content-Location'] = f'/profile-picture/file/{picture_file["name"]}'
+    
+    sendfile = config.get('PROFILE_PICTURE_SENDFILE')
+    if sendfile == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(picture_file['path'])
+    elif sendfile == 'x-accel-redirect':
+        relative_path = os.path.relpath(picture_file['path'], config['UPLOAD_DIRECTORY'])
+        headers['X-Accel-Redirect'] = config.get('PROFILE_PICTURE_ACCEL_PREFIX', '/profile-pictures/') + relative_path
+    
+    return headers
+
 def create_endpoints(app, services):
-    app.json_encoder = CustomJSONEcoder
+    app.json_encoder = json_encoder_class(app.config.get('JSON_ENCODER', 'orjson'))
+    app.extensions['token_cache'] = TokenCache(app.config.get('JWT_CACHE_SIZE', 1024),
+                                               app.config.get('JWT_CACHE_TTL', 300))
     user_service = services.user_service
     tweet_service = services.tweet_service
     
@@ -49,27 +160,49 @@ def create_endpoints(app, services):
     def ping():
         return "pong"
     
+    ## Internal counters: connection pool, SQL statements, verified-token cache, tweet buffer and compression
+    @app.route("/stats", methods=['GET'])
+    def stats():
+        if request.remote_addr not in app.config.get('INTERNAL_ADDRESSES', ['127.0.0.1']):
+            return '', 403
+        
+        return jsonify({
+            name: app.extensions[name].stats()
+            for name in ('pool_stats', 'replica_router', 'query_stats', 'memory_store', 'admission', 'token_cache',
+                         'tweet_buffer', 'compressor')
+            if name in app.extensions
+        })
+    
+    ## Prometheus scrape endpoint, see RequestMetrics
+    @app.route("/metrics", methods=['GET'])
+    def metrics():
+        if request.remote_addr not in app.config.get('INTERNAL_ADDRESSES', ['127.0.0.1']):
+            return '', 403
+        if 'metrics' not in app.extensions:
+            return '', 404
+        
+        return Response(app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
+    
     @app.route("/sign-up", methods=['POST'])
     def sign_up():
         new_user = request.json
-        new_user_id = user_service.create_new_user(new_user)
+        try:
+            new_user_id = user_service.create_new_user(new_user)
+        except PasswordHasherBusy:
+            return 'Server is busy', 503, {'Retry-After': '1'}
         
         return jsonify(new_user_id)
     
     @app.route("/login", methods=['POST'])
     def login():
         credential = request.json
-        authorized = user_service.login(credential)
+        try:
+            authorized_user = user_service.login(credential)
+        except PasswordHasherBusy:
+            return 'Server is busy', 503, {'Retry-After': '1'}
         
-        if authorized:
-            user_credential = user_service.get_user_id_and_password(credential['email'])
-            user_id = user_credential['id']
-            token = user_service.generate_access_token(user_id)
-            
-            return jsonify({
-                'user_id': user_id,
-                'access_token': token
-            })
+        if authorized_user:
+            return jsonify(authorized_user)
         
         else:
             return '', 401
@@ -81,13 +214,33 @@ def create_endpoints(app, services):
         tweet = user_tweet['tweet']
         user_id = g.user_id
         
-        result = tweet_service.tweet(user_id, tweet)
+        try:
+            result = tweet_service.tweet(user_id, tweet)
+        except TweetBufferFull:
+            return 'Server is busy', 503, {'Retry-After': '1'}
+        
         if result is None:
             return 'Your tweet is over 300', 400
         
         return '', 200
     
     
+    @app.route("/tweets/batch", methods=['POST'])
+    @login_required
+    def tweet_batch():
+        payload = request.json
+        items = payload.get('tweets') if isinstance(payload, dict) else None
+        
+        if not isinstance(items, list):
+            return 'Tweets are missing', 400
+        if len(items) > app.config.get('TWEET_BATCH_MAX_SIZE', 500):
+            return 'Too many tweets', 413
+        
+        tweets = [item.get('tweet') if isinstance(item, dict) else None for item in items]
+        results = tweet_service.tweet_batch(g.user_id, tweets)
+        
+        return jsonify({'results': results})
+    
     @app.route("/follow", methods=['POST'])
     @login_required
     def follow():
@@ -110,23 +263,88 @@ def create_endpoints(app, services):
         
         return '', 200
     
+    ## Follow or unfollow a list of users at once: {'follow': [ids]} / {'unfollow': [ids]}.
+    ## Already applied edges are skipped, the response lists the ids that changed.
+    def user_ids_payload(key):
+        payload = request.json
+        user_ids = payload.get(key) if isinstance(payload, dict) else None
+        
+        if not isinstance(user_ids, list) or not all(type(user_id) is int for user_id in user_ids):
+            return None
+        
+        return user_ids
+    
+    @app.route("/follow/batch", methods=['POST'])
+    @login_required
+    def follow_batch():
+        follow_ids = user_ids_payload('follow')
+        if follow_ids is None:
+            return 'User ids are missing', 400
+        if len(follow_ids) > app.config.get('FOLLOW_BATCH_MAX_SIZE', 500):
+            return 'Too many users', 413
+        
+        followed = user_service.follow_many(g.user_id, follow_ids)
+        
+        return jsonify({'followed': followed})
+    
+    @app.route("/unfollow/batch", methods=['POST'])
+    @login_required
+    def unfollow_batch():
+        unfollow_ids = user_ids_payload('unfollow')
+        if unfollow_ids is None:
+            return 'User ids are missing', 400
+        if len(unfollow_ids) > app.config.get('FOLLOW_BATCH_MAX_SIZE', 500):
+            return 'Too many users', 413
+        
+        unfollowed = user_service.unfollow_many(g.user_id, unfollow_ids)
+        
+        return jsonify({'unfollowed': unfollowed})
+    
     @app.route("/timeline/<int:user_id>", methods=['GET'])
     def timeline(user_id):
-        timeline = tweet_service.timeline(user_id)
+        page_args = timeline_page_args()
+        if page_args is None:
+            return 'Invalid pagination parameters', 400
+        
+        ## Answer polls of an unchanged timeline without reading it
+        headers = {}
+        version = tweet_service.timeline_version(user_id)
+        if version is not None:
+            headers = timeline_cache_headers(user_id, version)
+            if not is_resource_modified(request.environ,
+                                        etag=headers['ETag'],
+                                        last_modified=headers.get('Last-Modified')):
+                return Response(status=304, headers=headers)
+        
+        if timeline_stream_requested():
+            tweets = tweet_service.iter_timeline(user_id, page_args.get('max_id'), page_args.get('since_id'))
+            return timeline_stream_response(user_id, tweets), headers
+        
+        page = tweet_service.timeline_page(user_id, **page_args)
         
         return jsonify({
             'user_id': user_id,
-            'timeline': timeline
-        })
+            'timeline': page['timeline'],
+            'next_cursor': page['next_cursor']
+        }), headers
         
     @app.route("/timeline", methods=['GET'])
     @login_required
     def user_timeline():
-        timeline = tweet_service.timeline(g.user_id)
+        page_args = timeline_page_args()
+        if page_args is None:
+            return 'Invalid pagination parameters', 400
+        
+        if timeline_stream_requested():
+            tweets = tweet_service.iter_timeline(g.user_id, page_args.get('max_id'), page_args.get('since_id'))
+            return timeline_stream_response(g.user_id, tweets)
+        
+        page = tweet_service.timeline_page(g.user_id, **page_args)
         
         return jsonify({
             'user_id': g.user_id,
-            'timeline': timeline
+            'timeline': page['timeline'],
+            'next_cursor': page['next_cursor']
         })
 
     @app.route("/profile-picture", methods=['POST'])
@@ -148,11 +366,45 @@ def create_endpoints(app, services):
         
         return '', 200
     
+    ## Strong ETag from the picture's content hash: If-None-Match is answered with 304
+    ## before the file is touched, and Range requests are served by send_file.
+    def profile_picture_response(picture_file, headers):
+        if picture_file['etag'] in request.if_none_match:
+            return Response(status=304, headers={name: value for name, value in headers.items()
+                                                 if name in ('ETag', 'Cache-Control', 'Content-Location')})
+        
+        if 'X-Sendfile' in headers or 'X-Accel-Redirect' in headers:
+            mimetype = mimetypes.guess_type(picture_file['path'])[0] or 'application/octet-stream'
+            return Response(mimetype=mimetype, headers=headers)
+        
+        response = send_file(picture_file['path'], conditional=True, etag=picture_file['etag'])
+        response.headers['Cache-Control'] = headers['Cache-Control']
+        if 'Content-Location' in headers:
+            response.headers['Content-Location'] = headers['Content-Location']
+        
+        return response
+    
+    ## ?size= picks one of the PROFILE_PICTURE_SIZES variants.
     @app.route("/profile-picture/<int:user_id>", methods=['GET'])
     def get_profile_picture(user_id):
-        profile_picture = user_service.get_profile_picture(user_id)
+        size = request.args.get('size', type=int)
+        if 'size' in request.args and size not in app.config.get('PROFILE_PICTURE_SIZES', (48, 96, 200)):
+            return 'Invalid size', 400
         
-        if profile_picture:
-            return send_file(profile_picture)
+        if size is None:
+            picture_file = user_service.get_profile_picture_file(user_id)
         else:
-            return '', 404
\ No newline at end of file
+            picture_file = user_service.get_profile_picture_variant(user_id, size)
+        
+        if not picture_file:
+            return '', 404
+        
+        return profile_picture_response(picture_file, profile_picture_headers(app.config, picture_file))
+    
+    @app.route("/profile-picture/file/<name>", methods=['GET'])
+    def get_stored_profile_picture(name):
+        picture_file = user_service.get_stored_picture(name)
+        if not picture_file:
+            return '', 404
+        
+        return profile_picture_response(picture_file, profile_picture_headers(app.config, picture_file, immutable=True))
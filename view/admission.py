@@ -0,0 +1,176 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, g, request
+
+## Endpoint (view function name) -> route class. Endpoints of no class (/ping, /stats,
+## /metrics) are always admitted, so health checks answer while the app is shedding load.
+ROUTE_CLASSES = {
+    'sign_up': 'auth',
+    'login': 'auth',
+    'tweet': 'writes',
+    'tweet_batch': 'writes',
+    'follow': 'writes',
+    'unfollow': 'writes',
+    'follow_batch': 'writes',
+    'unfollow_batch': 'writes',
+    'upload_profile_picture': 'writes',
+    'timeline': 'reads',
+    'user_timeline': 'reads',
+    'get_profile_picture': 'static',
+    'get_stored_profile_picture': 'static'
+}
+
+
+## Admission control in front of the endpoints. Each route class admits at most
+## ADMISSION_LIMITS[class] requests at once; a request that finds its class full waits up
+## to ADMISSION_QUEUE_TIMEOUT seconds for a slot (0: not at all) and is then answered
+## 503 with Retry-After, before the view checks out a database connection. So when the
+## database slows down, the requests beyond the limits fail fast instead of queueing
+## on the pool, and the other classes (and /ping) keep their latency.
+## A slot is held until the request context is torn down, after a streamed body is sent.
+##
+## With USER_RATE_LIMITS = {class: (tokens per second, burst)}, each authenticated user
+## also has a token bucket per listed class; login_required calls take_token() once
+## g.user_id is known and answers 429 with Retry-After when the bucket is empty.
+## Buckets of the USER_RATE_LIMIT_MAX_USERS most recent users are kept, an evicted
+## user starts again with a full bucket.
+## ADMISSION_ROUTE_CLASSES adds to or overrides ROUTE_CLASSES; an endpoint mapped to None
+## is exempt. A configuration that can't work (a class name that isn't a string, a rate
+## that isn't positive) raises ValueError when the app is created, not on a request.
+class AdmissionController:
+    def __init__(self, config):
+        self.limits = {route_class: limit
+                       for route_class, limit in (config.get('ADMISSION_LIMITS') or {}).items() if limit}
+        route_classes = dict(ROUTE_CLASSES, **(config.get('ADMISSION_ROUTE_CLASSES') or {}))
+        self.route_classes = {endpoint: route_class
+                              for endpoint, route_class in route_classes.items() if route_class is not None}
+        self.queue_timeout = config.get('ADMISSION_QUEUE_TIMEOUT', 0)
+        self.retry_after = config.get('ADMISSION_RETRY_AFTER', 1)
+        self.rate_limits = config.get('USER_RATE_LIMITS') or {}
+        self.max_users = config.get('USER_RATE_LIMIT_MAX_USERS', 100000)
+
+        for endpoint, route_class in self.route_classes.items():
+            if not isinstance(route_class, str):
+                raise ValueError(f'ADMISSION_ROUTE_CLASSES: route class of {endpoint} is not a string: {route_class!r}')
+        for route_class, rate_limit in self.rate_limits.items():
+            rate, burst = rate_limit
+            if not rate > 0 or not burst >= 1:
+                raise ValueError(f'USER_RATE_LIMITS: {route_class} needs a rate > 0 and a burst >= 1, got {rate_limit!r}')
+
+        self.slots = {route_class: threading.BoundedSemaphore(limit) for route_class, limit in self.limits.items()}
+        self.lock = threading.Lock()
+        ## (user_id, route class) -> [tokens, monotonic time of the last refill]
+        self.buckets = OrderedDict()
+        self.counters = {route_class: {
+            'admitted': 0,
+            'rejected': 0,
+            'rate_limited': 0,
+            'in_flight': 0,
+            'in_flight_max': 0
+        } for route_class in set(self.route_classes.values())}
+
+    def attach(self, app):
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+
+        return self
+
+    def route_class(self):
+        return self.route_classes.get(request.endpoint)
+
+    def admit(self):
+        route_class = self.route_class()
+        slots = self.slots.get(route_class)
+        if slots is None:
+            return None
+
+        if self.queue_timeout:
+            admitted = slots.acquire(timeout=self.queue_timeout)
+        else:
+            admitted = slots.acquire(blocking=False)
+
+        with self.lock:
+            counters = self.counters[route_class]
+            if not admitted:
+                counters['rejected'] += 1
+            else:
+                counters['admitted'] += 1
+                counters['in_flight'] += 1
+                counters['in_flight_max'] = max(counters['in_flight_max'], counters['in_flight'])
+
+        if not admitted:
+            return Response('Server is busy', status=503, headers={'Retry-After': str(self.retry_after)})
+
+        g.admission_class = route_class
+        return None
+
+    def release(self, exception=None):
+        route_class = g.pop('admission_class', None)
+        if route_class is None:
+            return
+
+        with self.lock:
+            self.counters[route_class]['in_flight'] -= 1
+        self.slots[route_class].release()
+
+    ## Takes a token from the user's bucket of the current route class.
+    ## Returns None when the request may go on, else the seconds until a token is available.
+    def take_token(self, user_id):
+        route_class = self.route_class()
+        rate_limit = self.rate_limits.get(route_class)
+        if rate_limit is None:
+            return None
+
+        rate, burst = rate_limit
+        key = (user_id, route_class)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [burst, now]
+                if len(self.buckets) > self.max_users:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return None
+
+            self.counters[route_class]['rate_limited'] += 1
+            return (1 - bucket[0]) / rate
+
+    ## 429 answer for a take_token() result
+    @staticmethod
+    def rate_limited_response(retry_after):
+        return Response('Too many requests', status=429, headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+    ## Per route class: requests admitted, rejected with 503 and 429, and in flight now / at most,
+    ## with the limits they run under.
+    def stats(self):
+        with self.lock:
+            return {
+                'classes': {route_class: dict(counters,
+                                              limit=self.limits.get(route_class),
+                                              rate_limit=self.rate_limits.get(route_class))
+                            for route_class, counters in self.counters.items()},
+                'rate_limit_buckets': len(self.buckets)
+            }
+
+    ## The same counters for RequestMetrics.add_collector
+    def metrics(self):
+        classes = self.stats()['classes']
+        return [
+            (f'http_admission_{name}', metric_type, description,
+             [({'route_class': route_class}, counters[key]) for route_class, counters in sorted(classes.items())])
+            for name, metric_type, key, description in (
+                ('admitted_total', 'counter', 'admitted', 'Requests admitted, by route class.'),
+                ('rejected_total', 'counter', 'rejected', 'Requests shed with 503, by route class.'),
+                ('rate_limited_total', 'counter', 'rate_limited', 'Requests refused with 429, by route class.'),
+                ('in_flight', 'gauge', 'in_flight', 'Admitted requests being served, by route class.'))
+        ]
@@ -0,0 +1,198 @@
+import mimetypes
+from functools import wraps
+
+from quart import Response, current_app, g, jsonify, request, send_file
+from werkzeug.utils import secure_filename
+
+from service import PasswordHasherBusy
+from . import (json_encoder_class, parse_timeline_page_args, profile_picture_headers,
+               verify_access_token)
+from .token_cache import TokenCache
+
+
+########################################################################
+#           Decorators
+########################################################################
+def async_login_required(f):
+    @wraps(f)
+    async def wrapper_function(*args, **kwargs):
+        access_token = request.headers.get('Authorization')
+        if access_token is not None:
+            payload = verify_access_token(access_token,
+                                          current_app.extensions['token_cache'],
+                                          current_app.config['JWT_SECRET_KEY'])
+            
+            if payload is None: return Response('', status=401)
+            
+            user_id = payload['user_id']
+            g.user_id = user_id
+        
+        else:
+            return Response('', status=401)
+
+        return await f(*args, **kwargs)
+    return wrapper_function
+
+## The core endpoints of view.create_endpoints, on a Quart (ASGI) app.
+def create_async_endpoints(app, services):
+    app.json_encoder = json_encoder_class(app.config.get('JSON_ENCODER', 'orjson'))
+    app.extensions['token_cache'] = TokenCache(app.config.get('JWT_CACHE_SIZE', 1024),
+                                               app.config.get('JWT_CACHE_TTL', 300))
+    user_service = services.user_service
+    tweet_service = services.tweet_service
+    
+    @app.route("/ping", methods=['GET'])
+    async def ping():
+        return "pong"
+    
+    @app.route("/stats", methods=['GET'])
+    async def stats():
+        if request.remote_addr not in app.config.get('INTERNAL_ADDRESSES', ['127.0.0.1']):
+            return '', 403
+        
+        return jsonify({
+            name: app.extensions[name].stats()
+            for name in ('pool_stats', 'query_stats', 'token_cache') if name in app.extensions
+        })
+    
+    @app.route("/sign-up", methods=['POST'])
+    async def sign_up():
+        new_user = await request.get_json()
+        try:
+            new_user_id = await user_service.create_new_user(new_user)
+        except PasswordHasherBusy:
+            return 'Server is busy', 503, {'Retry-After': '1'}
+        
+        return jsonify(new_user_id)
+    
+    @app.route("/login", methods=['POST'])
+    async def login():
+        credential = await request.get_json()
+        try:
+            authorized_user = await user_service.login(credential)
+        except PasswordHasherBusy:
+            return 'Server is busy', 503, {'Retry-After': '1'}
+        
+        if authorized_user:
+            return jsonify(authorized_user)
+        
+        else:
+            return '', 401
+        
+    @app.route("/tweet", methods=['POST'])
+    @async_login_required
+    async def tweet():
+        user_tweet = await request.get_json()
+        tweet = user_tweet['tweet']
+        user_id = g.user_id
+        
+        result = await tweet_service.tweet(user_id, tweet)
+        if result is None:
+            return 'Your tweet is over 300', 400
+        
+        return '', 200
+    
+    @app.route("/follow", methods=['POST'])
+    @async_login_required
+    async def follow():
+        payload = await request.get_json()
+        user_id = g.user_id
+        follow_id = payload['follow']
+        
+        await user_service.follow(user_id, follow_id)
+        
+        return '', 200
+    
+    @app.route("/unfollow", methods=['POST'])
+    @async_login_required
+    async def unfollow():
+        payload = await request.get_json()
+        user_id = g.user_id
+        unfollow_id = payload['unfollow']
+        
+        await user_service.unfollow(user_id, unfollow_id)
+        
+        return '', 200
+    
+    @app.route("/timeline/<int:user_id>", methods=['GET'])
+    async def timeline(user_id):
+        page_args = parse_timeline_page_args(request.args, app.config)
+        if page_args is None:
+            return 'Invalid pagination parameters', 400
+        
+        page = await tweet_service.timeline_page(user_id, **page_args)
+        
+        return jsonify({
+            'user_id': user_id,
+            'timeline': page['timeline'],
+            'next_cursor': page['next_cursor']
+        })
+        
+    @app.route("/timeline", methods=['GET'])
+    @async_login_required
+    async def user_timeline():
+        page_args = parse_timeline_page_args(request.args, app.config)
+        if page_args is None:
+            return 'Invalid pagination parameters', 400
+        
+        page = await tweet_service.timeline_page(g.user_id, **page_args)
+        
+        return jsonify({
+            'user_id': g.user_id,
+            'timeline': page['timeline'],
+            'next_cursor': page['next_cursor']
+        })
+
+    @app.route("/profile-picture", methods=['POST'])
+    @async_login_required
+    async def upload_profile_picture():
+        user_id = g.user_id
+        files = await request.files
+        
+        if 'profile_pic' not in files:
+            return 'File is missing', 404
+        
+        profile_pic = files['profile_pic']
+        
+        if profile_pic.filename == '':
+            return 'File is missing', 404
+        
+        filename = secure_filename(profile_pic.filename)
+        
+        await user_service.save_profile_picture(profile_pic, filename, user_id)
+        
+        return '', 200
+    
+    async def profile_picture_response(picture_file, headers):
+        if picture_file['etag'] in request.if_none_match:
+            return Response('', status=304, headers={name: value for name, value in headers.items()
+                                                     if name in ('ETag', 'Cache-Control', 'Content-Location')})
+        
+        if 'X-Sendfile' in headers or 'X-Accel-Redirect' in headers:
+            mimetype = mimetypes.guess_type(picture_file['path'])[0] or 'application/octet-stream'
+            return Response('', mimetype=mimetype, headers=headers)
+        
+        response = await send_file(picture_file['path'], add_etags=False, conditional=True)
+        for name in ('ETag', 'Cache-Control', 'Content-Location'):
+            if name in headers:
+                response.headers[name] = headers[name]
+        
+        return response
+    
+    @app.route("/profile-picture/<int:user_id>", methods=['GET'])
+    async def get_profile_picture(user_id):
+        picture_file = await user_service.get_profile_picture_file(user_id)
+        
+        if not picture_file:
+            return '', 404
+        
+        return await profile_picture_response(picture_file, profile_picture_headers(app.config, picture_file))
+    
+    @app.route("/profile-picture/file/<name>", methods=['GET'])
+    async def get_stored_profile_picture(name):
+        picture_file = await user_service.get_stored_picture(name)
+        if not picture_file:
+            return '', 404
+        
+        return await profile_picture_response(picture_file,
+                                              profile_picture_headers(app.config, picture_file, immutable=True))
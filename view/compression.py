@@ -0,0 +1,157 @@
+import gzip
+import threading
+import time
+
+from flask import request
+
+from service.ttl_cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def gzip_compress(data, level):
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def brotli_compress(data, level):
+    return brotli.compress(data, quality=level)
+
+def zstd_compress(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+## Content-Encoding -> (compress function, default level), for the codecs installed here.
+CODECS = {'gzip': (gzip_compress, 6)}
+if brotli is not None:
+    CODECS['br'] = (brotli_compress, 4)
+if zstandard is not None:
+    CODECS['zstd'] = (zstd_compress, 3)
+
+
+## Compresses responses after the view, with the encoding the client prefers
+## among COMPRESSION_ENCODINGS (br and zstd only when brotli / zstandard are installed).
+## Responses smaller than COMPRESSION_MIN_SIZE, of other types than COMPRESSION_MIMETYPES,
+## already encoded, or streamed (send_file, ?stream=1 timelines) are sent as they are.
+## Compressed bodies of responses with an ETag, that aren't private or no-store, are cached
+## by (url, ETag, encoding), so a popular response is compressed once per version.
+## The ETag of a compressed response is made weak: the encodings are equivalent, not identical.
+class Compressor:
+    def __init__(self, config):
+        self.encodings = [encoding for encoding in config.get('COMPRESSION_ENCODINGS', ('br', 'zstd', 'gzip'))
+                          if encoding in CODECS]
+        self.levels = config.get('COMPRESSION_LEVELS', {})
+        self.min_size = config.get('COMPRESSION_MIN_SIZE', 1024)
+        self.mimetypes = set(config.get('COMPRESSION_MIMETYPES', ('application/json', 'text/html', 'text/plain')))
+        self.cache = TTLCache(config.get('COMPRESSION_CACHE_SIZE', 256),
+                              config.get('COMPRESSION_CACHE_TTL', 300))
+        self.lock = threading.Lock()
+        self.counters = {encoding: {
+            'responses': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'cpu_seconds': 0.0,
+            'cache_hits': 0
+        } for encoding in self.encodings}
+        self.skipped_small = 0
+
+    def attach(self, app):
+        app.after_request(self.compress_response)
+
+        return self
+
+    def compress_response(self, response):
+        if not self.encodings or not self.compressible(response):
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            with self.lock:
+                self.skipped_small += 1
+            return response
+
+        etag, _ = response.get_etag()
+        cache_key = None
+        if etag is not None and self.cacheable(response):
+            cache_key = (request.full_path, etag, encoding)
+
+        compressed = self.cache.get(cache_key) if cache_key is not None else None
+        cache_hit = compressed is not None
+        if not cache_hit:
+            compressed = self.compress(encoding, data)
+            if cache_key is not None:
+                self.cache.put(cache_key, compressed)
+
+        with self.lock:
+            self.counters[encoding]['responses'] += 1
+            self.counters[encoding]['cache_hits'] += cache_hit
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+
+        return response
+
+    def compressible(self, response):
+        return (200 <= response.status_code < 300
+                and response.status_code != 204
+                and not response.direct_passthrough
+                and not response.is_streamed
+                and 'Content-Encoding' not in response.headers
+                and response.mimetype in self.mimetypes)
+
+    @staticmethod
+    def cacheable(response):
+        cache_control = response.cache_control
+        return not (cache_control.no_store or cache_control.private)
+
+    def compress(self, encoding, data):
+        compress, default_level = CODECS[encoding]
+
+        start = time.thread_time()
+        compressed = compress(data, self.levels.get(encoding, default_level))
+        cpu_seconds = time.thread_time() - start
+
+        with self.lock:
+            counters = self.counters[encoding]
+            counters['bytes_in'] += len(data)
+            counters['bytes_out'] += len(compressed)
+            counters['cpu_seconds'] += cpu_seconds
+
+        return compressed
+
+    ## The same counters for RequestMetrics.add_collector
+    def metrics(self):
+        stats = self.stats()['encodings']
+        return [
+            (f'http_compression_{name}_total', 'counter', description,
+             [({'encoding': encoding}, counters[key]) for encoding, counters in stats.items()])
+            for name, key, description in (
+                ('responses', 'responses', 'Compressed responses.'),
+                ('cache_hits', 'cache_hits', 'Compressed responses served from the cache.'),
+                ('bytes_in', 'bytes_in', 'Bytes before compression.'),
+                ('bytes_out', 'bytes_out', 'Bytes after compression.'),
+                ('cpu_seconds', 'cpu_seconds', 'Thread CPU time spent compressing.'))
+        ]
+
+    ## Per encoding: compressed responses and how many of them came from the cache, then
+    ## bytes before/after and CPU time of the compressions actually run (thread CPU time,
+    ## so time spent waiting for the GIL isn't counted).
+    def stats(self):
+        with self.lock:
+            return {
+                'encodings': {encoding: dict(counters) for encoding, counters in self.counters.items()},
+                'skipped_small': self.skipped_small
+            }
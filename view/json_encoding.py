@@ -0,0 +1,47 @@
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+## Default Json encoder is not able to transform set to JSON.
+## By writing Custom Json Encoder, change 'set' to 'list'
+class CustomJSONEcoder(JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, set):
+            return list(obj)
+
+        return JSONEncoder.default(self, obj)
+
+
+## Same output as CustomJSONEcoder, encoded by orjson (C backed, several times faster
+## on timeline sized payloads). Types orjson doesn't know (set, and date/dataclass so
+## they keep Flask's format) go through default(). Anything orjson can't encode, and
+## indents other than 2, fall back to the stdlib encoder.
+class OrjsonEncoder(CustomJSONEcoder):
+    def encode(self, obj):
+        option = (orjson.OPT_NON_STR_KEYS
+                  | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent is not None:
+            if self.indent != 2:
+                return super().encode(obj)
+            option |= orjson.OPT_INDENT_2
+
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return super().encode(obj)
+
+
+## Encoder class for the JSON_ENCODER config value: 'orjson' when it's installed,
+## 'json' (the stdlib encoder) otherwise.
+def json_encoder_class(name='orjson'):
+    if name == 'orjson' and orjson is not None:
+        return OrjsonEncoder
+
+    return CustomJSONEcoder
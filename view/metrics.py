@@ -0,0 +1,248 @@
+import bisect
+import threading
+import time
+
+from flask import g, request
+
+## Prometheus' default latency buckets, in seconds
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+## SQL statements per request
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+## Counters of the requests served by one thread. Only that thread writes to it,
+## so recording a request takes no lock; RequestMetrics adds the shards up on scrape.
+class MetricsShard:
+    def __init__(self, bucket_count, query_bucket_count=len(QUERY_BUCKETS)):
+        self.thread = threading.current_thread()
+        self.bucket_count = bucket_count
+        self.query_bucket_count = query_bucket_count
+        ## (method, route, status) -> count
+        self.requests = {}
+        ## (method, route) -> [count per bucket..., count above the last bucket, sum of seconds]
+        self.latency = {}
+        ## (method, route) -> [count per bucket..., count above the last bucket, sum of statements]
+        self.queries = {}
+        ## (method, route) -> count
+        self.started = {}
+        self.finished = {}
+        ## (method, route) -> [count, sum of bytes]
+        self.request_bytes = {}
+        self.response_bytes = {}
+
+    ## Adds the counts of `other` to this shard. The owner thread of `other` may be
+    ## recording meanwhile, so its dicts are copied first (list() of a dict view runs
+    ## without releasing the GIL). A scrape can count a request in some metrics only.
+    def merge(self, other):
+        for key, count in list(other.requests.items()):
+            self.requests[key] = self.requests.get(key, 0) + count
+        for histograms, other_histograms, bucket_count in (
+                (self.latency, other.latency, self.bucket_count),
+                (self.queries, other.queries, self.query_bucket_count)):
+            for key, values in list(other_histograms.items()):
+                totals = histograms.setdefault(key, [0] * (bucket_count + 1) + [0])
+                for i, value in enumerate(list(values)):
+                    totals[i] += value
+        for counts, other_counts in ((self.started, other.started), (self.finished, other.finished)):
+            for key, count in list(other_counts.items()):
+                counts[key] = counts.get(key, 0) + count
+        for sizes, other_sizes in ((self.request_bytes, other.request_bytes),
+                                   (self.response_bytes, other.response_bytes)):
+            for key, (count, total) in list(other_sizes.items()):
+                size = sizes.setdefault(key, [0, 0])
+                size[0] += count
+                size[1] += total
+
+
+## Per route request metrics, recorded by before/after/teardown request hooks
+## and rendered in the Prometheus text format by /metrics:
+##   http_requests_total{method, route, status}, http_request_duration_seconds{method, route},
+##   http_requests_in_flight{method, route}, http_request_size_bytes / http_response_size_bytes.
+## route is the URL rule ("/timeline/<int:user_id>"), so the number of series stays bounded.
+## Latency is measured up to the response object: the body of a streamed response isn't included.
+## Shards of threads that ended are folded into `retired` so they don't pile up.
+## With a model.database.QueryStats, the SQL statements each request ran are counted too
+## (http_request_queries{method, route}), and sent in X-Query-Count with query_count_header.
+class RequestMetrics:
+    def __init__(self, latency_buckets=None, query_stats=None, query_count_header=False):
+        self.buckets = tuple(sorted(latency_buckets or DEFAULT_LATENCY_BUCKETS))
+        self.query_stats = query_stats
+        self.query_count_header = query_count_header
+        self.local = threading.local()
+        self.shards = []
+        self.retired = MetricsShard(len(self.buckets))
+        self.lock = threading.Lock()
+        self.collectors = []
+
+    def attach(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+        return self
+
+    ## Also render `collector()`, a list of (name, type, help, [(labels, value), ...]).
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = MetricsShard(len(self.buckets))
+            with self.lock:
+                self._retire_dead_shards()
+                self.shards.append(shard)
+
+        return shard
+
+    @staticmethod
+    def route_key():
+        rule = request.url_rule
+        return request.method, rule.rule if rule is not None else '<unmatched>'
+
+    def before_request(self):
+        key = self.route_key()
+        started = self.shard().started
+        started[key] = started.get(key, 0) + 1
+        if self.query_stats is not None:
+            self.query_stats.start_request()
+        g.metrics_start = time.perf_counter()
+
+    def after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+
+        duration = time.perf_counter() - start
+        method, route = key = self.route_key()
+        shard = self.shard()
+
+        request_key = (method, route, response.status_code)
+        shard.requests[request_key] = shard.requests.get(request_key, 0) + 1
+
+        self.observe(shard.latency, key, self.buckets, duration)
+        
+        if self.query_stats is not None:
+            queries, _ = self.query_stats.request_queries()
+            self.observe(shard.queries, key, QUERY_BUCKETS, queries)
+            if self.query_count_header:
+                response.headers['X-Query-Count'] = str(queries)
+
+        for sizes, size in ((shard.request_bytes, request.content_length),
+                            (shard.response_bytes, response.calculate_content_length())):
+            if size is None:
+                continue
+            counts = sizes.get(key)
+            if counts is None:
+                counts = sizes[key] = [0, 0]
+            counts[0] += 1
+            counts[1] += size
+
+        return response
+
+    @staticmethod
+    def observe(histograms, key, buckets, value):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(buckets) + 1) + [0]
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def teardown_request(self, exception=None):
+        if g.get('metrics_start') is None:
+            return
+
+        key = self.route_key()
+        finished = self.shard().finished
+        finished[key] = finished.get(key, 0) + 1
+
+    def _retire_dead_shards(self):
+        alive = []
+        for shard in self.shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self.retired.merge(shard)
+        self.shards = alive
+
+    def collect(self):
+        total = MetricsShard(len(self.buckets))
+        with self.lock:
+            self._retire_dead_shards()
+            total.merge(self.retired)
+            for shard in self.shards:
+                total.merge(shard)
+
+        return total
+
+    def render(self):
+        total = self.collect()
+        lines = []
+
+        lines += [
+            '# HELP http_requests_total Requests served, by method, route and status.',
+            '# TYPE http_requests_total counter'
+        ]
+        for (method, route, status), count in sorted(total.requests.items()):
+            lines.append(f'http_requests_total{labels(method=method, route=route, status=status)} {count}')
+
+        lines += histogram_lines('http_request_duration_seconds', 'Time to produce the response, by method and route.',
+                                 self.buckets, total.latency)
+        lines += histogram_lines('http_request_queries', 'SQL statements run per request, by method and route.',
+                                 QUERY_BUCKETS, total.queries)
+
+        lines += [
+            '# HELP http_requests_in_flight Requests being served, by method and route.',
+            '# TYPE http_requests_in_flight gauge'
+        ]
+        for key, started in sorted(total.started.items()):
+            method, route = key
+            lines.append(f'http_requests_in_flight{labels(method=method, route=route)} '
+                         f'{started - total.finished.get(key, 0)}')
+
+        for name, description, sizes in (
+                ('http_request_size_bytes', 'Request body sizes', total.request_bytes),
+                ('http_response_size_bytes', 'Response body sizes, as sent', total.response_bytes)):
+            lines += [
+                f'# HELP {name} {description}, by method and route.',
+                f'# TYPE {name} summary'
+            ]
+            for (method, route), (count, size) in sorted(sizes.items()):
+                lines.append(f'{name}_sum{labels(method=method, route=route)} {size}')
+                lines.append(f'{name}_count{labels(method=method, route=route)} {count}')
+
+        for collector in self.collectors:
+            for name, metric_type, description, samples in collector():
+                lines += [
+                    f'# HELP {name} {description}',
+                    f'# TYPE {name} {metric_type}'
+                ]
+                for sample_labels, value in samples:
+                    lines.append(f'{name}{labels(**sample_labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def histogram_lines(name, description, buckets, histograms):
+    lines = [
+        f'# HELP {name} {description}',
+        f'# TYPE {name} histogram'
+    ]
+    for (method, route), values in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(buckets + ('+Inf',), values):
+            cumulative += count
+            lines.append(f'{name}_bucket{labels(method=method, route=route, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{labels(method=method, route=route)} {values[-1]}')
+        lines.append(f'{name}_count{labels(method=method, route=route)} {cumulative}')
+
+    return lines
+
+def labels(**values):
+    if not values:
+        return ''
+
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in values.items()) + '}'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
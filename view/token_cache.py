@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+## Bounded LRU cache of verified access tokens to their decoded payloads.
+## An entry expires after ttl seconds, and never later than the token's own 'exp',
+## so a cached token stops being accepted at the same moment jwt.decode would reject it.
+class TokenCache:
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            payload, expires_at = entry
+            if expires_at <= now:
+                del self.entries[token]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(token)
+            self.hits += 1
+            return payload
+
+    def put(self, token, payload):
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.time() + self.ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+
+        with self.lock:
+            self.entries[token] = (payload, expires_at)
+            self.entries.move_to_end(token)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }